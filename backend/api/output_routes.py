@@ -1,56 +1,98 @@
-from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, Form
+from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, Form, Response, Query
 from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
-from typing import List, Optional, Dict, Any
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Dict, Any, Tuple
+import base64
 import os
 import json
-import shutil
 from datetime import datetime
-import uuid
 
 from models.user import User
 from models.workflow import Output, OutputCreate, OutputResponse
 from database.session import get_db
 from auth.security import get_current_active_user
+from api import settings_routes
+from services.uploads import save_upload, UploadTooLarge
+from services.blob_store import blob_store, OUTPUTS_DIR
+from services.thumbnails import thumbnails
 
 router = APIRouter()
 
 # Ensure the outputs directory exists
-OUTPUTS_DIR = os.path.join("static", "outputs")
 os.makedirs(OUTPUTS_DIR, exist_ok=True)
 
+def encode_cursor(output: Output) -> str:
+    """
+    Encode the sort key of the last output on a page as an opaque cursor.
+    """
+    key = f"{output.created_at.isoformat()}|{output.id}"
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Decode a cursor from encode_cursor into (created_at, id).
+    """
+    try:
+        key = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, output_id = key.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(output_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
 @router.get("/outputs", response_model=List[OutputResponse])
 async def get_outputs(
-    skip: int = 0,
-    limit: int = 100,
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    skip: int = Query(0, ge=0),
     workflow_id: Optional[int] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
-    Get all outputs, optionally filtered by workflow ID.
+    Get outputs, newest first, optionally filtered by workflow ID.
+    
+    Pages are keyset-based on (created_at, id): pass the X-Next-Cursor
+    response header as ?cursor= to get the following page. The header is
+    absent on the last page. skip is still accepted for older clients, but
+    its cost grows with the offset.
     """
-    query = db.query(Output)
+    query = select(Output)
     
     # Filter by workflow ID if provided
     if workflow_id is not None:
         query = query.filter(Output.workflow_id == workflow_id)
     
-    # Get outputs
-    outputs = query.order_by(Output.created_at.desc()).offset(skip).limit(limit).all()
+    if cursor is not None:
+        query = query.filter(tuple_(Output.created_at, Output.id) < decode_cursor(cursor))
+    elif skip:
+        query = query.offset(skip)
+    
+    # Fetch one extra row to know whether there is a next page
+    outputs = (await db.scalars(
+        query.order_by(Output.created_at.desc(), Output.id.desc()).limit(limit + 1)
+    )).all()
+    
+    if len(outputs) > limit:
+        outputs = outputs[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(outputs[-1])
     
     return outputs
 
 @router.get("/outputs/{output_id}", response_model=OutputResponse)
 async def get_output(
     output_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Get a specific output by ID.
     """
-    output = db.query(Output).filter(Output.id == output_id).first()
+    output = await db.scalar(select(Output).filter(Output.id == output_id))
     if not output:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -65,12 +107,18 @@ async def create_output(
     file: UploadFile = File(...),
     description: Optional[str] = Form(None),
     metadata: Optional[str] = Form(None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Create a new output by uploading a file.
+    
+    Files larger than max_upload_size_mb from the app settings are rejected.
+    Oversized request bodies are already refused by UploadSizeLimitMiddleware
+    before they are parsed; the exact file size is checked while copying.
     """
+    max_size = settings_routes.app_settings.max_upload_size_mb * 1024 * 1024
+    
     # Parse metadata if provided
     metadata_dict = {}
     if metadata:
@@ -81,6 +129,11 @@ async def create_output(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Invalid metadata JSON"
             )
+        if not isinstance(metadata_dict, dict):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid metadata JSON"
+            )
     
     # Determine file type based on content type
     file_type = "unknown"
@@ -89,43 +142,62 @@ async def create_output(
     elif file.content_type.startswith("video/"):
         file_type = "video"
     
-    # Generate a unique filename
+    # Stream the file to disk, hashing it on the way
+    temp_path = blob_store.temp_path()
+    try:
+        file_size, content_hash = await save_upload(file, temp_path, max_size)
+    except UploadTooLarge:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File is larger than {settings_routes.app_settings.max_upload_size_mb} MB"
+        )
+    
+    # Identical files share one blob named after their content
     file_extension = os.path.splitext(file.filename)[1]
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    
-    # Save the file
-    file_path = os.path.join(OUTPUTS_DIR, unique_filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    # Create output record in database
-    db_output = Output(
-        workflow_id=workflow_id,
-        user_id=current_user.id,
-        filename=unique_filename,
-        original_filename=file.filename,
-        file_type=file_type,
-        file_size=os.path.getsize(file_path),
-        description=description,
-        metadata=metadata_dict
-    )
+    blob_name = blob_store.blob_name(content_hash, file_extension)
+    
+    async with blob_store.lock(db, blob_name):
+        await blob_store.store(temp_path, content_hash, file_extension)
+        
+        # Create output record in database
+        db_output = Output(
+            workflow_id=workflow_id,
+            user_id=current_user.id,
+            filename=blob_name,
+            original_filename=file.filename,
+            file_type=file_type,
+            file_size=file_size,
+            content_hash=content_hash,
+            description=description,
+            output_metadata=metadata_dict
+        )
+        
+        db.add(db_output)
+        try:
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            await blob_store.release(db, blob_name)
+            await db.commit()
+            raise
+    
+    await db.refresh(db_output)
     
-    db.add(db_output)
-    db.commit()
-    db.refresh(db_output)
+    # Have the gallery thumbnails ready before anyone asks for them
+    thumbnails.schedule(db_output.filename, db_output.file_type)
     
     return db_output
 
 @router.delete("/outputs/{output_id}", response_model=OutputResponse)
 async def delete_output(
     output_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Delete a specific output by ID.
     """
-    output = db.query(Output).filter(Output.id == output_id).first()
+    output = await db.scalar(select(Output).filter(Output.id == output_id))
     if not output:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -139,34 +211,33 @@ async def delete_output(
             detail="Not enough permissions"
         )
     
-    # Delete the file
-    file_path = os.path.join(OUTPUTS_DIR, output.filename)
-    if os.path.exists(file_path):
-        os.remove(file_path)
-    
-    # Delete from database
-    db.delete(output)
-    db.commit()
+    # Delete from database, then the blob if no other output shares it
+    async with blob_store.lock(db, output.filename):
+        await db.delete(output)
+        await db.commit()
+        if await blob_store.release(db, output.filename):
+            thumbnails.remove(output.filename)
+        await db.commit()
     
     return output
 
 @router.get("/outputs/{output_id}/download")
 async def download_output(
     output_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Download a specific output file by ID.
     """
-    output = db.query(Output).filter(Output.id == output_id).first()
+    output = await db.scalar(select(Output).filter(Output.id == output_id))
     if not output:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Output not found"
         )
     
-    file_path = os.path.join(OUTPUTS_DIR, output.filename)
+    file_path = blob_store.path(output.filename)
     if not os.path.exists(file_path):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -178,3 +249,49 @@ async def download_output(
         filename=output.original_filename,
         media_type=f"{'image' if output.file_type == 'image' else 'video'}/{os.path.splitext(output.filename)[1][1:]}"
     )
+
+@router.get("/outputs/{output_id}/thumbnail")
+async def get_output_thumbnail(
+    output_id: int,
+    size: int = 256,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get a WebP thumbnail of an output, or of a video output's poster frame.
+    
+    Like the files under /static, thumbnails are public so they can be used
+    directly as image sources. Missing thumbnails are generated on request.
+    """
+    if size not in thumbnails.sizes:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Size must be one of {', '.join(str(size) for size in thumbnails.sizes)}"
+        )
+    
+    output = await db.scalar(select(Output).filter(Output.id == output_id))
+    if not output:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Output not found"
+        )
+    
+    if not thumbnails.supports(output.file_type) or not os.path.exists(blob_store.path(output.filename)):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No thumbnail available for this output"
+        )
+    
+    try:
+        path = await thumbnails.get(output.filename, output.file_type, size)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error generating thumbnail: {str(e)}"
+        )
+    
+    # Blob names are content hashes, so a thumbnail never changes
+    return FileResponse(
+        path=path,
+        media_type="image/webp",
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
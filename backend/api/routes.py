@@ -1,33 +1,52 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response, Query
+from sqlalchemy import select, type_coerce, func, literal_column, null, union_all
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import defer
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
-import json
-import os
 from datetime import datetime
 
 from database.session import get_db
 from models.user import User
-from models.workflow import Workflow, Output
+from models.workflow import (
+    Workflow,
+    WorkflowVersion,
+    Output,
+    count_nodes,
+    node_types,
+    SEARCH_CONFIG,
+    workflow_search_document,
+    output_search_document,
+)
+from models.prompt import PromptRecord
 from auth.security import get_current_active_user
 from api.schemas import (
     WorkflowCreate,
     WorkflowUpdate,
     WorkflowResponse,
-    OutputCreate,
-    OutputResponse,
+    WorkflowSummary,
+    WorkflowVersionSummary,
+    WorkflowVersionResponse,
     ComfyUIPrompt,
     ComfyUIResponse,
+    PromptHistoryPage,
+    SearchPage,
 )
-from services.comfyui_service import ComfyUIService
+from services.comfyui_service import comfyui_service
+from services.prompt_tracker import prompt_tracker, format_outputs
+from services.prompt_queue import prompt_dispatcher, QueueFull
+from services.prompt_cache import prompt_cache, prompt_hash
+from services.workflow_sync import workflow_sync
+from services.workflow_versions import workflow_versions, VersionNotFound
+from services.object_info_cache import object_info_cache, accepts_gzip
 
 router = APIRouter()
-comfyui_service = ComfyUIService(os.environ.get("COMFYUI_API_URL", "http://comfyui:8188/"))
 
 # Workflow endpoints
 @router.post("/workflows", response_model=WorkflowResponse)
 async def create_workflow(
     workflow: WorkflowCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -37,38 +56,66 @@ async def create_workflow(
         name=workflow.name,
         description=workflow.description,
         workflow_json=workflow.workflow_json,
+        node_count=count_nodes(workflow.workflow_json),
+        node_types=node_types(workflow.workflow_json),
+        tags=workflow.tags,
+        is_public=workflow.is_public,
+        is_template=workflow.is_template,
         creator_id=current_user.id
     )
     
     db.add(db_workflow)
-    db.commit()
-    db.refresh(db_workflow)
+    await db.flush()
+    await workflow_versions.record(db, db_workflow.id, db_workflow.workflow_json, current_user.id)
+    await db.commit()
+    await db.refresh(db_workflow)
     
     return db_workflow
 
-@router.get("/workflows", response_model=List[WorkflowResponse])
+@router.get("/workflows", response_model=List[WorkflowSummary])
 async def read_workflows(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    tag: Optional[List[str]] = Query(None),
+    uses_node: Optional[List[str]] = Query(None),
+    is_template: Optional[bool] = None,
+    is_public: Optional[bool] = None,
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
-    Get all workflows.
+    Get all workflows, without their graphs.
+    
+    tag and uses_node can be repeated; a workflow must have every tag and
+    use every node type given. Use GET /workflows/{workflow_id} to load a
+    workflow's graph.
     """
-    workflows = db.query(Workflow).offset(skip).limit(limit).all()
+    # The graph can be hundreds of KB per row; never load it for a listing
+    query = select(Workflow).options(defer(Workflow.workflow_json, raiseload=True))
+    
+    # JSONB containment (@>), answered by the GIN indexes on tags and node_types
+    if tag:
+        query = query.filter(type_coerce(Workflow.tags, JSONB).contains(tag))
+    if uses_node:
+        query = query.filter(type_coerce(Workflow.node_types, JSONB).contains(uses_node))
+    if is_template is not None:
+        query = query.filter(Workflow.is_template == is_template)
+    if is_public is not None:
+        query = query.filter(Workflow.is_public == is_public)
+    
+    workflows = (await db.scalars(query.order_by(Workflow.id).offset(skip).limit(limit))).all()
     return workflows
 
 @router.get("/workflows/{workflow_id}", response_model=WorkflowResponse)
 async def read_workflow(
     workflow_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Get a specific workflow.
     """
-    workflow = db.query(Workflow).filter(Workflow.id == workflow_id).first()
+    workflow = await db.scalar(select(Workflow).filter(Workflow.id == workflow_id))
     
     if workflow is None:
         raise HTTPException(
@@ -82,13 +129,14 @@ async def read_workflow(
 async def update_workflow(
     workflow_id: int,
     workflow_update: WorkflowUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Update a workflow.
     """
-    db_workflow = db.query(Workflow).filter(Workflow.id == workflow_id).first()
+    # The row lock numbers versions in order across workers until the commit
+    db_workflow = await db.scalar(select(Workflow).filter(Workflow.id == workflow_id).with_for_update())
     
     if db_workflow is None:
         raise HTTPException(
@@ -102,24 +150,50 @@ async def update_workflow(
     if workflow_update.description is not None:
         db_workflow.description = workflow_update.description
     
+    previous_json = db_workflow.workflow_json
+    
     if workflow_update.workflow_json is not None:
         db_workflow.workflow_json = workflow_update.workflow_json
+        db_workflow.node_count = count_nodes(workflow_update.workflow_json)
+        db_workflow.node_types = node_types(workflow_update.workflow_json)
+    
+    if workflow_update.tags is not None:
+        db_workflow.tags = workflow_update.tags
+    
+    if workflow_update.is_public is not None:
+        db_workflow.is_public = workflow_update.is_public
     
-    db.commit()
-    db.refresh(db_workflow)
+    if workflow_update.is_template is not None:
+        db_workflow.is_template = workflow_update.is_template
+    
+    async with workflow_versions.lock(workflow_id):
+        if workflow_update.workflow_json is not None:
+            await workflow_versions.record(
+                db,
+                workflow_id,
+                workflow_update.workflow_json,
+                current_user.id,
+                previous=previous_json
+            )
+        await db.commit()
+    await db.refresh(db_workflow)
+    
+    # Keep the live copy used by collaborative editing in line with the save
+    if workflow_update.workflow_json is not None:
+        await workflow_sync.replace(str(workflow_id), db_workflow.workflow_json)
     
     return db_workflow
 
 @router.delete("/workflows/{workflow_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_workflow(
     workflow_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Delete a workflow.
     """
-    db_workflow = db.query(Workflow).filter(Workflow.id == workflow_id).first()
+    db_workflow = await db.scalar(select(Workflow).filter(Workflow.id == workflow_id))
     
     if db_workflow is None:
         raise HTTPException(
@@ -134,113 +208,168 @@ async def delete_workflow(
             detail="Not authorized to delete this workflow"
         )
     
-    db.delete(db_workflow)
-    db.commit()
+    await workflow_versions.delete(db, workflow_id)
+    await db.delete(db_workflow)
+    await db.commit()
     
     return None
 
-# Output endpoints
-@router.post("/outputs", response_model=OutputResponse)
-async def create_output(
-    output: OutputCreate,
-    db: Session = Depends(get_db),
+@router.get("/workflows/{workflow_id}/versions", response_model=List[WorkflowVersionSummary])
+async def list_workflow_versions(
+    workflow_id: int,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
-    Create a new output record.
+    Get the saved versions of a workflow, newest first.
+    
+    Pass the oldest version number returned as ?before= to get the next page.
     """
-    # Check if workflow exists
-    workflow = db.query(Workflow).filter(Workflow.id == output.workflow_id).first()
-    if workflow is None:
+    if await db.scalar(select(Workflow.id).filter(Workflow.id == workflow_id)) is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Workflow not found"
         )
     
-    db_output = Output(
-        filename=output.filename,
-        file_path=output.file_path,
-        file_type=output.file_type,
-        metadata=output.metadata,
-        workflow_id=output.workflow_id,
-        creator_id=current_user.id
-    )
+    query = select(
+        WorkflowVersion.version,
+        WorkflowVersion.is_keyframe,
+        WorkflowVersion.user_id,
+        WorkflowVersion.created_at
+    ).filter(WorkflowVersion.workflow_id == workflow_id)
+    
+    if before is not None:
+        query = query.filter(WorkflowVersion.version < before)
     
-    db.add(db_output)
-    db.commit()
-    db.refresh(db_output)
+    versions = (await db.execute(query.order_by(WorkflowVersion.version.desc()).limit(limit))).all()
     
-    return db_output
+    return [version._asdict() for version in versions]
 
-@router.get("/outputs", response_model=List[OutputResponse])
-async def read_outputs(
-    workflow_id: Optional[int] = None,
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db),
+@router.get("/workflows/{workflow_id}/versions/{version}", response_model=WorkflowVersionResponse)
+async def read_workflow_version(
+    workflow_id: int,
+    version: int,
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
-    Get all outputs, optionally filtered by workflow.
+    Get the workflow JSON of a saved version.
     """
-    query = db.query(Output)
+    try:
+        workflow_json = await workflow_versions.get(db, workflow_id, version)
+    except VersionNotFound:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Version not found"
+        )
     
-    if workflow_id is not None:
-        query = query.filter(Output.workflow_id == workflow_id)
+    record = (await db.execute(
+        select(WorkflowVersion.is_keyframe, WorkflowVersion.user_id, WorkflowVersion.created_at)
+        .filter(WorkflowVersion.workflow_id == workflow_id, WorkflowVersion.version == version)
+    )).one()
     
-    outputs = query.offset(skip).limit(limit).all()
-    return outputs
+    return {"version": version, **record._asdict(), "workflow_json": workflow_json}
 
-@router.get("/outputs/{output_id}", response_model=OutputResponse)
-async def read_output(
-    output_id: int,
-    db: Session = Depends(get_db),
+@router.post("/workflows/{workflow_id}/versions/{version}/restore", response_model=WorkflowResponse)
+async def restore_workflow_version(
+    workflow_id: int,
+    version: int,
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
-    Get a specific output.
+    Make a saved version the current workflow.
+    
+    The history is append-only, so the restored JSON is saved as a new
+    version.
     """
-    output = db.query(Output).filter(Output.id == output_id).first()
+    # The row lock numbers versions in order across workers until the commit
+    db_workflow = await db.scalar(select(Workflow).filter(Workflow.id == workflow_id).with_for_update())
     
-    if output is None:
+    if db_workflow is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="Output not found"
+            detail="Workflow not found"
         )
     
-    return output
+    async with workflow_versions.lock(workflow_id):
+        try:
+            workflow_json = await workflow_versions.get(db, workflow_id, version)
+        except VersionNotFound:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Version not found"
+            )
+        
+        db_workflow.workflow_json = workflow_json
+        db_workflow.node_count = count_nodes(workflow_json)
+        db_workflow.node_types = node_types(workflow_json)
+        await workflow_versions.record(db, workflow_id, workflow_json, current_user.id)
+        await db.commit()
+    await db.refresh(db_workflow)
+    
+    await workflow_sync.replace(str(workflow_id), db_workflow.workflow_json)
+    
+    return db_workflow
 
 # ComfyUI integration endpoints
 @router.post("/comfyui/prompt", response_model=ComfyUIResponse)
 async def queue_prompt(
     prompt_data: ComfyUIPrompt,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Queue a prompt in ComfyUI.
+    
+    Prompts wait in a per-user fair queue and are sent to ComfyUI as
+    capacity frees up; admins' prompts go first. If an identical prompt
+    already completed, its outputs are returned without running it again;
+    if one is still waiting or running, the caller shares it. use_cache=false
+    always queues a new run.
     """
-    try:
-        # Send prompt to ComfyUI
-        response = await comfyui_service.queue_prompt(prompt_data.prompt)
-        prompt_id = response.get("prompt_id")
-        
-        # If workflow_id is provided, save the output when it's ready
-        if prompt_data.workflow_id is not None:
-            # This would be handled by a background task in a real implementation
-            pass
-        
-        return {
-            "prompt_id": prompt_id,
-            "status": "queued",
-            "outputs": None
-        }
+    key = prompt_hash(prompt_data.prompt)
     
-    except Exception as e:
+    if prompt_data.use_cache:
+        cached = prompt_cache.get(key)
+        if cached is not None:
+            return {
+                "prompt_id": cached["prompt_id"],
+                "status": "completed",
+                "outputs": format_outputs(cached["outputs"]),
+                "cached": True
+            }
+    
+    try:
+        prompt_id = prompt_dispatcher.submit(
+            prompt_data.prompt,
+            current_user.username,
+            prompt_data.workflow_id,
+            priority=current_user.role == "admin",
+            prompt_hash=key,
+            coalesce=prompt_data.use_cache
+        )
+    except QueueFull as e:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error queuing prompt: {str(e)}"
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e)
         )
+    
+    # Progress and completion are pushed to the user over Socket.IO. If
+    # workflow_id is provided, the output ingestion worker saves the
+    # produced files as outputs once the tracker sees the prompt complete.
+    # An identical unfinished prompt may have been shared instead, in
+    # which case it can already be running.
+    state = prompt_tracker.get(prompt_id)
+    
+    return {
+        "prompt_id": prompt_id,
+        "status": state["status"],
+        "outputs": None,
+        "position": prompt_dispatcher.position(prompt_id)
+    }
 
 @router.get("/comfyui/prompt/{prompt_id}", response_model=ComfyUIResponse)
 async def get_prompt_status(
@@ -250,14 +379,24 @@ async def get_prompt_status(
     """
     Get the status of a queued prompt.
     """
+    # Prompts tracked over the ComfyUI websocket are answered from memory
+    state = prompt_tracker.get(prompt_id)
+    if state is not None:
+        return {
+            "prompt_id": prompt_id,
+            "status": state["status"],
+            "outputs": format_outputs(state["outputs"]) if state["status"] == "completed" else None,
+            "position": prompt_dispatcher.position(prompt_id) if state["status"] == "pending" else None
+        }
+    
     try:
-        # Get prompt status from ComfyUI
+        # Fall back to ComfyUI's history for prompts we are not tracking
         response = await comfyui_service.get_prompt_status(prompt_id)
         
         return {
             "prompt_id": prompt_id,
             "status": response.get("status", "unknown"),
-            "outputs": response.get("outputs")
+            "outputs": format_outputs(response.get("outputs"))
         }
     
     except Exception as e:
@@ -266,18 +405,222 @@ async def get_prompt_status(
             detail=f"Error getting prompt status: {str(e)}"
         )
 
-@router.get("/comfyui/history")
-async def get_history(current_user: User = Depends(get_current_active_user)):
+@router.get("/comfyui/prompt-cache/stats")
+async def get_prompt_cache_stats(current_user: User = Depends(get_current_active_user)):
     """
-    Get ComfyUI history.
+    Get prompt result cache statistics. Only accessible by admins.
+    """
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    
+    return prompt_cache.stats()
+
+@router.get("/comfyui/backends")
+async def get_backends(current_user: User = Depends(get_current_active_user)):
+    """
+    Get the health and queue depth of each ComfyUI backend. Only accessible by admins.
+    """
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    
+    return comfyui_service.nodes_status()
+
+@router.get("/comfyui/history", response_model=PromptHistoryPage)
+async def get_history(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    user_id: Optional[int] = None,
+    workflow_id: Optional[int] = None,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Get finished prompts, newest first, from the mirrored ComfyUI history.
+    
+    Pages are cursor-based: pass the returned next_cursor to get the
+    following page. since/until filter on the time the prompt finished.
+    """
+    query = select(PromptRecord)
+    
+    if cursor is not None:
+        if not cursor.isdigit():
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+        query = query.filter(PromptRecord.id < int(cursor))
+    
+    if user_id is not None:
+        query = query.filter(PromptRecord.user_id == user_id)
+    if workflow_id is not None:
+        query = query.filter(PromptRecord.workflow_id == workflow_id)
+    if status_filter is not None:
+        query = query.filter(PromptRecord.status == status_filter)
+    if since is not None:
+        query = query.filter(PromptRecord.finished_at >= since)
+    if until is not None:
+        query = query.filter(PromptRecord.finished_at < until)
+    
+    # Fetch one extra row to know whether there is a next page
+    records = (await db.scalars(query.order_by(PromptRecord.id.desc()).limit(limit + 1))).all()
+    has_more = len(records) > limit
+    records = records[:limit]
+    
+    return {
+        "items": [
+            {
+                "id": record.id,
+                "prompt_id": record.prompt_id,
+                "user_id": record.user_id,
+                "workflow_id": record.workflow_id,
+                "status": record.status,
+                "outputs": format_outputs(record.outputs),
+                "error": record.error,
+                "queued_at": record.queued_at,
+                "finished_at": record.finished_at,
+                "created_at": record.created_at,
+            }
+            for record in records
+        ],
+        "next_cursor": str(records[-1].id) if has_more else None
+    }
+
+@router.get("/comfyui/object_info")
+async def get_object_info(
+    request: Request,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Get ComfyUI's node catalogue from the cache.
+    
+    The response carries a strong ETag and is served gzip-compressed to
+    clients that accept it; a matching If-None-Match gets a 304.
     """
     try:
-        # Get history from ComfyUI
-        history = await comfyui_service.get_history()
-        return history
+        cache = await object_info_cache.get()
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error getting object info: {str(e)}"
+        )
     
+    # The gzipped bytes are a different representation, so they get their own tag
+    use_gzip = accepts_gzip(request.headers.get("accept-encoding", ""))
+    etag = f'"{cache.etag}-gzip"' if use_gzip else f'"{cache.etag}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=cache.gzip_body, media_type="application/json", headers=headers)
+    
+    return Response(content=cache.body, media_type="application/json", headers=headers)
+
+@router.post("/comfyui/object_info/refresh")
+async def refresh_object_info(current_user: User = Depends(get_current_active_user)):
+    """
+    Download ComfyUI's node catalogue again, e.g. after installing models. Only accessible by admins.
+    """
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    
+    try:
+        await object_info_cache.refresh(force=True)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error getting history: {str(e)}"
+            detail=f"Error refreshing object info: {str(e)}"
         )
+    
+    return {"etag": object_info_cache.etag, "updated_at": object_info_cache.updated_at}
+
+# Search endpoints
+@router.get("/search", response_model=SearchPage)
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    kind: Optional[str] = Query(None, pattern="^(workflow|output)$"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Full-text search over workflows and outputs, best matches first.
+    
+    Workflows are matched on name, description and tags, outputs on file
+    name, description and metadata. q accepts web search syntax: quoted
+    phrases, "or" and -excluded words. Pass kind to search only one of
+    them. Every match has to be ranked before sorting, so paging is by
+    offset.
+    """
+    if db.bind.dialect.name != "postgresql":
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Search requires PostgreSQL"
+        )
+    
+    query = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+    
+    # Matching with @@ on the indexed documents is answered by their GIN indexes
+    searches = []
+    if kind in (None, "workflow"):
+        searches.append(
+            select(
+                literal_column("'workflow'").label("kind"),
+                Workflow.id,
+                Workflow.name.label("title"),
+                Workflow.description,
+                Workflow.id.label("workflow_id"),
+                null().label("file_type"),
+                Workflow.created_at,
+                func.ts_rank(workflow_search_document, query).label("rank")
+            ).filter(workflow_search_document.op("@@")(query))
+        )
+    if kind in (None, "output"):
+        searches.append(
+            select(
+                literal_column("'output'").label("kind"),
+                Output.id,
+                Output.original_filename.label("title"),
+                Output.description,
+                Output.workflow_id,
+                Output.file_type,
+                Output.created_at,
+                func.ts_rank(output_search_document, query).label("rank")
+            ).filter(output_search_document.op("@@")(query))
+        )
+    
+    results = union_all(*searches).subquery()
+    
+    # Fetch one extra row to know whether there is a next page
+    rows = (await db.execute(
+        select(results)
+        .order_by(results.c.rank.desc(), results.c.created_at.desc(), results.c.kind, results.c.id.desc())
+        .offset(offset)
+        .limit(limit + 1)
+    )).all()
+    has_more = len(rows) > limit
+    
+    return {
+        "items": [row._asdict() for row in rows[:limit]],
+        "next_offset": offset + limit if has_more else None
+    }
@@ -8,22 +8,57 @@ class WorkflowBase(BaseModel):
     workflow_json: Dict[str, Any]
 
 class WorkflowCreate(WorkflowBase):
-    pass
+    tags: Optional[List[str]] = None
+    is_public: bool = False
+    is_template: bool = False
 
 class WorkflowUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
     workflow_json: Optional[Dict[str, Any]] = None
+    tags: Optional[List[str]] = None
+    is_public: Optional[bool] = None
+    is_template: Optional[bool] = None
 
 class WorkflowResponse(WorkflowBase):
     id: int
     creator_id: int
+    tags: Optional[List[str]] = None
+    is_public: Optional[bool] = None
+    is_template: Optional[bool] = None
     created_at: datetime
     updated_at: Optional[datetime] = None
     
     class Config:
         orm_mode = True
 
+class WorkflowSummary(BaseModel):
+    """A workflow without its graph, for listings."""
+    id: int
+    name: str
+    description: Optional[str] = None
+    tags: Optional[List[str]] = None
+    creator_id: int
+    is_public: Optional[bool] = None
+    is_template: Optional[bool] = None
+    node_count: Optional[int] = None
+    node_types: Optional[List[str]] = None
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+    
+    class Config:
+        orm_mode = True
+
+class WorkflowVersionSummary(BaseModel):
+    version: int
+    # True if the version is stored in full rather than as a patch
+    is_keyframe: bool
+    user_id: Optional[int] = None
+    created_at: Optional[datetime] = None
+
+class WorkflowVersionResponse(WorkflowVersionSummary):
+    workflow_json: Dict[str, Any]
+
 class OutputBase(BaseModel):
     filename: str
     file_path: str
@@ -45,8 +80,49 @@ class OutputResponse(OutputBase):
 class ComfyUIPrompt(BaseModel):
     prompt: Dict[str, Any]
     workflow_id: Optional[int] = None
+    # Set to False to run the prompt even if an identical one already
+    # completed or is waiting or running
+    use_cache: bool = True
 
 class ComfyUIResponse(BaseModel):
     prompt_id: str
     status: str
     outputs: Optional[List[Dict[str, Any]]] = None
+    # Place in the dispatch queue while the prompt is pending
+    position: Optional[int] = None
+    # True if the outputs of an earlier identical prompt were returned
+    cached: bool = False
+
+class PromptHistoryItem(BaseModel):
+    id: int
+    prompt_id: str
+    user_id: Optional[int] = None
+    workflow_id: Optional[int] = None
+    status: str
+    outputs: Optional[List[Dict[str, Any]]] = None
+    error: Optional[str] = None
+    queued_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+
+class PromptHistoryPage(BaseModel):
+    items: List[PromptHistoryItem]
+    # Pass as ?cursor= to get the next (older) page; None on the last page
+    next_cursor: Optional[str] = None
+
+class SearchResult(BaseModel):
+    kind: str  # workflow or output
+    id: int
+    # Workflow name, or the output's original file name
+    title: Optional[str] = None
+    description: Optional[str] = None
+    # The output's workflow; for workflows, the workflow itself
+    workflow_id: Optional[int] = None
+    file_type: Optional[str] = None
+    created_at: Optional[datetime] = None
+    rank: float
+
+class SearchPage(BaseModel):
+    items: List[SearchResult]
+    # Pass as ?offset= to get the next page; None on the last page
+    next_offset: Optional[int] = None
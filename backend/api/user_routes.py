@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 
 from models.user import User, UserCreate, UserUpdate, UserResponse
 from database.session import get_db
 from auth.security import get_current_active_user, get_password_hash, verify_password
+from auth.user_cache import user_cache
 
 router = APIRouter()
 
@@ -12,7 +14,7 @@ router = APIRouter()
 async def get_users(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -24,7 +26,7 @@ async def get_users(
             detail="Not enough permissions"
         )
     
-    users = db.query(User).offset(skip).limit(limit).all()
+    users = (await db.scalars(select(User).offset(skip).limit(limit))).all()
     return users
 
 @router.get("/users/me", response_model=UserResponse)
@@ -34,18 +36,33 @@ async def get_current_user(current_user: User = Depends(get_current_active_user)
     """
     return current_user
 
+@router.get("/users/cache-stats")
+async def get_user_cache_stats(current_user: User = Depends(get_current_active_user)):
+    """
+    Get authenticated-user cache statistics. Only accessible by admins.
+    """
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    
+    return user_cache.stats()
+
 @router.put("/users/me", response_model=UserResponse)
 async def update_current_user(
     user_update: UserUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Update current user information.
     """
+    previous_username = current_user.username
+    
     # Check if email is already taken
     if user_update.email and user_update.email != current_user.email:
-        db_user = db.query(User).filter(User.email == user_update.email).first()
+        db_user = await db.scalar(select(User).filter(User.email == user_update.email))
         if db_user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -73,15 +90,17 @@ async def update_current_user(
     if user_update.color is not None:
         current_user.color = user_update.color
     
-    db.commit()
-    db.refresh(current_user)
+    await db.commit()
+    await db.refresh(current_user)
+    
+    user_cache.invalidate(previous_username, current_user.username)
     
     return current_user
 
 @router.post("/users", response_model=UserResponse)
 async def create_user(
     user_create: UserCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -94,7 +113,7 @@ async def create_user(
         )
     
     # Check if username is already taken
-    db_user = db.query(User).filter(User.username == user_create.username).first()
+    db_user = await db.scalar(select(User).filter(User.username == user_create.username))
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -102,7 +121,7 @@ async def create_user(
         )
     
     # Check if email is already taken
-    db_user = db.query(User).filter(User.email == user_create.email).first()
+    db_user = await db.scalar(select(User).filter(User.email == user_create.email))
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -120,15 +139,15 @@ async def create_user(
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     
     return db_user
 
 @router.get("/users/{user_id}", response_model=UserResponse)
 async def get_user(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -140,7 +159,7 @@ async def get_user(
             detail="Not enough permissions"
         )
     
-    db_user = db.query(User).filter(User.id == user_id).first()
+    db_user = await db.scalar(select(User).filter(User.id == user_id))
     if not db_user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -153,7 +172,7 @@ async def get_user(
 async def update_user(
     user_id: int,
     user_update: UserUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -165,16 +184,18 @@ async def update_user(
             detail="Not enough permissions"
         )
     
-    db_user = db.query(User).filter(User.id == user_id).first()
+    db_user = await db.scalar(select(User).filter(User.id == user_id))
     if not db_user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
     
+    previous_username = db_user.username
+    
     # Check if email is already taken
     if user_update.email and user_update.email != db_user.email:
-        email_exists = db.query(User).filter(User.email == user_update.email).first()
+        email_exists = await db.scalar(select(User).filter(User.email == user_update.email))
         if email_exists:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -194,8 +215,10 @@ async def update_user(
     if user_update.color is not None:
         db_user.color = user_update.color
     
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    
+    user_cache.invalidate(previous_username, db_user.username)
     
     return db_user
 
@@ -203,7 +226,7 @@ async def update_user(
 async def reset_user_password(
     user_id: int,
     password_reset: dict,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -215,7 +238,7 @@ async def reset_user_password(
             detail="Not enough permissions"
         )
     
-    db_user = db.query(User).filter(User.id == user_id).first()
+    db_user = await db.scalar(select(User).filter(User.id == user_id))
     if not db_user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -231,15 +254,17 @@ async def reset_user_password(
     # Update password
     db_user.hashed_password = get_password_hash(password_reset["password"])
     
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    
+    user_cache.invalidate(db_user.username)
     
     return db_user
 
 @router.put("/users/{user_id}/toggle-active", response_model=UserResponse)
 async def toggle_user_active(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -251,7 +276,7 @@ async def toggle_user_active(
             detail="Not enough permissions"
         )
     
-    db_user = db.query(User).filter(User.id == user_id).first()
+    db_user = await db.scalar(select(User).filter(User.id == user_id))
     if not db_user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -261,15 +286,17 @@ async def toggle_user_active(
     # Toggle active status
     db_user.is_active = not db_user.is_active
     
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    
+    user_cache.invalidate(db_user.username)
     
     return db_user
 
 @router.delete("/users/{user_id}", response_model=UserResponse)
 async def delete_user(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -281,7 +308,7 @@ async def delete_user(
             detail="Not enough permissions"
         )
     
-    db_user = db.query(User).filter(User.id == user_id).first()
+    db_user = await db.scalar(select(User).filter(User.id == user_id))
     if not db_user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -289,7 +316,9 @@ async def delete_user(
         )
     
     # Delete user
-    db.delete(db_user)
-    db.commit()
+    await db.delete(db_user)
+    await db.commit()
+    
+    user_cache.invalidate(db_user.username)
     
     return db_user
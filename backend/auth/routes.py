@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta, datetime
 from typing import List
 
@@ -13,6 +14,7 @@ from auth.security import (
     get_current_active_user,
     ACCESS_TOKEN_EXPIRE_MINUTES,
 )
+from auth.user_cache import user_cache
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -25,12 +27,12 @@ class Token(BaseModel):
 @router.post("/token", response_model=Token)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get an access token for a user.
     """
-    user = db.query(User).filter(User.username == form_data.username).first()
+    user = await db.scalar(select(User).filter(User.username == form_data.username))
     
     if not user or not verify_password(form_data.password, user.hashed_password):
         raise HTTPException(
@@ -48,8 +50,8 @@ async def login_for_access_token(
     
     # Update last login time
     user.last_login = datetime.utcnow()
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -66,13 +68,13 @@ async def login_for_access_token(
 @router.post("/register", response_model=UserResponse)
 async def register_user(
     user_create: UserCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Register a new user.
     """
     # Check if username already exists
-    db_user = db.query(User).filter(User.username == user_create.username).first()
+    db_user = await db.scalar(select(User).filter(User.username == user_create.username))
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -81,7 +83,7 @@ async def register_user(
     
     # Check if email already exists
     if user_create.email:
-        db_user = db.query(User).filter(User.email == user_create.email).first()
+        db_user = await db.scalar(select(User).filter(User.email == user_create.email))
         if db_user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -98,15 +100,15 @@ async def register_user(
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     
     return db_user
 
 @router.post("/users", response_model=UserResponse)
 async def create_user(
     user_create: UserCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -119,7 +121,7 @@ async def create_user(
         )
     
     # Check if username already exists
-    db_user = db.query(User).filter(User.username == user_create.username).first()
+    db_user = await db.scalar(select(User).filter(User.username == user_create.username))
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -138,8 +140,8 @@ async def create_user(
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     
     return db_user
 
@@ -147,13 +149,13 @@ async def create_user(
 async def read_users(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Get all users.
     """
-    users = db.query(User).offset(skip).limit(limit).all()
+    users = (await db.scalars(select(User).offset(skip).limit(limit))).all()
     return users
 
 @router.get("/users/me", response_model=UserResponse)
@@ -167,14 +169,14 @@ async def read_users_me(current_user: User = Depends(get_current_active_user)):
 async def update_user(
     user_id: int,
     user_update: UserUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Update a user (admin only or self).
     """
     # Check if user exists
-    db_user = db.query(User).filter(User.id == user_id).first()
+    db_user = await db.scalar(select(User).filter(User.id == user_id))
     if not db_user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -188,6 +190,8 @@ async def update_user(
             detail="Not authorized to update this user"
         )
     
+    previous_username = db_user.username
+    
     # Update user
     if user_update.display_name is not None:
         db_user.display_name = user_update.display_name
@@ -205,7 +209,9 @@ async def update_user(
     if current_user.role == "admin" and user_update.role is not None:
         db_user.role = user_update.role
     
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    
+    user_cache.invalidate(previous_username, db_user.username)
     
     return db_user
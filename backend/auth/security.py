@@ -5,9 +5,12 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from database.session import get_db
 from models.user import User
+from services.last_seen import last_seen
+from auth.user_cache import user_cache
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -42,7 +45,16 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def get_token_subject(token: str) -> Optional[str]:
+    """Get the username from a JWT token, or None if the token is invalid."""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    
+    return payload.get("sub")
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     """Get the current user from a JWT token."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -60,18 +72,28 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     except JWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.username == username).first()
+    cached_user = user_cache.get(username)
     
-    if user is None:
-        raise credentials_exception
+    if cached_user is None:
+        user = await db.scalar(select(User).filter(User.username == username))
+        
+        if user is None:
+            raise credentials_exception
+        
+        # Cache a detached copy so later requests can skip the lookup
+        db.expunge(user)
+        user_cache.set(username, user)
+        cached_user = user
+    
+    # Attach a copy to this request's session without querying the database
+    user = await db.merge(cached_user, load=False)
     
-    # Update last_login time
-    user.last_login = datetime.utcnow()
-    db.commit()
+    # Record activity; last_login is written in periodic batches
+    last_seen.touch(user.id)
     
     return user
 
-def get_current_active_user(current_user: User = Depends(get_current_user)):
+async def get_current_active_user(current_user: User = Depends(get_current_user)):
     """Get the current active user."""
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
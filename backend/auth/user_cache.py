@@ -0,0 +1,92 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from models.user import User
+
+# Cache configuration
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "1024"))
+# Each worker has its own cache and invalidations only reach the worker that
+# made the change, so other workers can serve a stale user for up to this long
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "10"))
+
+class UserCache:
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        """
+        LRU cache of authenticated users keyed by JWT subject (the username).
+
+        Cached users are detached from any session; callers merge them into
+        their own session before use. The cache is per process: a change
+        made through one worker is seen by the others only once their
+        entry expires, so ttl bounds how long e.g. a deactivated user stays
+        signed in elsewhere.
+
+        Args:
+            max_size: Maximum number of cached users.
+            ttl: Seconds a cached user stays valid.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, User]]" = OrderedDict()
+
+    def get(self, username: str) -> Optional[User]:
+        """
+        Get a cached user, or None if it is missing or expired.
+        """
+        entry = self._entries.get(username)
+
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[username]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(username)
+        self.hits += 1
+
+        return entry[1]
+
+    def set(self, username: str, user: User):
+        """
+        Cache a detached user.
+        """
+        self._entries[username] = (time.monotonic() + self.ttl, user)
+        self._entries.move_to_end(username)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, *usernames: str):
+        """
+        Drop users from the cache after their role, status or credentials
+        change. Pass both the old and the new username of a renamed user.
+        """
+        for username in usernames:
+            self._entries.pop(username, None)
+
+    def clear(self):
+        """
+        Drop all cached users.
+        """
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Get the cache size and hit/miss counters.
+        """
+        lookups = self.hits + self.misses
+
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+# Shared cache instance used by the whole application
+user_cache = UserCache()
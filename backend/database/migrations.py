@@ -0,0 +1,118 @@
+import json
+
+from sqlalchemy import inspect, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.engine import Engine
+
+from models.workflow import count_nodes, node_types, SEARCH_INDEXES
+
+# Columns added to existing tables after they were first created: (table, column, type)
+ADDED_COLUMNS = [
+    ("prompt_history", "prompt_hash", "VARCHAR"),
+    ("outputs", "content_hash", "VARCHAR(64)"),
+    ("workflows", "node_count", "INTEGER"),
+    ("workflows", "node_types", "JSON"),
+]
+
+# JSON columns stored as JSONB on PostgreSQL: (table, column)
+JSONB_COLUMNS = [
+    ("workflows", "workflow_json"),
+    ("workflows", "tags"),
+    ("workflows", "node_types"),
+]
+
+# Indexes added to existing tables: (name, table, columns)
+ADDED_INDEXES = [
+    ("ix_prompt_history_prompt_hash", "prompt_history", "prompt_hash"),
+    ("ix_outputs_content_hash", "outputs", "content_hash"),
+    ("ix_outputs_created_at_id", "outputs", "created_at, id"),
+    ("ix_outputs_workflow_id_created_at_id", "outputs", "workflow_id, created_at, id"),
+    ("ix_outputs_user_id_created_at_id", "outputs", "user_id, created_at, id"),
+    ("ix_workflows_is_public", "workflows", "is_public"),
+    ("ix_workflows_is_template", "workflows", "is_template"),
+]
+
+# GIN indexes for containment queries on JSONB columns, PostgreSQL only: (name, table, column)
+GIN_INDEXES = [
+    ("ix_workflows_tags", "workflows", "tags"),
+    ("ix_workflows_node_types", "workflows", "node_types"),
+]
+
+def run_migrations(engine: Engine):
+    """
+    Bring tables created by an older version up to date.
+
+    create_all only creates missing tables, so columns and indexes added to
+    existing tables are applied here. Every step checks before it changes
+    anything, so this is safe to run on each startup.
+    """
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        tables = set(inspector.get_table_names())
+
+        for table, column, column_type in ADDED_COLUMNS:
+            if table not in tables:
+                continue
+
+            columns = {existing["name"] for existing in inspector.get_columns(table)}
+            if column not in columns:
+                connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+
+        for name, table, columns in ADDED_INDEXES:
+            if table in tables:
+                connection.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+        if connection.dialect.name == "postgresql":
+            migrate_jsonb(connection, tables)
+
+            # Full-text search indexes, built on the JSONB columns above
+            for index in SEARCH_INDEXES:
+                if index.table.name in tables:
+                    index.create(connection, checkfirst=True)
+
+        if "workflows" in tables:
+            backfill_workflow_summaries(connection)
+
+def migrate_jsonb(connection, tables):
+    """
+    Convert JSON columns to JSONB and add their GIN indexes.
+    """
+    inspector = inspect(connection)
+
+    for table, column in JSONB_COLUMNS:
+        if table not in tables:
+            continue
+
+        column_types = {existing["name"]: existing["type"] for existing in inspector.get_columns(table)}
+        if not isinstance(column_types.get(column), JSONB):
+            connection.execute(text(
+                f"ALTER TABLE {table} ALTER COLUMN {column} TYPE JSONB USING {column}::jsonb"
+            ))
+
+    for name, table, column in GIN_INDEXES:
+        if table in tables:
+            connection.execute(text(
+                f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin ({column} jsonb_path_ops)"
+            ))
+
+def backfill_workflow_summaries(connection):
+    """
+    Fill in the node counts and node types of workflows saved before those
+    columns existed.
+    """
+    rows = connection.execute(text(
+        "SELECT id, workflow_json FROM workflows WHERE node_count IS NULL OR node_types IS NULL"
+    )).all()
+    for workflow_id, workflow_json in rows:
+        # Drivers without native JSON support return the raw text
+        if isinstance(workflow_json, str):
+            workflow_json = json.loads(workflow_json)
+
+        connection.execute(
+            text("UPDATE workflows SET node_count = :node_count, node_types = :node_types WHERE id = :id"),
+            {
+                "node_count": count_nodes(workflow_json),
+                "node_types": json.dumps(node_types(workflow_json)),
+                "id": workflow_id
+            }
+        )
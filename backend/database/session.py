@@ -1,12 +1,9 @@
-from database.db import SessionLocal
+from database.db import AsyncSessionLocal
 
-def get_db():
+async def get_db():
     """
-    Dependency to get a database session.
+    Dependency to get an async database session.
     Yields a database session and ensures it's closed after use.
     """
-    db = SessionLocal()
-    try:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -1,8 +1,7 @@
 import os
 import sys
 from sqlalchemy.orm import Session
-from database.db import engine, Base
-from database.session import get_db
+from database.db import engine, Base, SessionLocal
 from models.user import User
 from auth.security import get_password_hash
 
@@ -14,7 +13,7 @@ def init_db():
     Base.metadata.create_all(bind=engine)
     
     # Get database session
-    db = next(get_db())
+    db = SessionLocal()
     
     try:
         # Check if admin user already exists
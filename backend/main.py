@@ -1,4 +1,3 @@
-import os
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -9,20 +8,45 @@ from typing import List, Optional
 from api.routes import router as api_router
 from auth.routes import router as auth_router
 from api.user_routes import router as user_router
+from api import settings_routes
 from api.settings_routes import router as settings_router
 from api.output_routes import router as output_router
-from database.db import engine, Base
-from database.session import get_db
+from sqlalchemy import select
+
+from database.db import engine, Base, AsyncSessionLocal
+from database.migrations import run_migrations
 from models.user import User
 from models.workflow import Workflow
-from services.comfyui_service import ComfyUIService
+from services.comfyui_service import comfyui_service
+from services.prompt_tracker import prompt_tracker, user_room
+from services.output_ingestion import output_ingestion
+from services.prompt_queue import prompt_dispatcher
+from services.object_info_cache import object_info_cache
+from services.history_mirror import history_mirror
+from services.prompt_cache import prompt_cache
+from services.thumbnails import thumbnails
+from services.last_seen import last_seen
+from services.presence import presence, workflow_room, REDIS_URL
+from services.cursor_batcher import cursor_batcher
+from services.workflow_sync import workflow_sync, WorkflowNotFound, PatchRejected
+from services.uploads import UploadSizeLimitMiddleware
+from auth.security import get_token_subject
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
+# Add columns and indexes introduced since the tables were created
+run_migrations(engine)
 
 # Create FastAPI app
 app = FastAPI(title="Collaborative ComfyUI API")
 
+# Refuse oversized uploads before their body is parsed
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    paths=["/api/outputs"],
+    max_size=lambda: settings_routes.app_settings.max_upload_size_mb * 1024 * 1024,
+)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -30,14 +54,25 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Cursor of the next page of list endpoints
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Share Socket.IO events between workers through Redis when it is configured
+client_manager = socketio.AsyncRedisManager(REDIS_URL) if REDIS_URL else None
+
 # Create Socket.IO server
 sio = socketio.AsyncServer(
     async_mode='asgi',
+    client_manager=client_manager,
     cors_allowed_origins=["*"]  # In production, replace with specific origins
 )
-socket_app = socketio.ASGIApp(sio)
+# The app is mounted at /socket.io, which Starlette strips from the path
+socket_app = socketio.ASGIApp(sio, socketio_path="/")
+prompt_tracker.attach(sio)
+output_ingestion.attach(sio)
+cursor_batcher.attach(sio)
+workflow_sync.attach(sio)
 
 # Include routers
 app.include_router(auth_router, prefix="/auth", tags=["Authentication"])
@@ -52,32 +87,231 @@ app.mount("/socket.io", socket_app)
 # Mount static files directory for serving outputs
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Create ComfyUI service
-comfyui_service = ComfyUIService(os.environ.get("COMFYUI_API_URL", "http://comfyui:8188/"))
+# Application lifecycle
+@app.on_event("startup")
+async def startup():
+    # Open the shared, pooled HTTP session to ComfyUI
+    await comfyui_service.start()
+    # Listen for prompt progress on the ComfyUI websocket
+    await prompt_tracker.start()
+    # Feed queued prompts to ComfyUI, taking turns between users
+    await prompt_dispatcher.start()
+    # Save the files of finished prompts as outputs
+    await output_ingestion.start()
+    # Write user activity to last_login in batches
+    await last_seen.start()
+    # Send coalesced cursor positions on a fixed tick
+    await cursor_batcher.start()
+    # Keep a compressed copy of ComfyUI's node catalogue for editor page loads
+    await object_info_cache.start()
+    # Mirror ComfyUI's history into the database for paginated queries
+    await history_mirror.start()
+    # Index recent results so identical prompts can skip the GPU
+    await prompt_cache.load()
+    # Worker processes that render output thumbnails
+    await thumbnails.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await history_mirror.stop()
+    await object_info_cache.stop()
+    await prompt_dispatcher.stop()
+    await prompt_tracker.stop()
+    await output_ingestion.stop()
+    await last_seen.stop()
+    await cursor_batcher.stop()
+    # Save workflows that still have unsaved collaborative edits
+    await workflow_sync.close_all()
+    # Remove this worker's sessions from the shared presence state
+    await presence.close()
+    await thumbnails.stop()
+    await comfyui_service.close()
 
 # Socket.IO events
 @sio.event
-async def connect(sid, environ):
-    print(f"Client connected: {sid}")
+async def connect(sid, environ, auth=None):
+    # Authenticate with the JWT the frontend passes in the handshake
+    username = get_token_subject((auth or {}).get("token") or "")
+    if username is None:
+        raise socketio.exceptions.ConnectionRefusedError("Authentication failed")
+    
+    async with AsyncSessionLocal() as db:
+        user = await db.scalar(select(User).filter(User.username == username))
+    
+    if user is None or not user.is_active:
+        raise socketio.exceptions.ConnectionRefusedError("Authentication failed")
+    
+    await sio.save_session(sid, {
+        "username": user.username,
+        "user": {
+            "userId": user.id,
+            "username": user.username,
+            "displayName": user.display_name,
+            "color": user.color,
+        }
+    })
+    
+    # Join the per-user room that prompt updates are sent to
+    await sio.enter_room(sid, user_room(username))
+    print(f"Client connected: {sid} ({username})")
 
 @sio.event
 async def disconnect(sid):
+    session = await sio.get_session(sid)
+    
+    # Drop the session from every workflow it was editing
+    for workflow_id in await presence.leave_all(sid):
+        await workflow_left(workflow_id, session["user"])
+    
     print(f"Client disconnected: {sid}")
 
+async def broadcast_presence(workflow_id):
+    """Send the list of users editing a workflow to everyone in its room."""
+    await sio.emit(
+        'users',
+        await presence.members(workflow_id),
+        room=workflow_room(workflow_id)
+    )
+
+async def workflow_left(workflow_id, user):
+    """Clean up after a session left a workflow room."""
+    cursor_batcher.discard(workflow_id, user["userId"])
+    
+    members = await presence.members(workflow_id)
+    if members:
+        await broadcast_presence(workflow_id)
+    
+    if not presence.has_local_sessions(workflow_id):
+        # Nobody on this worker is editing the workflow any more
+        await workflow_sync.close(workflow_id, edited_elsewhere=bool(members))
+
+async def broadcast_to_workflows(sid, event, data):
+    """Relay an event to the other sessions editing the sender's workflows."""
+    for workflow_id in await presence.workflows_of(sid):
+        await sio.emit(event, data, room=workflow_room(workflow_id), skip_sid=sid)
+
+@sio.event
+async def join_workflow(sid, data):
+    workflow_id = str((data or {}).get("workflowId") or "")
+    if not workflow_id:
+        return {"error": "workflowId is required"}
+    
+    session = await sio.get_session(sid)
+    
+    try:
+        snapshot = await workflow_sync.open(workflow_id)
+    except WorkflowNotFound:
+        return {"error": "Workflow not found"}
+    
+    # A session edits one workflow at a time
+    for previous_id in await presence.workflows_of(sid):
+        if previous_id != workflow_id:
+            await leave_workflow(sid, {"workflowId": previous_id})
+    
+    await sio.enter_room(sid, workflow_room(workflow_id))
+    await presence.join(sid, workflow_id, session["user"])
+    await broadcast_presence(workflow_id)
+    
+    # The joining client starts from a full snapshot of the live document
+    return {**snapshot, "users": await presence.members(workflow_id)}
+
+@sio.event
+async def leave_workflow(sid, data):
+    workflow_id = str((data or {}).get("workflowId") or "")
+    
+    await sio.leave_room(sid, workflow_room(workflow_id))
+    if await presence.leave(sid, workflow_id):
+        session = await sio.get_session(sid)
+        await workflow_left(workflow_id, session["user"])
+
 @sio.event
 async def cursor_move(sid, data):
-    # Broadcast cursor position to all clients except sender
-    await sio.emit('cursor_update', data, skip_sid=sid)
+    # Cursor positions are coalesced and sent to the workflow room in batches
+    workflow_ids = await presence.workflows_of(sid)
+    if not workflow_ids:
+        return
+    
+    session = await sio.get_session(sid)
+    for workflow_id in workflow_ids:
+        cursor_batcher.update(workflow_id, session["user"], data.get("x"), data.get("y"))
 
 @sio.event
 async def node_select(sid, data):
-    # Broadcast node selection to all clients except sender
-    await sio.emit('node_update', data, skip_sid=sid)
+    # Broadcast node selection to the other editors of the workflow
+    await broadcast_to_workflows(sid, 'node_update', data)
+
+@sio.event
+async def workflow_patch(sid, data):
+    # Apply a JSON Patch to the live document and relay it to the other editors
+    workflow_id = str((data or {}).get("workflowId") or "")
+    if not await presence.is_member(sid, workflow_id):
+        return {"error": "Not editing this workflow"}
+    
+    operations = data.get("ops") or []
+    base_version = data.get("baseVersion")
+    
+    try:
+        version = await workflow_sync.apply(
+            workflow_id,
+            None if base_version is None else int(base_version),
+            operations
+        )
+    except (PatchRejected, TypeError, ValueError) as e:
+        # The client has to resync from the authoritative copy
+        return {"error": str(e), "snapshot": await workflow_sync.snapshot(workflow_id)}
+    
+    session = await sio.get_session(sid)
+    await sio.emit(
+        'workflow_change',
+        {
+            "workflowId": workflow_id,
+            "version": version,
+            "ops": operations,
+            "userId": session["user"]["userId"],
+            "username": session["user"]["username"],
+        },
+        room=workflow_room(workflow_id),
+        skip_sid=sid
+    )
+    
+    return {"version": version}
+
+@sio.event
+async def sync_workflow(sid, data):
+    # Send a lagging client the patches it missed, or a snapshot if they are gone
+    workflow_id = str((data or {}).get("workflowId") or "")
+    if not await presence.is_member(sid, workflow_id):
+        return {"error": "Not editing this workflow"}
+    
+    version = data.get("version")
+    patches = await workflow_sync.operations_since(workflow_id, version) if isinstance(version, int) else None
+    
+    if patches is None:
+        return {"snapshot": await workflow_sync.snapshot(workflow_id)}
+    
+    return {
+        "workflowId": workflow_id,
+        "version": patches[-1]["version"] if patches else version,
+        "patches": patches
+    }
 
 @sio.event
 async def workflow_update(sid, data):
-    # Broadcast workflow changes to all clients except sender
-    await sio.emit('workflow_change', data, skip_sid=sid)
+    # Older clients send the whole workflow; treat it as a root replace patch
+    workflow_data = (data or {}).get("workflowData") if isinstance(data, dict) else None
+    
+    for workflow_id in await presence.workflows_of(sid):
+        if not isinstance(workflow_data, dict):
+            # Nothing is applied; the sender starts over from the live copy
+            return {"error": "workflowData must be a JSON object", "snapshot": await workflow_sync.snapshot(workflow_id)}
+        
+        # Without a base version the replace applies to the current version
+        result = await workflow_patch(sid, {
+            "workflowId": workflow_id,
+            "ops": [{"op": "replace", "path": "", "value": workflow_data}],
+        })
+        if "error" in result:
+            return result
 
 # Root endpoint
 @app.get("/")
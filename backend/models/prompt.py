@@ -0,0 +1,29 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON, Index
+from sqlalchemy.sql import func
+
+from database.db import Base
+
+class PromptRecord(Base):
+    """A finished ComfyUI prompt, mirrored from the prompt tracker and ComfyUI's history."""
+    __tablename__ = "prompt_history"
+
+    id = Column(Integer, primary_key=True, index=True)
+    prompt_id = Column(String, unique=True, index=True, nullable=False)
+    # Unknown for prompts queued directly in ComfyUI
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    workflow_id = Column(Integer, ForeignKey("workflows.id", ondelete="SET NULL"), nullable=True)
+    # Canonical hash of the prompt graph, for prompts queued through the backend
+    prompt_hash = Column(String, nullable=True, index=True)
+    status = Column(String, nullable=False)  # completed, error, interrupted
+    outputs = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+    queued_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        # Newest-first pages, optionally narrowed to a user or workflow
+        Index("ix_prompt_history_user_id_id", "user_id", "id"),
+        Index("ix_prompt_history_workflow_id_id", "workflow_id", "id"),
+        Index("ix_prompt_history_finished_at", "finished_at"),
+    )
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON, BigInteger, Boolean
-from sqlalchemy.sql import func
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON, BigInteger, Boolean, Index, UniqueConstraint
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql import func, text
 from sqlalchemy.orm import relationship
 from pydantic import BaseModel, Field, validator
 from typing import Optional, Dict, Any, List
@@ -7,17 +8,51 @@ from datetime import datetime
 
 from database.db import Base
 
+# JSONB on PostgreSQL, so the column can be queried through a GIN index
+JSONDocument = JSON().with_variant(JSONB(), "postgresql")
+
+def count_nodes(workflow_json: Optional[Dict[str, Any]]) -> int:
+    """
+    Count the nodes of a workflow in ComfyUI's UI format ({"nodes": [...]})
+    or API format ({node_id: {"class_type": ...}}).
+    """
+    if not isinstance(workflow_json, dict):
+        return 0
+
+    if isinstance(workflow_json.get("nodes"), list):
+        return len(workflow_json["nodes"])
+
+    return sum(1 for node in workflow_json.values() if isinstance(node, dict) and "class_type" in node)
+
+def node_types(workflow_json: Optional[Dict[str, Any]]) -> List[str]:
+    """
+    Get the sorted, distinct node types used by a workflow in ComfyUI's UI
+    or API format.
+    """
+    if not isinstance(workflow_json, dict):
+        return []
+
+    if isinstance(workflow_json.get("nodes"), list):
+        types = (node.get("type") for node in workflow_json["nodes"] if isinstance(node, dict))
+    else:
+        types = (node.get("class_type") for node in workflow_json.values() if isinstance(node, dict))
+
+    return sorted({node_type for node_type in types if isinstance(node_type, str)})
+
 class Workflow(Base):
     __tablename__ = "workflows"
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
     description = Column(Text, nullable=True)
-    workflow_json = Column(JSON, nullable=False)
+    workflow_json = Column(JSONDocument, nullable=False)
+    # Kept in step with workflow_json so listings don't have to load it
+    node_count = Column(Integer, nullable=True)
+    node_types = Column(JSONDocument, nullable=True)
     creator_id = Column(Integer, ForeignKey("users.id"))
-    is_public = Column(Boolean, default=False)
-    is_template = Column(Boolean, default=False)
-    tags = Column(JSON, nullable=True)
+    is_public = Column(Boolean, default=False, index=True)
+    is_template = Column(Boolean, default=False, index=True)
+    tags = Column(JSONDocument, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
@@ -25,6 +60,34 @@ class Workflow(Base):
     creator = relationship("User", backref="workflows")
     outputs = relationship("Output", back_populates="workflow")
 
+    __table_args__ = (
+        # Containment (@>) lookups by tag and by node type
+        Index("ix_workflows_tags", "tags", postgresql_using="gin", postgresql_ops={"tags": "jsonb_path_ops"}),
+        Index("ix_workflows_node_types", "node_types", postgresql_using="gin", postgresql_ops={"node_types": "jsonb_path_ops"}),
+    )
+
+class WorkflowVersion(Base):
+    """
+    One saved version of a workflow. Versions are append-only: a keyframe
+    stores the full workflow JSON, and the versions after it store the JSON
+    Patch from the version before.
+    """
+    __tablename__ = "workflow_versions"
+
+    id = Column(Integer, primary_key=True)
+    workflow_id = Column(Integer, ForeignKey("workflows.id", ondelete="CASCADE"), nullable=False)
+    # Numbered from 1 within each workflow
+    version = Column(Integer, nullable=False)
+    is_keyframe = Column(Boolean, nullable=False, default=False)
+    # The workflow JSON for keyframes, the patch operations otherwise
+    data = Column(JSONDocument, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("workflow_id", "version", name="uq_workflow_versions_workflow_id_version"),
+    )
+
 class Output(Base):
     __tablename__ = "outputs"
 
@@ -35,15 +98,66 @@ class Output(Base):
     original_filename = Column(String, nullable=True)
     file_type = Column(String, nullable=False)  # image, video, etc.
     file_size = Column(BigInteger, nullable=False)
+    # SHA-256 of the file; outputs with the same content share one stored blob
+    content_hash = Column(String(64), nullable=True, index=True)
     description = Column(Text, nullable=True)
-    metadata = Column(JSON, nullable=True)
+    # "metadata" is reserved by the declarative API, so map the column under another attribute
+    output_metadata = Column("metadata", JSON, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
     workflow = relationship("Workflow", back_populates="outputs")
     user = relationship("User", backref="outputs")
 
-# Pydantic models for API
+    __table_args__ = (
+        # Newest-first gallery pages, optionally narrowed to a workflow or user
+        Index("ix_outputs_created_at_id", "created_at", "id"),
+        Index("ix_outputs_workflow_id_created_at_id", "workflow_id", "created_at", "id"),
+        Index("ix_outputs_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
+
+# Full-text search documents. The GIN indexes below are built on these exact
+# expressions, so constants are written as literals rather than bound
+# parameters; otherwise PostgreSQL would not match queries to the indexes.
+# Constants use text() and columns the table's own columns so SQLAlchemy
+# can tell which table the indexes belong to.
+SEARCH_CONFIG = text("'english'::regconfig")
+
+def _search_text(column, weight: str):
+    return func.setweight(
+        func.to_tsvector(SEARCH_CONFIG, func.coalesce(column, text("''"))),
+        text(f"'{weight}'")
+    )
+
+def _search_json(to_tsvector, column, empty: str, weight: str):
+    # Only the string values of the JSON are indexed, not its keys
+    return func.setweight(
+        to_tsvector(
+            SEARCH_CONFIG,
+            func.coalesce(column, text(empty)),
+            text("'[\"string\"]'::jsonb")
+        ),
+        text(f"'{weight}'")
+    )
+
+workflow_search_document = (
+    _search_text(Workflow.__table__.c.name, "A")
+    .op("||")(_search_text(Workflow.__table__.c.description, "B"))
+    .op("||")(_search_json(func.jsonb_to_tsvector, Workflow.__table__.c.tags, "'[]'::jsonb", "C"))
+)
+
+output_search_document = (
+    _search_text(Output.__table__.c.original_filename, "A")
+    .op("||")(_search_text(Output.__table__.c.description, "B"))
+    .op("||")(_search_json(func.json_to_tsvector, Output.__table__.c.metadata, "'{}'::json", "C"))
+)
+
+# PostgreSQL keeps these up to date on every insert and update
+SEARCH_INDEXES = [
+    Index("ix_workflows_search", workflow_search_document, postgresql_using="gin").ddl_if(dialect="postgresql"),
+    Index("ix_outputs_search", output_search_document, postgresql_using="gin").ddl_if(dialect="postgresql"),
+]
+
 class WorkflowBase(BaseModel):
     name: str
     description: Optional[str] = None
@@ -88,8 +202,9 @@ class OutputResponse(BaseModel):
     original_filename: Optional[str]
     file_type: str
     file_size: int
+    content_hash: Optional[str] = None
     description: Optional[str]
-    metadata: Optional[Dict[str, Any]]
+    metadata: Optional[Dict[str, Any]] = Field(None, validation_alias="output_metadata")
     created_at: datetime
     
     class Config:
@@ -6,8 +6,7 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))
 
 from sqlalchemy.orm import Session
-from database.db import engine, Base
-from database.session import get_db
+from database.db import engine, Base, SessionLocal
 from models.user import User
 from auth.security import get_password_hash
 
@@ -19,7 +18,7 @@ def init_db():
     Base.metadata.create_all(bind=engine)
     
     # Get database session
-    db = next(get_db())
+    db = SessionLocal()
     
     # Check if admin user already exists
     admin_user = db.query(User).filter(User.username == "admin").first()
@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import os
+import uuid
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.workflow import Output
+
+OUTPUTS_DIR = os.path.join("static", "outputs")
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Compute the hex SHA-256 of a file. Blocking; run it in a worker thread.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+class BlobStore:
+    def __init__(self, root: str = OUTPUTS_DIR):
+        """
+        Content-addressed storage for output files.
+
+        Files are stored once per SHA-256 under two levels of sharded
+        directories (ab/cd/abcd...ext). Output rows point at their blob
+        through Output.filename, and a blob is removed once no row points
+        at it any more.
+
+        Callers hold lock(db, name) from storing a blob until the row
+        pointing at it is committed, and release() takes the same lock
+        while it counts references and removes the file, so a blob is never
+        removed under a new reference. On PostgreSQL the lock is a
+        transaction advisory lock, which also holds between workers.
+
+        Args:
+            root: Directory the blobs are stored in.
+        """
+        self.root = root
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def blob_name(self, content_hash: str, extension: str) -> str:
+        """
+        Get the path of a blob relative to the store root.
+
+        The extension is kept so the static file server sends the right
+        content type.
+        """
+        return f"{content_hash[:2]}/{content_hash[2:4]}/{content_hash}{extension.lower()}"
+
+    def path(self, name: str) -> str:
+        """
+        Get the full path of a blob.
+        """
+        return os.path.join(self.root, name)
+
+    def temp_path(self) -> str:
+        """
+        Get a fresh path to write a file to before storing it.
+        """
+        temp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(temp_dir, exist_ok=True)
+
+        return os.path.join(temp_dir, f"{uuid.uuid4()}.part")
+
+    def _local_lock(self, name: str) -> asyncio.Lock:
+        lock = self._locks.get(name)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[name] = lock
+
+        return lock
+
+    async def _lock_in_db(self, db: AsyncSession, name: str):
+        # Held until the session's transaction ends; SQLite has no
+        # equivalent, and a single process needs only the local lock
+        if db.bind.dialect.name != "postgresql":
+            return
+
+        key = int.from_bytes(hashlib.sha256(name.encode()).digest()[:8], "big", signed=True)
+        await db.execute(select(func.pg_advisory_xact_lock(key)))
+
+    @asynccontextmanager
+    async def lock(self, db: AsyncSession, name: str) -> AsyncIterator[None]:
+        """
+        Serialize reference changes to a blob across workers.
+
+        The database lock is taken in the session's current transaction
+        and released when it ends, so commit the new reference inside the
+        block.
+        """
+        async with self._local_lock(name):
+            await self._lock_in_db(db, name)
+            yield
+
+    async def store(self, temp_path: str, content_hash: str, extension: str) -> str:
+        """
+        Move a written file into the store, or drop it if the blob exists.
+
+        Returns:
+            The blob name to record in Output.filename.
+        """
+        name = self.blob_name(content_hash, extension)
+        path = self.path(name)
+
+        if os.path.exists(path):
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+
+        return name
+
+    async def release(self, db: AsyncSession, name: str) -> bool:
+        """
+        Remove a blob if no output row refers to it any more.
+
+        Takes the blob's database lock in the session's transaction, so
+        nobody can add a reference between the count and the removal. The
+        caller ends the transaction to release it.
+
+        Returns:
+            True if the blob was removed.
+        """
+        await self._lock_in_db(db, name)
+
+        references = await db.scalar(select(func.count()).select_from(Output).filter(Output.filename == name))
+        if references:
+            return False
+
+        path = self.path(name)
+        if os.path.exists(path):
+            os.remove(path)
+
+        return True
+
+    def discard(self, temp_path: Optional[str]):
+        """
+        Remove a temporary file that won't be stored.
+        """
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+# Shared store instance used by the whole application
+blob_store = BlobStore()
@@ -1,155 +1,614 @@
+import os
+import uuid
+import asyncio
+import logging
 import aiohttp
-import json
-from typing import Dict, Any, List, Optional
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Union
 
-class ComfyUIService:
+logger = logging.getLogger(__name__)
+
+# ComfyUI backends; COMFYUI_API_URLS takes a comma-separated list of nodes
+COMFYUI_API_URL = os.environ.get("COMFYUI_API_URL", "http://comfyui:8188/")
+COMFYUI_API_URLS = [
+    url.strip()
+    for url in os.environ.get("COMFYUI_API_URLS", COMFYUI_API_URL).split(",")
+    if url.strip()
+]
+# Seconds between health checks of each backend
+COMFYUI_HEALTH_INTERVAL = float(os.environ.get("COMFYUI_HEALTH_INTERVAL", "10"))
+
+# Connection pool configuration
+COMFYUI_MAX_CONNECTIONS = int(os.environ.get("COMFYUI_MAX_CONNECTIONS", "20"))
+COMFYUI_KEEPALIVE_TIMEOUT = float(os.environ.get("COMFYUI_KEEPALIVE_TIMEOUT", "30"))
+COMFYUI_REQUEST_TIMEOUT = float(os.environ.get("COMFYUI_REQUEST_TIMEOUT", "30"))
+COMFYUI_CONNECT_TIMEOUT = float(os.environ.get("COMFYUI_CONNECT_TIMEOUT", "5"))
+
+# Number of prompt -> backend assignments remembered for follow-up calls
+MAX_PROMPT_OWNERS = 10000
+
+# Errors that mean a backend is unreachable rather than rejecting a request
+CONNECTION_ERRORS = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+class NoBackendAvailable(Exception):
+    """Raised when no healthy ComfyUI backend can take a request."""
+
+class PromptIdMismatch(Exception):
+    """Raised when ComfyUI queues a prompt under a different ID than requested."""
+
+class ComfyUINode:
     def __init__(self, api_url: str):
+        """
+        A single ComfyUI backend and what the health checks know about it.
+
+        Args:
+            api_url: The URL of the backend's API.
+        """
+        self.api_url = api_url.rstrip("/")
+        # Assume a node is usable until a check or request says otherwise
+        self.healthy = True
+        self.queue_remaining = 0
+        self.last_error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "api_url": self.api_url,
+            "healthy": self.healthy,
+            "queue_remaining": self.queue_remaining,
+            "last_error": self.last_error,
+        }
+
+class ComfyUIService:
+    def __init__(
+        self,
+        api_urls: Union[str, List[str]],
+        max_connections: int = COMFYUI_MAX_CONNECTIONS,
+        keepalive_timeout: float = COMFYUI_KEEPALIVE_TIMEOUT,
+        request_timeout: float = COMFYUI_REQUEST_TIMEOUT,
+        connect_timeout: float = COMFYUI_CONNECT_TIMEOUT,
+        health_interval: float = COMFYUI_HEALTH_INTERVAL
+    ):
         """
         Initialize the ComfyUI service.
         
+        The service can spread prompts over several ComfyUI backends. New
+        prompts go to the healthy backend with the shortest queue, and
+        follow-up calls about a prompt go to the backend that ran it.
+        
         Args:
-            api_url: The URL of the ComfyUI API.
+            api_urls: The URL of the ComfyUI API, or a list of them.
+            max_connections: Maximum number of pooled connections per backend.
+            keepalive_timeout: Seconds an idle pooled connection is kept open.
+            request_timeout: Default total timeout for a single request.
+            connect_timeout: Timeout for establishing a new connection.
+            health_interval: Seconds between health checks of each backend.
         """
-        self.api_url = api_url
-        self.client_id = None
+        if isinstance(api_urls, str):
+            api_urls = [api_urls]
+        
+        self.nodes = [ComfyUINode(api_url) for api_url in api_urls]
+        # ComfyUI lets the client pick its ID; prompts queued under it report
+        # their progress on the websocket opened with the same ID.
+        self.client_id = str(uuid.uuid4())
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.request_timeout = request_timeout
+        self.connect_timeout = connect_timeout
+        self.health_interval = health_interval
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._health_task: Optional[asyncio.Task] = None
+        self._owners: "OrderedDict[str, ComfyUINode]" = OrderedDict()
     
-    async def _get_client_id(self, session: aiohttp.ClientSession) -> str:
+    async def start(self):
         """
-        Get a client ID from ComfyUI.
+        Open the shared HTTP session and start health checks. Called once on
+        application startup.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections * len(self.nodes),
+                limit_per_host=self.max_connections,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(
+                    total=self.request_timeout,
+                    connect=self.connect_timeout
+                )
+            )
+        
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.create_task(self._run_health_checks())
+    
+    async def close(self):
+        """
+        Stop health checks and close the shared HTTP session. Called once on
+        application shutdown.
+        """
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Get the shared HTTP session, opening it if startup has not run yet.
         
-        Args:
-            session: The aiohttp session.
-            
         Returns:
-            The client ID.
+            The aiohttp session.
         """
-        if self.client_id is None:
-            async with session.get(f"{self.api_url}/client_id") as response:
-                if response.status != 200:
-                    raise Exception(f"Failed to get client ID: {response.status}")
-                
-                data = await response.json()
-                self.client_id = data.get("client_id")
+        if self._session is None or self._session.closed:
+            await self.start()
+        
+        return self._session
+    
+    def _timeout(self, total: Optional[float]) -> Optional[aiohttp.ClientTimeout]:
+        """
+        Build a per-call timeout, falling back to the session default.
+        """
+        if total is None:
+            return None
+        
+        return aiohttp.ClientTimeout(total=total, connect=self.connect_timeout)
+    
+    async def _run_health_checks(self):
+        while True:
+            await asyncio.gather(*(self.check_node(node) for node in self.nodes))
+            await asyncio.sleep(self.health_interval)
+    
+    async def check_node(self, node: ComfyUINode) -> bool:
+        """
+        Check that a backend answers and refresh its queue depth.
         
-        return self.client_id
+        Returns:
+            Whether the backend is healthy.
+        """
+        try:
+            await self.system_stats(node=node)
+            queue = await self.get_queue_info(node)
+        except Exception as e:
+            if node.healthy:
+                logger.warning(f"ComfyUI backend {node.api_url} is unhealthy: {e}")
+            node.healthy = False
+            node.last_error = str(e) or type(e).__name__
+            return False
+        
+        if not node.healthy:
+            logger.info(f"ComfyUI backend {node.api_url} is healthy again")
+        node.healthy = True
+        node.last_error = None
+        node.queue_remaining = queue.get("exec_info", {}).get("queue_remaining", 0)
+        
+        return True
+    
+    def _mark_unhealthy(self, node: ComfyUINode, error: Exception):
+        logger.warning(f"ComfyUI backend {node.api_url} failed: {error}")
+        node.healthy = False
+        node.last_error = str(error) or type(error).__name__
+    
+    def _primary(self) -> ComfyUINode:
+        """
+        Get the backend for calls that any of them can answer.
+        """
+        for node in self.nodes:
+            if node.healthy:
+                return node
+        
+        raise NoBackendAvailable("No healthy ComfyUI backend available")
+    
+    def node_for(self, prompt_id: Optional[str]) -> Optional[ComfyUINode]:
+        """
+        Get the backend a prompt was queued on, if it is known.
+        """
+        if prompt_id is None:
+            return None
+        
+        return self._owners.get(prompt_id)
+    
+    def _assign(self, prompt_id: str, node: ComfyUINode):
+        self._owners[prompt_id] = node
+        self._owners.move_to_end(prompt_id)
+        while len(self._owners) > MAX_PROMPT_OWNERS:
+            self._owners.popitem(last=False)
     
-    async def queue_prompt(self, prompt: Dict[str, Any]) -> Dict[str, Any]:
+    def nodes_status(self) -> List[Dict[str, Any]]:
+        """
+        Get the health and queue depth of every backend.
+        """
+        return [node.to_dict() for node in self.nodes]
+    
+    async def queue_prompt(
+        self,
+        prompt: Dict[str, Any],
+        prompt_id: Optional[str] = None,
+        timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
         """
         Queue a prompt in ComfyUI.
         
         Args:
             prompt: The prompt to queue.
+            prompt_id: Optional ID for ComfyUI to use instead of generating one.
+            timeout: Optional timeout in seconds for this call.
             
         Returns:
             The response from ComfyUI.
+        
+        Raises:
+            NoBackendAvailable: If no backend could be reached.
+            PromptIdMismatch: If ComfyUI did not use the given prompt ID.
         """
-        async with aiohttp.ClientSession() as session:
-            client_id = await self._get_client_id(session)
+        session = await self._get_session()
+        
+        # Prepare prompt data
+        data = {
+            "prompt": prompt,
+            "client_id": self.client_id
+        }
+        if prompt_id is not None:
+            data["prompt_id"] = prompt_id
+        
+        # Shortest queue first; unreachable backends are skipped
+        candidates = sorted(
+            (node for node in self.nodes if node.healthy),
+            key=lambda node: node.queue_remaining
+        )
+        
+        for node in candidates:
+            try:
+                async with session.post(f"{node.api_url}/prompt", json=data, timeout=self._timeout(timeout)) as response:
+                    if response.status != 200:
+                        raise Exception(f"Failed to queue prompt: {response.status}")
+                    
+                    result = await response.json()
+            except CONNECTION_ERRORS as e:
+                self._mark_unhealthy(node, e)
+                continue
             
-            # Prepare prompt data
-            data = {
-                "prompt": prompt,
-                "client_id": client_id
-            }
+            # ComfyUI versions that ignore the requested ID generate their own,
+            # and the prompt could not be followed under the ID we track
+            if prompt_id is not None and result.get("prompt_id") != prompt_id:
+                await self._delete_queued(node, result.get("prompt_id"))
+                raise PromptIdMismatch(
+                    f"ComfyUI at {node.api_url} queued prompt {prompt_id} as {result.get('prompt_id')}"
+                )
             
-            # Queue prompt
-            async with session.post(f"{self.api_url}/prompt", json=data) as response:
-                if response.status != 200:
-                    raise Exception(f"Failed to queue prompt: {response.status}")
-                
-                return await response.json()
+            # Follow-up calls for this prompt go to the same backend
+            self._assign(result["prompt_id"], node)
+            node.queue_remaining += 1
+            
+            return result
+        
+        raise NoBackendAvailable("No healthy ComfyUI backend available")
     
-    async def get_prompt_status(self, prompt_id: str) -> Dict[str, Any]:
+    async def get_prompt_status(self, prompt_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
         """
         Get the status of a queued prompt.
         
         Args:
             prompt_id: The ID of the prompt.
+            timeout: Optional timeout in seconds for this call.
             
         Returns:
-            The status of the prompt.
+            The status of the prompt: "pending" while it is waiting or
+            running, "completed", "error" or "interrupted" once ComfyUI has
+            finished it, or "missing" if ComfyUI has neither queued nor
+            finished it (e.g. after a restart), along with its outputs and
+            error message.
         """
-        async with aiohttp.ClientSession() as session:
-            client_id = await self._get_client_id(session)
+        node = self.node_for(prompt_id)
+        if node is not None:
+            try:
+                return await self._get_prompt_status(node, prompt_id, timeout)
+            except CONNECTION_ERRORS as e:
+                # The prompt may still be there once the backend recovers
+                self._mark_unhealthy(node, e)
+                return {"status": "pending", "outputs": None, "error": None}
+        
+        # Prompts queued before a restart could be on any backend
+        nodes = [node for node in self.nodes if node.healthy]
+        if not nodes:
+            raise NoBackendAvailable("No healthy ComfyUI backend available")
+        
+        for node in nodes:
+            try:
+                result = await self._get_prompt_status(node, prompt_id, timeout)
+            except CONNECTION_ERRORS as e:
+                self._mark_unhealthy(node, e)
+                continue
             
-            # Get prompt status
-            async with session.get(f"{self.api_url}/history/{prompt_id}") as response:
-                if response.status != 200:
-                    raise Exception(f"Failed to get prompt status: {response.status}")
-                
-                data = await response.json()
-                
-                # Check if the prompt is completed
-                outputs = None
-                status = "pending"
-                
-                if data.get(prompt_id, {}).get("outputs"):
-                    outputs = data[prompt_id]["outputs"]
-                    status = "completed"
-                
+            if result["status"] != "missing":
+                self._assign(prompt_id, node)
+                return result
+        
+        # Only a prompt that none of the backends know is gone for certain
+        return {
+            "status": "missing" if all(node.healthy for node in self.nodes) else "pending",
+            "outputs": None,
+            "error": None
+        }
+    
+    async def _get_prompt_status(
+        self,
+        node: ComfyUINode,
+        prompt_id: str,
+        timeout: Optional[float]
+    ) -> Dict[str, Any]:
+        session = await self._get_session()
+        
+        # ComfyUI moves a finished prompt from the queue to the history at
+        # once, so checking the queue first can't miss a prompt in between
+        queue = await self.get_queue(node, timeout)
+        for item in queue.get("queue_running", []) + queue.get("queue_pending", []):
+            if len(item) > 1 and item[1] == prompt_id:
                 return {
-                    "status": status,
-                    "outputs": outputs
+                    "status": "pending",
+                    "outputs": None,
+                    "error": None
                 }
+        
+        async with session.get(f"{node.api_url}/history/{prompt_id}", timeout=self._timeout(timeout)) as response:
+            if response.status != 200:
+                raise Exception(f"Failed to get prompt status: {response.status}")
+            
+            data = await response.json()
+        
+        entry = data.get(prompt_id)
+        if entry is None:
+            return {
+                "status": "missing",
+                "outputs": None,
+                "error": None
+            }
+        
+        outputs = entry.get("outputs") or None
+        status = "completed"
+        error = None
+        
+        # Failed prompts are kept in the history too, with the event that stopped them
+        if entry.get("status", {}).get("status_str") == "error":
+            status = "error"
+            for event, event_data in entry["status"].get("messages", []):
+                if event == "execution_interrupted":
+                    status = "interrupted"
+                elif event == "execution_error":
+                    error = event_data.get("exception_message")
+        
+        return {
+            "status": status,
+            "outputs": outputs,
+            "error": error
+        }
     
-    async def get_history(self) -> Dict[str, Any]:
+    async def download_file(
+        self,
+        filename: str,
+        subfolder: str,
+        folder_type: str,
+        destination: str,
+        chunk_size: int = 1024 * 1024,
+        timeout: Optional[float] = 300,
+        prompt_id: Optional[str] = None
+    ) -> int:
         """
-        Get ComfyUI history.
+        Stream a generated file from ComfyUI's /view endpoint to disk.
+        
+        Args:
+            filename: The file name reported in the prompt outputs.
+            subfolder: The subfolder reported in the prompt outputs.
+            folder_type: The folder type ("output", "temp" or "input").
+            destination: The local path to write the file to.
+            chunk_size: Size of the chunks read from the response.
+            timeout: Optional timeout in seconds for this call.
+            prompt_id: The prompt that produced the file, so it is fetched
+                from the backend that ran it.
+        
+        Returns:
+            The number of bytes written.
+        """
+        session = await self._get_session()
+        node = self.node_for(prompt_id) or self._primary()
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        
+        async with session.get(f"{node.api_url}/view", params=params, timeout=self._timeout(timeout)) as response:
+            if response.status != 200:
+                raise Exception(f"Failed to download file: {response.status}")
+            
+            size = 0
+            with open(destination, "wb") as buffer:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    # Keep disk writes off the event loop
+                    await asyncio.to_thread(buffer.write, chunk)
+                    size += len(chunk)
+            
+            return size
+    
+    async def get_history(
+        self,
+        max_items: Optional[int] = None,
+        timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Get ComfyUI history, merged across the healthy backends.
+        
+        Args:
+            max_items: Only get the most recent entries of each backend.
+            timeout: Optional timeout in seconds for this call.
         
         Returns:
             The ComfyUI history.
         """
-        async with aiohttp.ClientSession() as session:
-            client_id = await self._get_client_id(session)
+        nodes = [node for node in self.nodes if node.healthy]
+        if not nodes:
+            raise NoBackendAvailable("No healthy ComfyUI backend available")
+        
+        results = await asyncio.gather(
+            *(self._get_history(node, max_items, timeout) for node in nodes),
+            return_exceptions=True
+        )
+        
+        history = {}
+        errors = []
+        for node, result in zip(nodes, results):
+            if isinstance(result, Exception):
+                errors.append(result)
+                continue
             
-            # Get history
-            async with session.get(f"{self.api_url}/history") as response:
-                if response.status != 200:
-                    raise Exception(f"Failed to get history: {response.status}")
-                
-                return await response.json()
+            for prompt_id in result:
+                if prompt_id not in self._owners:
+                    self._assign(prompt_id, node)
+            history.update(result)
+        
+        if len(errors) == len(nodes):
+            raise errors[0]
+        
+        return history
     
-    async def get_object_info(self) -> Dict[str, Any]:
+    async def _get_history(
+        self,
+        node: ComfyUINode,
+        max_items: Optional[int],
+        timeout: Optional[float]
+    ) -> Dict[str, Any]:
+        session = await self._get_session()
+        params = {"max_items": max_items} if max_items is not None else None
+        
+        # Get history
+        async with session.get(f"{node.api_url}/history", params=params, timeout=self._timeout(timeout)) as response:
+            if response.status != 200:
+                raise Exception(f"Failed to get history: {response.status}")
+            
+            return await response.json()
+    
+    async def get_object_info(self, timeout: Optional[float] = 120) -> Dict[str, Any]:
         """
         Get ComfyUI object info.
         
+        Args:
+            timeout: Optional timeout in seconds for this call. The node
+                catalogue is large, so this defaults to a longer timeout.
+        
         Returns:
             The ComfyUI object info.
         """
-        async with aiohttp.ClientSession() as session:
-            # Get object info
-            async with session.get(f"{self.api_url}/object_info") as response:
-                if response.status != 200:
-                    raise Exception(f"Failed to get object info: {response.status}")
-                
-                return await response.json()
+        session = await self._get_session()
+        node = self._primary()
+        
+        # Get object info
+        async with session.get(f"{node.api_url}/object_info", timeout=self._timeout(timeout)) as response:
+            if response.status != 200:
+                raise Exception(f"Failed to get object info: {response.status}")
+            
+            return await response.json()
     
-    async def get_extensions(self) -> List[str]:
+    async def get_extensions(self, timeout: Optional[float] = None) -> List[str]:
         """
         Get installed ComfyUI extensions.
         
+        Args:
+            timeout: Optional timeout in seconds for this call.
+        
         Returns:
             The list of installed extensions.
         """
-        async with aiohttp.ClientSession() as session:
-            # Get extensions
-            async with session.get(f"{self.api_url}/extensions") as response:
-                if response.status != 200:
-                    raise Exception(f"Failed to get extensions: {response.status}")
-                
-                return await response.json()
+        session = await self._get_session()
+        node = self._primary()
+        
+        # Get extensions
+        async with session.get(f"{node.api_url}/extensions", timeout=self._timeout(timeout)) as response:
+            if response.status != 200:
+                raise Exception(f"Failed to get extensions: {response.status}")
+            
+            return await response.json()
     
-    async def system_stats(self) -> Dict[str, Any]:
+    async def system_stats(
+        self,
+        timeout: Optional[float] = 10,
+        node: Optional[ComfyUINode] = None
+    ) -> Dict[str, Any]:
         """
         Get ComfyUI system stats.
         
+        Args:
+            timeout: Optional timeout in seconds for this call.
+            node: The backend to ask; defaults to the first healthy one.
+        
         Returns:
             The system stats.
         """
-        async with aiohttp.ClientSession() as session:
-            # Get system stats
-            async with session.get(f"{self.api_url}/system_stats") as response:
+        session = await self._get_session()
+        node = node or self._primary()
+        
+        # Get system stats
+        async with session.get(f"{node.api_url}/system_stats", timeout=self._timeout(timeout)) as response:
+            if response.status != 200:
+                raise Exception(f"Failed to get system stats: {response.status}")
+            
+            return await response.json()
+    
+    async def get_queue_info(self, node: ComfyUINode, timeout: Optional[float] = 10) -> Dict[str, Any]:
+        """
+        Get a backend's queue depth.
+        
+        Args:
+            node: The backend to ask.
+            timeout: Optional timeout in seconds for this call.
+        
+        Returns:
+            ComfyUI's prompt info, with exec_info.queue_remaining.
+        """
+        session = await self._get_session()
+        
+        async with session.get(f"{node.api_url}/prompt", timeout=self._timeout(timeout)) as response:
+            if response.status != 200:
+                raise Exception(f"Failed to get queue info: {response.status}")
+            
+            return await response.json()
+
+    async def get_queue(self, node: ComfyUINode, timeout: Optional[float] = 10) -> Dict[str, Any]:
+        """
+        Get the prompts a backend is running and has waiting.
+        
+        Args:
+            node: The backend to ask.
+            timeout: Optional timeout in seconds for this call.
+        
+        Returns:
+            ComfyUI's queue, with queue_running and queue_pending lists whose
+            items hold the prompt ID second.
+        """
+        session = await self._get_session()
+        
+        async with session.get(f"{node.api_url}/queue", timeout=self._timeout(timeout)) as response:
+            if response.status != 200:
+                raise Exception(f"Failed to get queue: {response.status}")
+            
+            return await response.json()
+    
+    async def _delete_queued(self, node: ComfyUINode, prompt_id: Optional[str]):
+        """
+        Remove a waiting prompt from a backend's queue, logging any failure.
+        """
+        if prompt_id is None:
+            return
+        
+        session = await self._get_session()
+        
+        try:
+            async with session.post(f"{node.api_url}/queue", json={"delete": [prompt_id]}, timeout=self._timeout(10)) as response:
                 if response.status != 200:
-                    raise Exception(f"Failed to get system stats: {response.status}")
-                
-                return await response.json()
+                    raise Exception(f"Failed to delete queued prompt: {response.status}")
+        except Exception as e:
+            logger.warning(f"Failed to remove prompt {prompt_id} from {node.api_url}: {e}")
+
+# Shared service instance used by the whole application
+comfyui_service = ComfyUIService(COMFYUI_API_URLS)
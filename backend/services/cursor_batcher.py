@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import os
+from typing import Dict, Any, Optional
+
+from services.presence import workflow_room
+
+logger = logging.getLogger(__name__)
+
+# Cursor frames sent per second to each workflow room
+CURSOR_TICK_HZ = float(os.environ.get("CURSOR_TICK_HZ", "25"))
+
+class CursorBatcher:
+    def __init__(self, tick_hz: float = CURSOR_TICK_HZ):
+        """
+        Coalesce cursor moves and send them to each workflow room in batches.
+
+        Only the latest position of each user is kept between ticks, so a
+        client moving its mouse faster than the tick rate costs one entry
+        per frame instead of one message per move.
+
+        Args:
+            tick_hz: Number of batched frames sent per second.
+        """
+        self.interval = 1.0 / tick_hz
+        self._pending: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._sio = None
+        self._task: Optional[asyncio.Task] = None
+
+    def attach(self, sio):
+        """
+        Attach the Socket.IO server used to send cursor frames.
+        """
+        self._sio = sio
+
+    def update(self, workflow_id: str, user: Dict[str, Any], x: Any, y: Any):
+        """
+        Record a user's latest cursor position, replacing any unsent one.
+        """
+        self._pending.setdefault(workflow_id, {})[str(user["userId"])] = {
+            **user,
+            "x": x,
+            "y": y,
+        }
+
+    def discard(self, workflow_id: str, user_id: Any):
+        """
+        Drop a user's unsent cursor position, e.g. after they leave the room.
+        """
+        cursors = self._pending.get(workflow_id)
+        if cursors is not None:
+            cursors.pop(str(user_id), None)
+
+    async def start(self):
+        """
+        Start the tick task.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the tick task.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+
+        while True:
+            next_tick += self.interval
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush cursor updates")
+
+            # Don't try to catch up on ticks missed while the loop was busy
+            next_tick = max(next_tick, loop.time())
+
+    async def flush(self):
+        """
+        Send one cursor_update frame per room with pending positions.
+        """
+        if not self._pending or self._sio is None:
+            return
+
+        pending, self._pending = self._pending, {}
+
+        for workflow_id, cursors in pending.items():
+            if not cursors:
+                continue
+
+            await self._sio.emit(
+                "cursor_update",
+                {"workflowId": workflow_id, "cursors": list(cursors.values())},
+                room=workflow_room(workflow_id)
+            )
+
+# Shared batcher instance used by the whole application
+cursor_batcher = CursorBatcher()
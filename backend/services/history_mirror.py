@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database.db import AsyncSessionLocal
+from models.prompt import PromptRecord
+from models.user import User
+from services.comfyui_service import ComfyUIService, comfyui_service
+from services.prompt_tracker import PromptTracker, prompt_tracker
+
+logger = logging.getLogger(__name__)
+
+# Seconds between polls of ComfyUI's history for prompts queued elsewhere
+HISTORY_SYNC_INTERVAL = float(os.environ.get("HISTORY_SYNC_INTERVAL", "30"))
+# Most recent history entries fetched from each backend per poll
+HISTORY_SYNC_BATCH = int(os.environ.get("HISTORY_SYNC_BATCH", "100"))
+
+# ComfyUI's status_str values mapped to our prompt statuses
+COMFYUI_STATUSES = {"success": "completed", "error": "error"}
+
+# Columns only known for prompts queued through the backend
+OWNER_COLUMNS = ("user_id", "workflow_id", "prompt_hash")
+
+def _timestamp(value: Optional[float]) -> Optional[datetime]:
+    if value is None:
+        return None
+
+    return datetime.fromtimestamp(value, tz=timezone.utc)
+
+def parse_history_entry(prompt_id: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Turn one entry of ComfyUI's /history into prompt record fields.
+    """
+    status = entry.get("status") or {}
+    # Messages are [event, data] pairs with millisecond timestamps
+    times = {
+        event: data.get("timestamp") / 1000
+        for event, data in status.get("messages") or []
+        if isinstance(data, dict) and data.get("timestamp") is not None
+    }
+    finished_at = max(times.values()) if times else None
+
+    return {
+        "prompt_id": prompt_id,
+        "status": COMFYUI_STATUSES.get(status.get("status_str"), "completed" if entry.get("outputs") else "error"),
+        "outputs": entry.get("outputs") or None,
+        "queued_at": _timestamp(times.get("execution_start")),
+        "finished_at": _timestamp(finished_at),
+    }
+
+class HistoryMirror:
+    def __init__(
+        self,
+        service: ComfyUIService,
+        tracker: PromptTracker,
+        sync_interval: float = HISTORY_SYNC_INTERVAL,
+        batch_size: int = HISTORY_SYNC_BATCH
+    ):
+        """
+        Mirror finished prompts into the prompt_history table.
+
+        Prompts queued through the backend are recorded when the tracker sees
+        them finish. Prompts queued directly in ComfyUI are picked up by
+        polling the most recent entries of its history.
+
+        Args:
+            service: The ComfyUI service to poll.
+            tracker: The tracker whose prompts are recorded as they finish.
+            sync_interval: Seconds between polls of ComfyUI's history.
+            batch_size: Most recent entries fetched from each backend per poll.
+        """
+        self.service = service
+        self.tracker = tracker
+        self.sync_interval = sync_interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, tracker: PromptTracker):
+        """
+        Record prompts as the tracker sees them finish.
+        """
+        tracker.add_completion_listener(self.on_prompt_finished)
+
+    async def on_prompt_finished(self, state: Dict[str, Any]):
+        """
+        Record a prompt queued through the backend.
+        """
+        async with AsyncSessionLocal() as db:
+            user_id = await db.scalar(select(User.id).filter(User.username == state["username"]))
+
+        await self._save([{
+            "prompt_id": state["prompt_id"],
+            "user_id": user_id,
+            "workflow_id": state["workflow_id"],
+            "prompt_hash": state.get("prompt_hash"),
+            "status": state["status"],
+            "outputs": state["outputs"] or None,
+            "error": state["error"],
+            "queued_at": _timestamp(state["queued_at"]),
+            "finished_at": _timestamp(state["finished_at"]),
+        }])
+
+    async def sync(self) -> int:
+        """
+        Record recent ComfyUI history entries that are not mirrored yet.
+
+        Returns:
+            The number of new records.
+        """
+        history = await self.service.get_history(max_items=self.batch_size)
+
+        # Prompts the tracker knows about are recorded with their owner when they finish
+        prompt_ids = [prompt_id for prompt_id in history if self.tracker.get(prompt_id) is None]
+        if not prompt_ids:
+            return 0
+
+        async with AsyncSessionLocal() as db:
+            known = set(await db.scalars(
+                select(PromptRecord.prompt_id).filter(PromptRecord.prompt_id.in_(prompt_ids))
+            ))
+
+        records = [
+            parse_history_entry(prompt_id, history[prompt_id])
+            for prompt_id in prompt_ids
+            if prompt_id not in known
+        ]
+        # Insert oldest first so record IDs follow completion order
+        records.sort(key=lambda record: record["finished_at"] or datetime.min.replace(tzinfo=timezone.utc))
+
+        return await self._save(records)
+
+    async def _save(self, records: List[Dict[str, Any]]) -> int:
+        """
+        Insert prompt records, or fill in the owner of those already mirrored.
+
+        A prompt can be mirrored from ComfyUI's history before the tracker
+        records it with its owner, so on conflict the owner columns still
+        unset are taken from the new record.
+        """
+        if not records:
+            return 0
+
+        async with AsyncSessionLocal() as db:
+            insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+            statement = insert(PromptRecord).values(records)
+            statement = statement.on_conflict_do_update(
+                index_elements=[PromptRecord.prompt_id],
+                set_={
+                    column: func.coalesce(getattr(PromptRecord, column), getattr(statement.excluded, column))
+                    for column in OWNER_COLUMNS
+                }
+            )
+            await db.execute(statement)
+            await db.commit()
+
+        return len(records)
+
+    async def start(self):
+        """
+        Start the history polling task.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the history polling task.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                count = await self.sync()
+                if count:
+                    logger.info(f"Mirrored {count} ComfyUI history entries")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Failed to sync ComfyUI history: {e}")
+
+            await asyncio.sleep(self.sync_interval)
+
+# Shared mirror instance used by the whole application
+history_mirror = HistoryMirror(comfyui_service, prompt_tracker)
+history_mirror.register(prompt_tracker)
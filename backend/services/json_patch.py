@@ -0,0 +1,254 @@
+import copy
+import json
+from typing import Any, Callable, Dict, List
+
+class PatchError(Exception):
+    """Raised when a JSON Patch operation cannot be applied."""
+
+def parse_pointer(pointer: str) -> List[str]:
+    """
+    Split a JSON Pointer (RFC 6901) into its unescaped tokens.
+    """
+    if not isinstance(pointer, str):
+        raise PatchError(f"Invalid JSON pointer: {pointer!r}")
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise PatchError(f"Invalid JSON pointer: {pointer}")
+
+    return [token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")]
+
+def _array_index(container: List[Any], token: str, allow_end: bool = False) -> int:
+    if token == "-" and allow_end:
+        return len(container)
+    if not token.isdigit() or (token != "0" and token.startswith("0")):
+        raise PatchError(f"Invalid array index: {token}")
+
+    index = int(token)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise PatchError(f"Array index out of range: {token}")
+
+    return index
+
+def _resolve(document: Any, tokens: List[str]) -> Any:
+    target = document
+    for token in tokens:
+        if isinstance(target, dict):
+            if token not in target:
+                raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+            target = target[token]
+        elif isinstance(target, list):
+            target = target[_array_index(target, token)]
+        else:
+            raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+
+    return target
+
+class _Document:
+    """A patch target whose root can be replaced, with an undo log."""
+
+    def __init__(self, root: Any):
+        self.root = root
+        self.undo: List[Callable[[], None]] = []
+
+    def get(self, pointer: str) -> Any:
+        return _resolve(self.root, parse_pointer(pointer))
+
+    def add(self, pointer: str, value: Any):
+        tokens = parse_pointer(pointer)
+        if not tokens:
+            previous = self.root
+            self.root = value
+            self.undo.append(lambda: setattr(self, "root", previous))
+            return
+
+        parent = _resolve(self.root, tokens[:-1])
+        key = tokens[-1]
+
+        if isinstance(parent, dict):
+            if key in parent:
+                previous = parent[key]
+                self.undo.append(lambda: parent.__setitem__(key, previous))
+            else:
+                self.undo.append(lambda: parent.pop(key))
+            parent[key] = value
+        elif isinstance(parent, list):
+            index = _array_index(parent, key, allow_end=True)
+            parent.insert(index, value)
+            self.undo.append(lambda: parent.pop(index))
+        else:
+            raise PatchError(f"Cannot add to {pointer}")
+
+    def remove(self, pointer: str) -> Any:
+        tokens = parse_pointer(pointer)
+        if not tokens:
+            raise PatchError("Cannot remove the document root")
+
+        parent = _resolve(self.root, tokens[:-1])
+        key = tokens[-1]
+
+        if isinstance(parent, dict):
+            if key not in parent:
+                raise PatchError(f"Path not found: {pointer}")
+            previous = parent.pop(key)
+            self.undo.append(lambda: parent.__setitem__(key, previous))
+        elif isinstance(parent, list):
+            index = _array_index(parent, key)
+            previous = parent.pop(index)
+            self.undo.append(lambda: parent.insert(index, previous))
+        else:
+            raise PatchError(f"Path not found: {pointer}")
+
+        return previous
+
+    def replace(self, pointer: str, value: Any):
+        tokens = parse_pointer(pointer)
+        if not tokens:
+            self.add(pointer, value)
+            return
+
+        # Make sure the target exists before replacing it
+        self.get(pointer)
+        self.remove(pointer)
+        self.add(pointer, value)
+
+    def rollback(self):
+        while self.undo:
+            self.undo.pop()()
+
+def apply_patch(document: Any, operations: List[Dict[str, Any]]) -> Any:
+    """
+    Apply a JSON Patch (RFC 6902) to a document in place.
+
+    The patch is atomic: if any operation fails, every change already made
+    is undone and PatchError is raised.
+
+    Args:
+        document: The JSON document to modify.
+        operations: The patch operations.
+
+    Returns:
+        The patched document. This is the same object unless the patch
+        replaced the document root.
+    """
+    target = _Document(document)
+
+    try:
+        for operation in operations:
+            if not isinstance(operation, dict) or "op" not in operation or "path" not in operation:
+                raise PatchError(f"Invalid patch operation: {operation}")
+
+            op = operation["op"]
+            path = operation["path"]
+            if not isinstance(path, str) or not isinstance(operation.get("from", ""), str):
+                raise PatchError(f"Invalid patch operation: {operation}")
+
+            if op == "add":
+                target.add(path, copy.deepcopy(operation["value"]))
+            elif op == "remove":
+                target.remove(path)
+            elif op == "replace":
+                target.replace(path, copy.deepcopy(operation["value"]))
+            elif op == "move":
+                if path.startswith(operation["from"] + "/"):
+                    raise PatchError("Cannot move a value into one of its children")
+                target.add(path, target.remove(operation["from"]))
+            elif op == "copy":
+                target.add(path, copy.deepcopy(target.get(operation["from"])))
+            elif op == "test":
+                if target.get(path) != operation["value"]:
+                    raise PatchError(f"Test failed at {path}")
+            else:
+                raise PatchError(f"Unknown patch operation: {op}")
+
+    except PatchError:
+        target.rollback()
+        raise
+    except (KeyError, TypeError) as e:
+        target.rollback()
+        raise PatchError(f"Invalid patch operation: {e}")
+
+    return target.root
+
+def _escape(token: str) -> str:
+    return token.replace("~", "~0").replace("/", "~1")
+
+def _same(a: Any, b: Any) -> bool:
+    # Stricter than ==, which treats True as 1 and 1.0 as 1
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_same(a[key], b[key]) for key in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+
+    return a == b
+
+def _diff(source: Any, target: Any, pointer: str, operations: List[Dict[str, Any]]):
+    if _same(source, target):
+        return
+
+    if isinstance(source, (dict, list)) and type(source) is type(target):
+        nested: List[Dict[str, Any]] = []
+        _diff_container(source, target, pointer, nested)
+
+        # Replace the whole value when that is shorter than editing it piecemeal
+        if len(nested) > 1 and len(json.dumps(nested)) > len(json.dumps(target)) + len(pointer) + 32:
+            operations.append({"op": "replace", "path": pointer, "value": copy.deepcopy(target)})
+        else:
+            operations.extend(nested)
+    else:
+        operations.append({"op": "replace", "path": pointer, "value": copy.deepcopy(target)})
+
+def _diff_container(source: Any, target: Any, pointer: str, operations: List[Dict[str, Any]]):
+    if isinstance(source, dict):
+        for key in source:
+            if key not in target:
+                operations.append({"op": "remove", "path": f"{pointer}/{_escape(key)}"})
+        for key, value in target.items():
+            if key in source:
+                _diff(source[key], value, f"{pointer}/{_escape(key)}", operations)
+            else:
+                operations.append({"op": "add", "path": f"{pointer}/{_escape(key)}", "value": copy.deepcopy(value)})
+
+    else:
+        # Skip the unchanged head and tail so an insert or delete in the
+        # middle of a list becomes a single operation
+        shortest = min(len(source), len(target))
+        start = 0
+        while start < shortest and _same(source[start], target[start]):
+            start += 1
+        end = 0
+        while end < shortest - start and _same(source[-1 - end], target[-1 - end]):
+            end += 1
+
+        changed_source = source[start:len(source) - end]
+        changed_target = target[start:len(target) - end]
+        common = min(len(changed_source), len(changed_target))
+
+        for offset in range(common):
+            _diff(changed_source[offset], changed_target[offset], f"{pointer}/{start + offset}", operations)
+        for _ in range(len(changed_source) - common):
+            operations.append({"op": "remove", "path": f"{pointer}/{start + common}"})
+        for offset in range(common, len(changed_target)):
+            operations.append({"op": "add", "path": f"{pointer}/{start + offset}", "value": copy.deepcopy(changed_target[offset])})
+
+def make_patch(source: Any, target: Any) -> List[Dict[str, Any]]:
+    """
+    Compute a JSON Patch (RFC 6902) that turns source into target.
+
+    Only add, remove and replace operations are produced. The patch is
+    not guaranteed to be minimal, but an edit touching one part of a
+    document gives a patch touching only that part.
+
+    Args:
+        source: The original JSON document.
+        target: The JSON document to reach.
+
+    Returns:
+        The patch operations; empty if the documents are equal.
+    """
+    operations: List[Dict[str, Any]] = []
+    _diff(source, target, "", operations)
+
+    return operations
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import update, bindparam
+
+from database.db import AsyncSessionLocal
+from models.user import User
+
+logger = logging.getLogger(__name__)
+
+# Seconds between batched last_login writes
+LAST_SEEN_FLUSH_INTERVAL = float(os.environ.get("LAST_SEEN_FLUSH_INTERVAL", "30"))
+
+class LastSeenTracker:
+    def __init__(self, flush_interval: float = LAST_SEEN_FLUSH_INTERVAL):
+        """
+        Buffer user activity in memory and write it out in periodic batches.
+
+        Args:
+            flush_interval: Seconds between flushes to the database.
+        """
+        self.flush_interval = flush_interval
+        self._pending: Dict[int, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def touch(self, user_id: int):
+        """
+        Record that a user was active just now. Does not touch the database.
+        """
+        self._pending[user_id] = datetime.utcnow()
+
+    async def start(self):
+        """
+        Start the periodic flush task.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the flush task and write out anything still buffered.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush last seen times")
+
+    async def flush(self):
+        """
+        Write all buffered activity in a single batched UPDATE.
+        """
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+
+        try:
+            async with AsyncSessionLocal() as db:
+                # Core executemany, so rows deleted in the meantime are simply skipped
+                await db.execute(
+                    update(User.__table__)
+                    .where(User.__table__.c.id == bindparam("user_id"))
+                    .values(last_login=bindparam("seen")),
+                    [{"user_id": user_id, "seen": seen} for user_id, seen in pending.items()]
+                )
+                await db.commit()
+
+        except Exception:
+            # Keep the entries for the next flush unless newer activity replaced them
+            for user_id, seen in pending.items():
+                self._pending.setdefault(user_id, seen)
+            raise
+
+# Shared tracker instance used by the whole application
+last_seen = LastSeenTracker()
@@ -0,0 +1,153 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, List, Optional
+
+from services.comfyui_service import ComfyUIService, comfyui_service
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the installed extensions
+OBJECT_INFO_CHECK_INTERVAL = float(os.environ.get("OBJECT_INFO_CHECK_INTERVAL", "60"))
+# Seconds after which the catalogue is downloaded again even if no extension
+# changed, e.g. to pick up new model files listed in node inputs
+OBJECT_INFO_MAX_AGE = float(os.environ.get("OBJECT_INFO_MAX_AGE", "900"))
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """
+    Check whether an Accept-Encoding header allows a gzip response.
+
+    Codings are weighed by their q-values, so "gzip;q=0" refuses gzip. A
+    wildcard covers gzip unless gzip is listed on its own.
+    """
+    weights = {}
+    for item in accept_encoding.split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        if not coding:
+            continue
+
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+
+        weights[coding.lower()] = weight
+
+    for coding in ("gzip", "x-gzip", "*"):
+        if coding in weights:
+            return weights[coding] > 0
+
+    return False
+
+class ObjectInfoCache:
+    def __init__(
+        self,
+        service: ComfyUIService,
+        check_interval: float = OBJECT_INFO_CHECK_INTERVAL,
+        max_age: float = OBJECT_INFO_MAX_AGE
+    ):
+        """
+        Keep a serialized, gzip-compressed copy of ComfyUI's /object_info
+        node catalogue so requests for it never reach ComfyUI.
+
+        Args:
+            service: The ComfyUI service to download the catalogue from.
+            check_interval: Seconds between checks of the installed extensions.
+            max_age: Seconds after which the catalogue is downloaded again anyway.
+        """
+        self.service = service
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self.body: Optional[bytes] = None
+        self.gzip_body: Optional[bytes] = None
+        self.etag: Optional[str] = None
+        self.extensions: Optional[List[str]] = None
+        self.updated_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def get(self) -> "ObjectInfoCache":
+        """
+        Make sure the catalogue is loaded, downloading it on first use.
+        """
+        if self.body is None:
+            await self.refresh()
+
+        return self
+
+    async def refresh(self, force: bool = False) -> bool:
+        """
+        Download the catalogue again if the installed extensions changed or
+        the copy is older than max_age.
+
+        Args:
+            force: Download the catalogue whatever the extensions say.
+
+        Returns:
+            True if the catalogue was downloaded.
+        """
+        async with self._lock:
+            extensions = await self.service.get_extensions()
+
+            stale = self.updated_at is None or time.time() - self.updated_at > self.max_age
+            if not force and not stale and extensions == self.extensions:
+                return False
+
+            object_info = await self.service.get_object_info()
+            await asyncio.to_thread(self._store, object_info)
+            self.extensions = extensions
+            logger.info(f"Cached ComfyUI object_info ({len(self.body)} bytes, {len(self.gzip_body)} gzipped)")
+
+            return True
+
+    def _store(self, object_info: Any):
+        # Serializing and compressing several MB is kept off the event loop
+        body = json.dumps(object_info, separators=(",", ":"), sort_keys=True).encode()
+        gzip_body = gzip.compress(body, compresslevel=6, mtime=0)
+
+        self.body = body
+        self.gzip_body = gzip_body
+        self.etag = hashlib.sha256(body).hexdigest()
+        self.updated_at = time.time()
+
+    async def start(self):
+        """
+        Start the background refresh task. The first download happens in it,
+        so startup doesn't wait for ComfyUI.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the background refresh task.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Failed to refresh ComfyUI object_info: {e}")
+
+            await asyncio.sleep(self.check_interval)
+
+# Shared cache instance used by the whole application
+object_info_cache = ObjectInfoCache(comfyui_service)
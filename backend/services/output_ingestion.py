@@ -0,0 +1,324 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from contextlib import AsyncExitStack
+from typing import Dict, Any, List, Set
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.db import AsyncSessionLocal
+from models.user import User
+from models.workflow import Workflow, Output
+from services.comfyui_service import ComfyUIService, comfyui_service
+from services.blob_store import blob_store, hash_file, OUTPUTS_DIR
+from services.thumbnails import thumbnails
+from services.prompt_tracker import PromptTracker, prompt_tracker, user_room
+
+logger = logging.getLogger(__name__)
+
+# Ingestion configuration
+INGESTION_WORKERS = int(os.environ.get("INGESTION_WORKERS", "2"))
+INGESTION_QUEUE_SIZE = int(os.environ.get("INGESTION_QUEUE_SIZE", "100"))
+INGESTION_MAX_OVERFLOW = int(os.environ.get("INGESTION_MAX_OVERFLOW", "1000"))
+INGESTION_MAX_DOWNLOADS = int(os.environ.get("INGESTION_MAX_DOWNLOADS", "4"))
+INGESTION_MAX_RETRIES = int(os.environ.get("INGESTION_MAX_RETRIES", "3"))
+INGESTION_RETRY_DELAY = float(os.environ.get("INGESTION_RETRY_DELAY", "1.0"))
+
+# Keys under which ComfyUI nodes report the files they produced
+OUTPUT_FILE_KEYS = ("images", "gifs", "videos", "audio")
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp")
+VIDEO_EXTENSIONS = (".mp4", ".webm", ".mov", ".mkv", ".avi")
+
+def get_file_type(filename: str) -> str:
+    """Guess the output file type from its extension."""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in IMAGE_EXTENSIONS:
+        return "image"
+    if extension in VIDEO_EXTENSIONS:
+        return "video"
+    return "unknown"
+
+def collect_output_files(outputs: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    List the saved files in a prompt's per-node outputs.
+
+    Temporary preview images are skipped since ComfyUI does not keep them.
+    """
+    files = []
+    for node_id, node_output in (outputs or {}).items():
+        for key in OUTPUT_FILE_KEYS:
+            for item in node_output.get(key) or []:
+                if not isinstance(item, dict) or item.get("type", "output") == "temp":
+                    continue
+                files.append({
+                    "node_id": node_id,
+                    "filename": item["filename"],
+                    "subfolder": item.get("subfolder", ""),
+                    "type": item.get("type", "output"),
+                })
+    return files
+
+class OutputIngestionWorker:
+    def __init__(
+        self,
+        service: ComfyUIService,
+        workers: int = INGESTION_WORKERS,
+        queue_size: int = INGESTION_QUEUE_SIZE,
+        max_overflow: int = INGESTION_MAX_OVERFLOW,
+        max_downloads: int = INGESTION_MAX_DOWNLOADS,
+        max_retries: int = INGESTION_MAX_RETRIES,
+        retry_delay: float = INGESTION_RETRY_DELAY
+    ):
+        """
+        Download the files of finished prompts and record them as outputs.
+
+        Args:
+            service: The ComfyUI service to download files from.
+            workers: Number of prompts ingested concurrently.
+            queue_size: Maximum number of prompts in the worker queue.
+                Further prompts wait in an overflow list, so the prompt
+                tracker is never held up by a slow ingestion.
+            max_overflow: Maximum number of prompts held in the overflow
+                list. Prompts beyond it are dropped with an error.
+            max_downloads: Maximum number of concurrent file downloads.
+            max_retries: Attempts per file before giving up on it.
+            retry_delay: Base delay in seconds between attempts.
+        """
+        self.service = service
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.max_overflow = max_overflow
+        self._overflow: deque = deque()
+        self._downloads = asyncio.Semaphore(max_downloads)
+        self._tasks: List[asyncio.Task] = []
+        self._sio = None
+
+    def attach(self, sio):
+        """
+        Attach the Socket.IO server used to notify users of ingested outputs.
+        """
+        self._sio = sio
+
+    def register(self, tracker: PromptTracker):
+        """
+        Ingest the outputs of every prompt the tracker sees complete.
+        """
+        tracker.add_completion_listener(self.on_prompt_finished)
+
+    async def start(self):
+        """
+        Start the worker tasks.
+        """
+        os.makedirs(OUTPUTS_DIR, exist_ok=True)
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self):
+        """
+        Stop the worker tasks. Jobs still queued or held are dropped.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def on_prompt_finished(self, state: Dict[str, Any]):
+        """
+        Queue a finished prompt for ingestion if it belongs to a workflow.
+        """
+        if state["status"] != "completed" or state.get("workflow_id") is None:
+            return
+
+        files = collect_output_files(state["outputs"])
+        if not files:
+            return
+
+        self.enqueue({
+            "prompt_id": state["prompt_id"],
+            "username": state["username"],
+            "workflow_id": state["workflow_id"],
+            "files": files,
+        })
+
+    def enqueue(self, job: Dict[str, Any]):
+        """
+        Add a job to the queue without waiting. Jobs that don't fit are held
+        in the overflow list until the workers catch up, and dropped once
+        that is full too.
+        """
+        if not self._overflow:
+            try:
+                self.queue.put_nowait(job)
+                return
+            except asyncio.QueueFull:
+                pass
+
+        if len(self._overflow) >= self.max_overflow:
+            logger.error(f"Ingestion overflow is full; dropping outputs of prompt {job['prompt_id']}")
+            return
+
+        logger.warning(f"Ingestion queue is full; holding prompt {job['prompt_id']} in overflow")
+        self._overflow.append(job)
+
+    def _refill(self):
+        # Move held jobs into the queue, oldest first, as room frees up
+        while self._overflow and not self.queue.full():
+            self.queue.put_nowait(self._overflow.popleft())
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            self._refill()
+            try:
+                await self._ingest(job)
+            except Exception:
+                logger.exception(f"Failed to ingest outputs of prompt {job['prompt_id']}")
+            finally:
+                self.queue.task_done()
+
+    async def _ingest(self, job: Dict[str, Any]):
+        """
+        Download all files of a prompt and create their output rows in one batch.
+        """
+        results = await asyncio.gather(
+            *(self._download(file, job["prompt_id"]) for file in job["files"]),
+            return_exceptions=True
+        )
+
+        downloaded = []
+        for file, result in zip(job["files"], results):
+            if isinstance(result, Exception):
+                logger.error(f"Giving up on {file['filename']} of prompt {job['prompt_id']}: {result}")
+            else:
+                downloaded.append({**file, **result})
+
+        if not downloaded:
+            return
+
+        output_ids = await self._save_outputs(job, downloaded)
+
+        if self._sio is not None and output_ids:
+            await self._sio.emit(
+                "outputs_ingested",
+                {
+                    "promptId": job["prompt_id"],
+                    "workflowId": job["workflow_id"],
+                    "outputIds": output_ids,
+                },
+                room=user_room(job["username"])
+            )
+
+    async def _download(self, file: Dict[str, Any], prompt_id: str) -> Dict[str, Any]:
+        """
+        Download a single file with retries and exponential backoff.
+        """
+        temp_path = blob_store.temp_path()
+
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                async with self._downloads:
+                    size = await self.service.download_file(
+                        file["filename"], file["subfolder"], file["type"], temp_path,
+                        prompt_id=prompt_id
+                    )
+                content_hash = await asyncio.to_thread(hash_file, temp_path)
+                return {"temp_path": temp_path, "file_size": size, "content_hash": content_hash}
+
+            except Exception as e:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Download of {file['filename']} failed (attempt {attempt}): {e}")
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+    async def _save_outputs(self, job: Dict[str, Any], files: List[Dict[str, Any]]) -> List[int]:
+        """
+        Store the downloaded files as blobs and create their output rows.
+        """
+        for file in files:
+            extension = os.path.splitext(file["filename"])[1]
+            file["extension"] = extension
+            file["blob_name"] = blob_store.blob_name(file["content_hash"], extension)
+
+        async with AsyncSessionLocal() as db:
+            user = await db.scalar(select(User).filter(User.username == job["username"]))
+            workflow = await db.scalar(select(Workflow).filter(Workflow.id == job["workflow_id"]))
+
+            if user is None or workflow is None:
+                # The owner or workflow went away while the prompt ran
+                for file in files:
+                    blob_store.discard(file["temp_path"])
+                return []
+
+            async with AsyncExitStack() as locks:
+                stored = set()
+                try:
+                    # Sorted so concurrent jobs sharing blobs can't deadlock
+                    for blob_name in sorted({file["blob_name"] for file in files}):
+                        await locks.enter_async_context(blob_store.lock(db, blob_name))
+
+                    for file in files:
+                        stored.add(await blob_store.store(file["temp_path"], file["content_hash"], file["extension"]))
+
+                    outputs = await self._add_outputs(db, job, user, workflow, files)
+                except BaseException:
+                    await self._abandon(db, job, files, stored)
+                    raise
+
+            for output in outputs:
+                thumbnails.schedule(output.filename, output.file_type)
+
+            return [output.id for output in outputs]
+
+    async def _add_outputs(self, db: AsyncSession, job: Dict[str, Any], user: User, workflow: Workflow,
+                           files: List[Dict[str, Any]]) -> List[Output]:
+        """
+        Create and commit the output rows of the stored files.
+        """
+        outputs = [
+            Output(
+                workflow_id=workflow.id,
+                user_id=user.id,
+                filename=file["blob_name"],
+                original_filename=file["filename"],
+                file_type=get_file_type(file["filename"]),
+                file_size=file["file_size"],
+                content_hash=file["content_hash"],
+                output_metadata={
+                    "prompt_id": job["prompt_id"],
+                    "node_id": file["node_id"],
+                    "subfolder": file["subfolder"],
+                }
+            )
+            for file in files
+        ]
+
+        db.add_all(outputs)
+        await db.commit()
+        return outputs
+
+    async def _abandon(self, db: AsyncSession, job: Dict[str, Any], files: List[Dict[str, Any]], stored: Set[str]):
+        """
+        Clean up after a failed save: remove the temporary files not yet
+        stored and the blobs no output row ended up referring to.
+        """
+        for file in files:
+            blob_store.discard(file["temp_path"])
+
+        try:
+            await db.rollback()
+            for name in stored:
+                await blob_store.release(db, name)
+            await db.commit()
+        except Exception:
+            logger.exception(f"Failed to remove unreferenced blobs of prompt {job['prompt_id']}")
+
+# Shared worker instance used by the whole application
+output_ingestion = OutputIngestionWorker(comfyui_service)
+output_ingestion.register(prompt_tracker)
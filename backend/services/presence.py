@@ -0,0 +1,230 @@
+import json
+import os
+from typing import Dict, Any, List, Set
+
+try:
+    from redis import asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+# Redis server shared by all workers; unset keeps everything in this process
+REDIS_URL = os.environ.get("REDIS_URL")
+
+def workflow_room(workflow_id: Any) -> str:
+    """Socket.IO room shared by every session editing a workflow."""
+    return f"workflow:{workflow_id}"
+
+class PresenceTracker:
+    def __init__(self):
+        """
+        Track which sessions are editing which workflow.
+        """
+        self._rooms: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._session_rooms: Dict[str, Set[str]] = {}
+
+    async def join(self, sid: str, workflow_id: str, user: Dict[str, Any]):
+        """
+        Record that a session joined a workflow.
+
+        Args:
+            sid: The Socket.IO session ID.
+            workflow_id: The workflow being edited.
+            user: Public information about the session's user.
+        """
+        self._rooms.setdefault(workflow_id, {})[sid] = user
+        self._session_rooms.setdefault(sid, set()).add(workflow_id)
+
+    async def leave(self, sid: str, workflow_id: str) -> bool:
+        """
+        Record that a session left a workflow.
+
+        Returns:
+            True if the session was in the workflow.
+        """
+        members = self._rooms.get(workflow_id)
+        if members is None or sid not in members:
+            return False
+
+        del members[sid]
+        if not members:
+            del self._rooms[workflow_id]
+
+        rooms = self._session_rooms.get(sid)
+        if rooms is not None:
+            rooms.discard(workflow_id)
+            if not rooms:
+                del self._session_rooms[sid]
+
+        return True
+
+    async def leave_all(self, sid: str) -> List[str]:
+        """
+        Remove a disconnected session from every workflow.
+
+        Returns:
+            The workflows the session was in.
+        """
+        workflow_ids = list(self._session_rooms.get(sid, ()))
+        for workflow_id in workflow_ids:
+            await self.leave(sid, workflow_id)
+
+        return workflow_ids
+
+    async def workflows_of(self, sid: str) -> List[str]:
+        """
+        Get the workflows a session is currently in.
+        """
+        return list(self._session_rooms.get(sid, ()))
+
+    async def is_member(self, sid: str, workflow_id: str) -> bool:
+        """
+        Check whether a session is in a workflow.
+        """
+        return sid in self._rooms.get(workflow_id, {})
+
+    async def members(self, workflow_id: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Get the users editing a workflow, keyed by user ID.
+
+        A user with several sessions in the same workflow is listed once.
+        """
+        users = {}
+        for user in self._rooms.get(workflow_id, {}).values():
+            users[str(user["userId"])] = user
+
+        return users
+
+    def has_local_sessions(self, workflow_id: str) -> bool:
+        """
+        Check whether any session of this process is in a workflow.
+        """
+        return workflow_id in self._rooms
+
+    async def close(self):
+        """
+        Forget the sessions of this process. Called on application shutdown.
+        """
+        self._rooms.clear()
+        self._session_rooms.clear()
+
+class RedisPresenceTracker:
+    def __init__(self, url: str, prefix: str = "presence"):
+        """
+        Track which sessions are editing which workflow in Redis, so every
+        worker behind the load balancer sees the same room members.
+
+        The sessions connected to this process are also kept locally, so
+        per-process state like the live workflow documents can be released
+        when the last local editor leaves.
+
+        Args:
+            url: The Redis connection URL.
+            prefix: Prefix of the Redis keys.
+        """
+        if aioredis is None:
+            raise RuntimeError("The redis package is required when REDIS_URL is set")
+
+        self.prefix = prefix
+        self._redis = aioredis.from_url(url, decode_responses=True)
+        self._local: Dict[str, Set[str]] = {}
+
+    def _room_key(self, workflow_id: str) -> str:
+        return f"{self.prefix}:workflow:{workflow_id}"
+
+    def _session_key(self, sid: str) -> str:
+        return f"{self.prefix}:session:{sid}"
+
+    async def join(self, sid: str, workflow_id: str, user: Dict[str, Any]):
+        """
+        Record that a session joined a workflow.
+
+        Args:
+            sid: The Socket.IO session ID.
+            workflow_id: The workflow being edited.
+            user: Public information about the session's user.
+        """
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._room_key(workflow_id), sid, json.dumps(user))
+            pipe.sadd(self._session_key(sid), workflow_id)
+            await pipe.execute()
+
+        self._local.setdefault(workflow_id, set()).add(sid)
+
+    async def leave(self, sid: str, workflow_id: str) -> bool:
+        """
+        Record that a session left a workflow.
+
+        Returns:
+            True if the session was in the workflow.
+        """
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hdel(self._room_key(workflow_id), sid)
+            pipe.srem(self._session_key(sid), workflow_id)
+            removed, _ = await pipe.execute()
+
+        sids = self._local.get(workflow_id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._local[workflow_id]
+
+        return bool(removed)
+
+    async def leave_all(self, sid: str) -> List[str]:
+        """
+        Remove a disconnected session from every workflow.
+
+        Returns:
+            The workflows the session was in.
+        """
+        workflow_ids = await self.workflows_of(sid)
+        for workflow_id in workflow_ids:
+            await self.leave(sid, workflow_id)
+
+        return workflow_ids
+
+    async def workflows_of(self, sid: str) -> List[str]:
+        """
+        Get the workflows a session is currently in.
+        """
+        return list(await self._redis.smembers(self._session_key(sid)))
+
+    async def is_member(self, sid: str, workflow_id: str) -> bool:
+        """
+        Check whether a session is in a workflow.
+        """
+        return bool(await self._redis.hexists(self._room_key(workflow_id), sid))
+
+    async def members(self, workflow_id: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Get the users editing a workflow on any worker, keyed by user ID.
+
+        A user with several sessions in the same workflow is listed once.
+        """
+        users = {}
+        for value in await self._redis.hvals(self._room_key(workflow_id)):
+            user = json.loads(value)
+            users[str(user["userId"])] = user
+
+        return users
+
+    def has_local_sessions(self, workflow_id: str) -> bool:
+        """
+        Check whether any session of this process is in a workflow.
+        """
+        return workflow_id in self._local
+
+    async def close(self):
+        """
+        Remove the sessions of this process from Redis and close the
+        connection. Called on application shutdown, so a stopped worker
+        doesn't leave ghost users in the rooms.
+        """
+        for workflow_id, sids in list(self._local.items()):
+            for sid in list(sids):
+                await self.leave(sid, workflow_id)
+
+        await self._redis.aclose()
+
+# Shared presence instance used by the whole application
+presence = RedisPresenceTracker(REDIS_URL) if REDIS_URL else PresenceTracker()
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from sqlalchemy import select
+
+from database.db import AsyncSessionLocal
+from models.prompt import PromptRecord
+from services.prompt_tracker import PromptTracker, prompt_tracker
+
+logger = logging.getLogger(__name__)
+
+# Number of prompt results kept in the index
+PROMPT_CACHE_SIZE = int(os.environ.get("PROMPT_CACHE_SIZE", "1000"))
+
+# Node fields that only affect how the graph is shown, not what it produces
+NON_SEMANTIC_NODE_FIELDS = ("_meta",)
+
+def prompt_hash(prompt: Dict[str, Any]) -> str:
+    """
+    Hash a prompt graph so that graphs producing the same result hash alike.
+
+    Keys are sorted and UI-only node fields such as titles are dropped. The
+    seed is part of the node inputs, so a re-randomized seed gives a new hash.
+    """
+    nodes = {
+        node_id: {key: value for key, value in node.items() if key not in NON_SEMANTIC_NODE_FIELDS}
+        if isinstance(node, dict) else node
+        for node_id, node in prompt.items()
+    }
+    canonical = json.dumps(nodes, sort_keys=True, separators=(",", ":"), default=str)
+
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+class PromptResultCache:
+    def __init__(self, max_size: int = PROMPT_CACHE_SIZE):
+        """
+        LRU index of completed prompts by prompt hash, so re-running an
+        identical graph can return the earlier outputs without a GPU run.
+
+        Args:
+            max_size: Maximum number of prompt results kept.
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def register(self, tracker: PromptTracker):
+        """
+        Add prompts to the index as the tracker sees them complete.
+        """
+        tracker.add_completion_listener(self.on_prompt_finished)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the prompt ID and outputs of an earlier run of a prompt hash.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+
+        return entry
+
+    def set(self, key: str, prompt_id: str, outputs: Dict[str, Any]):
+        """
+        Remember the result of a completed prompt.
+        """
+        self._entries[key] = {"prompt_id": prompt_id, "outputs": outputs}
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def on_prompt_finished(self, state: Dict[str, Any]):
+        """
+        Index a prompt that completed with outputs.
+        """
+        if state["status"] == "completed" and state["outputs"] and state.get("prompt_hash"):
+            self.set(state["prompt_hash"], state["prompt_id"], state["outputs"])
+
+    async def load(self):
+        """
+        Fill the index from the most recent completed prompts in the history.
+        Called once on application startup.
+        """
+        async with AsyncSessionLocal() as db:
+            records = (await db.execute(
+                select(PromptRecord.prompt_hash, PromptRecord.prompt_id, PromptRecord.outputs)
+                .filter(PromptRecord.prompt_hash.isnot(None), PromptRecord.status == "completed")
+                .order_by(PromptRecord.id.desc())
+                .limit(self.max_size)
+            )).all()
+
+        # Oldest first, so the newest end up most recently used
+        for key, prompt_id, outputs in reversed(records):
+            if outputs:
+                self.set(key, prompt_id, outputs)
+
+        logger.info(f"Loaded {len(self._entries)} prompt results into the cache")
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Get the index size and hit/miss counters.
+        """
+        lookups = self.hits + self.misses
+
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+# Shared cache instance used by the whole application
+prompt_cache = PromptResultCache()
+prompt_cache.register(prompt_tracker)
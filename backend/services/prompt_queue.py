@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import os
+import uuid
+from collections import OrderedDict, deque
+from typing import Dict, Any, List, Optional, Set
+
+from services.comfyui_service import ComfyUIService, NoBackendAvailable, comfyui_service
+from services.prompt_tracker import PromptTracker, prompt_tracker
+
+logger = logging.getLogger(__name__)
+
+# Prompts sent to each healthy ComfyUI backend that haven't finished yet
+PROMPT_MAX_IN_FLIGHT = int(os.environ.get("PROMPT_MAX_IN_FLIGHT", "2"))
+# Prompts a single user may have waiting in the queue
+PROMPT_MAX_QUEUED_PER_USER = int(os.environ.get("PROMPT_MAX_QUEUED_PER_USER", "100"))
+
+class QueueFull(Exception):
+    """Raised when a user already has the maximum number of prompts waiting."""
+
+class PromptDispatcher:
+    def __init__(
+        self,
+        service: ComfyUIService,
+        tracker: PromptTracker,
+        max_in_flight: int = PROMPT_MAX_IN_FLIGHT,
+        max_queued_per_user: int = PROMPT_MAX_QUEUED_PER_USER
+    ):
+        """
+        Hold submitted prompts and feed them to ComfyUI fairly.
+
+        Each user has their own queue and users take turns, so a large batch
+        from one user doesn't delay everyone else's next prompt. Priority
+        prompts (from admins) are sent before any others. A prompt identical
+        to one that is still waiting or running is not sent again; the later
+        submitter shares the earlier prompt instead. Only a few prompts
+        are in each ComfyUI backend at a time; the next one is sent when the
+        tracker reports one finished. While no backend is healthy, prompts
+        keep waiting until one recovers.
+
+        Args:
+            service: The ComfyUI service prompts are sent to.
+            tracker: The tracker that follows the prompts once sent.
+            max_in_flight: Maximum number of unfinished prompts per healthy backend.
+            max_queued_per_user: Maximum number of waiting prompts per user.
+        """
+        self.service = service
+        self.tracker = tracker
+        self.max_in_flight = max_in_flight
+        self.max_queued_per_user = max_queued_per_user
+        # Priority tier first; each tier rotates between users' queues
+        self._tiers: List["OrderedDict[str, deque]"] = [OrderedDict(), OrderedDict()]
+        self._in_flight: Set[str] = set()
+        # Unfinished prompts by prompt hash, for coalescing identical submissions
+        self._by_hash: Dict[str, str] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, tracker: PromptTracker):
+        """
+        Free an in-flight slot whenever the tracker sees a prompt finish.
+        """
+        tracker.add_completion_listener(self.on_prompt_finished)
+
+    def submit(
+        self,
+        prompt: Dict[str, Any],
+        username: str,
+        workflow_id: Optional[int] = None,
+        priority: bool = False,
+        prompt_hash: Optional[str] = None,
+        coalesce: bool = True
+    ) -> str:
+        """
+        Queue a prompt on behalf of a user.
+
+        The prompt ID is generated here and passed on to ComfyUI, so it can be
+        tracked and reported before the prompt is sent.
+
+        Args:
+            prompt: The prompt graph.
+            username: The submitting user.
+            workflow_id: The workflow the prompt was generated from, if any.
+            priority: Send the prompt before those of regular users.
+            prompt_hash: The canonical hash of the prompt graph.
+            coalesce: Share an unfinished prompt with the same hash instead
+                of queuing a new one.
+
+        Returns:
+            The prompt ID.
+
+        Raises:
+            QueueFull: If the user has too many prompts waiting.
+        """
+        coalesce = coalesce and prompt_hash is not None
+        if coalesce and prompt_hash in self._by_hash:
+            prompt_id = self._by_hash[prompt_hash]
+            # The tracker drops a prompt from active before its completion
+            # listeners run, so a finished prompt is never shared
+            if prompt_id in self.tracker.active:
+                self.tracker.watch(prompt_id, username)
+                return prompt_id
+            del self._by_hash[prompt_hash]
+
+        if self.queued_count(username) >= self.max_queued_per_user:
+            raise QueueFull(f"At most {self.max_queued_per_user} prompts can be waiting per user")
+
+        prompt_id = str(uuid.uuid4())
+        self.tracker.track(prompt_id, username, workflow_id, status="pending", prompt_hash=prompt_hash)
+
+        if coalesce:
+            self._by_hash[prompt_hash] = prompt_id
+
+        tier = self._tiers[0 if priority else 1]
+        tier.setdefault(username, deque()).append({
+            "prompt_id": prompt_id,
+            "prompt": prompt,
+            "username": username,
+            "priority": priority,
+        })
+        self._wakeup.set()
+
+        return prompt_id
+
+    def queued_count(self, username: str) -> int:
+        """
+        Get the number of prompts a user has waiting.
+        """
+        return sum(len(tier.get(username, ())) for tier in self._tiers)
+
+    def position(self, prompt_id: str) -> Optional[int]:
+        """
+        Get a waiting prompt's place in line, 1 being the next one sent.
+
+        Returns:
+            The position, or None if the prompt is not waiting.
+        """
+        for position, job in enumerate(self._dispatch_order(), start=1):
+            if job["prompt_id"] == prompt_id:
+                return position
+
+        return None
+
+    def capacity(self) -> int:
+        """
+        Get the number of prompts that may be unfinished in ComfyUI at once.
+        """
+        healthy = sum(1 for node in self.service.nodes if node.healthy)
+        return self.max_in_flight * healthy
+
+    def _dispatch_order(self):
+        """
+        Yield the waiting prompts in the order they will be sent, assuming
+        nothing else is submitted.
+        """
+        for tier in self._tiers:
+            queues = list(tier.values())
+            for index in range(max((len(jobs) for jobs in queues), default=0)):
+                for jobs in queues:
+                    if index < len(jobs):
+                        yield jobs[index]
+
+    def _next_job(self) -> Optional[Dict[str, Any]]:
+        for tier in self._tiers:
+            if not tier:
+                continue
+
+            username, jobs = tier.popitem(last=False)
+            job = jobs.popleft()
+            # The user goes to the back of the rotation
+            if jobs:
+                tier[username] = jobs
+
+            return job
+
+        return None
+
+    def _requeue(self, job: Dict[str, Any]):
+        """
+        Put a job that could not be sent back at the head of the line.
+        """
+        tier = self._tiers[0 if job["priority"] else 1]
+        jobs = tier.get(job["username"])
+        if jobs is None:
+            jobs = tier[job["username"]] = deque()
+        tier.move_to_end(job["username"], last=False)
+        jobs.appendleft(job)
+
+    async def start(self):
+        """
+        Start the dispatch task.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the dispatch task. Prompts still waiting are not sent.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            # Backends recovering don't wake us, so look again after each health check
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.service.health_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            while len(self._in_flight) < self.capacity():
+                job = self._next_job()
+                if job is None:
+                    break
+
+                if not await self._dispatch(job):
+                    break
+
+    async def _dispatch(self, job: Dict[str, Any]) -> bool:
+        """
+        Send a job to ComfyUI.
+
+        Returns:
+            False if no backend could take it and it was put back in line.
+        """
+        prompt_id = job["prompt_id"]
+        self._in_flight.add(prompt_id)
+
+        try:
+            await self.service.queue_prompt(job["prompt"], prompt_id=prompt_id)
+        except NoBackendAvailable as e:
+            logger.warning(f"Holding prompt {prompt_id} until a ComfyUI backend is available: {e}")
+            self._in_flight.discard(prompt_id)
+            self._requeue(job)
+            return False
+        except Exception as e:
+            logger.warning(f"Failed to send prompt {prompt_id} to ComfyUI: {e}")
+            # Finishing the prompt also frees its in-flight slot
+            await self.tracker.fail(prompt_id, f"Error queuing prompt: {e}")
+            return True
+
+        await self.tracker.dispatched(prompt_id)
+        return True
+
+    async def on_prompt_finished(self, state: Dict[str, Any]):
+        """
+        Free the slot of a finished prompt and send the next one.
+        """
+        if self._by_hash.get(state.get("prompt_hash")) == state["prompt_id"]:
+            del self._by_hash[state["prompt_hash"]]
+
+        if state["prompt_id"] in self._in_flight:
+            self._in_flight.discard(state["prompt_id"])
+            self._wakeup.set()
+
+# Shared dispatcher instance used by the whole application
+prompt_dispatcher = PromptDispatcher(comfyui_service, prompt_tracker)
+prompt_dispatcher.register(prompt_tracker)
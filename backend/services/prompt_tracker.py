@@ -0,0 +1,368 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+
+import aiohttp
+
+from services.comfyui_service import ComfyUIService, ComfyUINode, comfyui_service
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before reconnecting after the websocket drops
+RECONNECT_DELAY = 2.0
+MAX_RECONNECT_DELAY = 30.0
+
+# Seconds between checks of sent prompts against ComfyUI's queue and history,
+# in case a websocket event was missed
+PROMPT_RECONCILE_INTERVAL = float(os.environ.get("PROMPT_RECONCILE_INTERVAL", "60"))
+# Seconds a prompt may stay unfinished in ComfyUI before it is given up on
+PROMPT_IN_FLIGHT_TIMEOUT = float(os.environ.get("PROMPT_IN_FLIGHT_TIMEOUT", "3600"))
+
+# Number of finished prompts kept in memory for status lookups
+MAX_FINISHED_PROMPTS = 1000
+
+# Statuses after which a prompt no longer changes
+FINISHED_STATUSES = ("completed", "error", "interrupted")
+
+CompletionListener = Callable[[Dict[str, Any]], Awaitable[None]]
+
+def user_room(username: str) -> str:
+    """Socket.IO room that every session of a user joins."""
+    return f"user:{username}"
+
+class PromptTracker:
+    def __init__(
+        self,
+        service: ComfyUIService,
+        reconcile_interval: float = PROMPT_RECONCILE_INTERVAL,
+        in_flight_timeout: float = PROMPT_IN_FLIGHT_TIMEOUT
+    ):
+        """
+        Track queued prompts over ComfyUI's websockets and relay their progress.
+
+        One websocket is kept open to each ComfyUI backend of the service.
+        Sent prompts are also checked against ComfyUI periodically, and
+        failed once in_flight_timeout passes, so none stays unfinished
+        forever when an event is lost.
+
+        Args:
+            service: The ComfyUI service whose client ID the prompts are queued under.
+            reconcile_interval: Seconds between periodic checks.
+            in_flight_timeout: Seconds a sent prompt may take to finish.
+        """
+        self.service = service
+        self.reconcile_interval = reconcile_interval
+        self.in_flight_timeout = in_flight_timeout
+        self.active: Dict[str, Dict[str, Any]] = {}
+        self.finished: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.connected: Dict[str, bool] = {}
+        self._sio = None
+        self._tasks: List[asyncio.Task] = []
+        self._completion_listeners: List[CompletionListener] = []
+
+    def attach(self, sio):
+        """
+        Attach the Socket.IO server used to relay prompt events to users.
+        """
+        self._sio = sio
+
+    def add_completion_listener(self, listener: CompletionListener):
+        """
+        Register a coroutine called with the prompt state when a prompt finishes.
+        """
+        self._completion_listeners.append(listener)
+
+    def track(
+        self,
+        prompt_id: str,
+        username: str,
+        workflow_id: Optional[int] = None,
+        status: str = "queued",
+        prompt_hash: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Start tracking a prompt queued on behalf of a user.
+
+        Args:
+            prompt_id: The ComfyUI prompt ID.
+            username: The user who submitted the prompt.
+            workflow_id: The workflow the prompt was generated from, if any.
+            status: "pending" if the prompt is still waiting to be sent to ComfyUI.
+            prompt_hash: The canonical hash of the prompt graph, if computed.
+
+        Returns:
+            The tracked prompt state.
+        """
+        state = {
+            "prompt_id": prompt_id,
+            "username": username,
+            "workflow_id": workflow_id,
+            "prompt_hash": prompt_hash,
+            # Other users who submitted the same prompt and share its events
+            "watchers": [],
+            "status": status,
+            "node": None,
+            "progress": None,
+            "outputs": {},
+            "error": None,
+            "queued_at": time.time(),
+            "dispatched_at": None if status == "pending" else time.time(),
+            "finished_at": None,
+        }
+        self.active[prompt_id] = state
+
+        return state
+
+    def watch(self, prompt_id: str, username: str):
+        """
+        Send a tracked prompt's events to another user as well.
+        """
+        state = self.active.get(prompt_id)
+        if state is not None and username != state["username"] and username not in state["watchers"]:
+            state["watchers"].append(username)
+
+    def get(self, prompt_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the tracked state of a prompt, if it is known.
+        """
+        return self.active.get(prompt_id) or self.finished.get(prompt_id)
+
+    async def dispatched(self, prompt_id: str):
+        """
+        Mark a pending prompt as sent to ComfyUI and notify its owner.
+        """
+        state = self.active.get(prompt_id)
+        if state is not None and state["status"] == "pending":
+            state["status"] = "queued"
+            state["dispatched_at"] = time.time()
+            await self._relay(state, "queued")
+
+    async def fail(self, prompt_id: str, error: str):
+        """
+        Finish a prompt that ComfyUI never accepted.
+        """
+        state = self.active.get(prompt_id)
+        if state is not None:
+            state["error"] = error
+            await self._finish(prompt_id, "error")
+
+    async def start(self):
+        """
+        Start a background websocket listener for each backend.
+        """
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run(node)) for node in self.service.nodes]
+            self._tasks.append(asyncio.create_task(self._watch()))
+
+    async def stop(self):
+        """
+        Stop the background websocket listeners.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _ws_url(self, node: ComfyUINode) -> str:
+        base = node.api_url
+        if base.startswith("https://"):
+            base = "wss://" + base[len("https://"):]
+        elif base.startswith("http://"):
+            base = "ws://" + base[len("http://"):]
+
+        return f"{base}/ws?clientId={self.service.client_id}"
+
+    async def _run(self, node: ComfyUINode):
+        """
+        Keep one websocket open to a ComfyUI backend, reconnecting with backoff.
+        """
+        delay = RECONNECT_DELAY
+
+        while True:
+            try:
+                session = await self.service._get_session()
+                async with session.ws_connect(self._ws_url(node), heartbeat=30, timeout=None) as ws:
+                    self.connected[node.api_url] = True
+                    delay = RECONNECT_DELAY
+                    logger.info(f"Connected to ComfyUI websocket at {node.api_url}")
+
+                    # Catch up on anything that finished while we were disconnected
+                    await self._reconcile(node)
+
+                    async for msg in ws:
+                        # Binary frames are live previews, which we don't relay
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            try:
+                                await self._handle_message(json.loads(msg.data))
+                            except Exception:
+                                logger.exception("Failed to handle ComfyUI event")
+                        elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                            break
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"ComfyUI websocket error at {node.api_url}: {e}")
+
+            self.connected[node.api_url] = False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    async def _watch(self):
+        """
+        Periodically reconcile every backend and fail prompts that ran too long.
+        """
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+
+            try:
+                for node in self.service.nodes:
+                    if node.healthy:
+                        await self._reconcile(node)
+                await self._expire()
+            except Exception:
+                logger.exception("Failed to check prompts against ComfyUI")
+
+    async def _expire(self):
+        """
+        Fail sent prompts that have been unfinished for longer than the timeout.
+        """
+        deadline = time.time() - self.in_flight_timeout
+
+        for prompt_id, state in list(self.active.items()):
+            if state["dispatched_at"] is not None and state["dispatched_at"] < deadline:
+                logger.warning(f"Prompt {prompt_id} did not finish within {self.in_flight_timeout} seconds")
+                await self.fail(prompt_id, "Prompt timed out")
+
+    async def _reconcile(self, node: ComfyUINode):
+        """
+        Check prompts still marked as running on a backend against its queue and history.
+        """
+        for prompt_id, state in list(self.active.items()):
+            # Prompts still waiting in our own queue aren't in ComfyUI yet
+            if state["status"] == "pending" or self.service.node_for(prompt_id) is not node:
+                continue
+
+            try:
+                result = await self.service.get_prompt_status(prompt_id)
+            except Exception as e:
+                logger.warning(f"Failed to reconcile prompt {prompt_id}: {e}")
+                continue
+
+            if result["status"] == "pending" or prompt_id not in self.active:
+                continue
+
+            state = self.active[prompt_id]
+            if result["status"] == "missing":
+                # Lost by ComfyUI, e.g. in a restart; it will never finish
+                state["error"] = "Prompt is no longer known to ComfyUI"
+                await self._finish(prompt_id, "error")
+            else:
+                state["outputs"] = result["outputs"] or state["outputs"]
+                state["error"] = result.get("error") or state["error"]
+                await self._finish(prompt_id, result["status"])
+
+    async def _handle_message(self, message: Dict[str, Any]):
+        """
+        Apply a single ComfyUI websocket event to the tracked prompt state.
+        """
+        event_type = message.get("type")
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id")
+
+        if prompt_id is None or prompt_id not in self.active:
+            return
+
+        state = self.active[prompt_id]
+
+        if event_type == "execution_start":
+            state["status"] = "running"
+            await self._relay(state, event_type)
+
+        elif event_type == "executing":
+            # A null node means the whole prompt has finished executing
+            if data.get("node") is None:
+                await self._finish(prompt_id, "completed")
+            else:
+                state["status"] = "running"
+                state["node"] = data["node"]
+                state["progress"] = None
+                await self._relay(state, event_type)
+
+        elif event_type == "progress":
+            state["progress"] = {"value": data.get("value"), "max": data.get("max")}
+            await self._relay(state, event_type)
+
+        elif event_type == "executed":
+            if data.get("output") is not None:
+                state["outputs"][data.get("node")] = data["output"]
+            await self._relay(state, event_type)
+
+        elif event_type == "execution_error":
+            state["error"] = data.get("exception_message")
+            await self._finish(prompt_id, "error")
+
+        elif event_type == "execution_interrupted":
+            await self._finish(prompt_id, "interrupted")
+
+    async def _finish(self, prompt_id: str, status: str):
+        """
+        Mark a prompt as finished, notify its owner and completion listeners.
+        """
+        state = self.active.pop(prompt_id, None)
+        if state is None:
+            return
+
+        state["status"] = status
+        state["node"] = None
+        state["finished_at"] = time.time()
+
+        self.finished[prompt_id] = state
+        while len(self.finished) > MAX_FINISHED_PROMPTS:
+            self.finished.popitem(last=False)
+
+        await self._relay(state, status)
+
+        for listener in self._completion_listeners:
+            try:
+                await listener(state)
+            except Exception:
+                logger.exception(f"Completion listener failed for prompt {prompt_id}")
+
+    async def _relay(self, state: Dict[str, Any], event: str):
+        """
+        Send the prompt's current state to every session of the users who submitted it.
+        """
+        if self._sio is None:
+            return
+
+        await self._sio.emit(
+            "prompt_update",
+            {
+                "promptId": state["prompt_id"],
+                "workflowId": state["workflow_id"],
+                "event": event,
+                "status": state["status"],
+                "node": state["node"],
+                "progress": state["progress"],
+                "outputs": format_outputs(state["outputs"]) if state["status"] == "completed" else None,
+                "error": state["error"],
+            },
+            room=[user_room(username) for username in [state["username"], *state["watchers"]]]
+        )
+
+def format_outputs(outputs: Optional[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+    """
+    Flatten ComfyUI's per-node output mapping into a list of node outputs.
+    """
+    if not outputs:
+        return None
+
+    return [{"node_id": node_id, **output} for node_id, output in outputs.items()]
+
+# Shared tracker instance used by the whole application
+prompt_tracker = PromptTracker(comfyui_service)
@@ -0,0 +1,196 @@
+import asyncio
+import io
+import logging
+import os
+import shutil
+import subprocess
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Set, Tuple
+
+from PIL import Image, ImageOps
+
+from services.blob_store import OUTPUTS_DIR
+
+logger = logging.getLogger(__name__)
+
+THUMBNAILS_DIR = os.path.join("static", "thumbnails")
+
+# Longest side, in pixels, of the thumbnails generated for each output
+THUMBNAIL_SIZES = tuple(
+    int(size) for size in os.environ.get("THUMBNAIL_SIZES", "256,512,1024").split(",")
+)
+# Processes generating thumbnails
+THUMBNAIL_WORKERS = int(os.environ.get("THUMBNAIL_WORKERS", "2"))
+# Thumbnails being generated at once, including those waiting for a process
+THUMBNAIL_CONCURRENCY = int(os.environ.get("THUMBNAIL_CONCURRENCY", "4"))
+THUMBNAIL_QUALITY = int(os.environ.get("THUMBNAIL_QUALITY", "80"))
+
+# Seconds into a video the poster frame is taken from
+POSTER_FRAME_OFFSET = "1"
+
+# Background generation tasks; the event loop only keeps weak references
+_background_tasks: Set[asyncio.Task] = set()
+
+def _poster_frame(source: str) -> Image.Image:
+    """
+    Extract an early frame of a video with ffmpeg.
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise RuntimeError("ffmpeg is required for video thumbnails")
+
+    # Seek a little in to skip black lead-in frames; fall back to the first frame
+    for offset in (POSTER_FRAME_OFFSET, "0"):
+        result = subprocess.run(
+            [ffmpeg, "-v", "error", "-ss", offset, "-i", source, "-frames:v", "1", "-f", "image2pipe", "-vcodec", "png", "-"],
+            capture_output=True,
+            timeout=60
+        )
+        if result.returncode == 0 and result.stdout:
+            return Image.open(io.BytesIO(result.stdout))
+
+    raise RuntimeError(f"Could not extract a frame: {result.stderr.decode(errors='replace')[:200]}")
+
+def generate_thumbnail(source: str, destination: str, size: int, file_type: str):
+    """
+    Write a WebP thumbnail of an image, or of a video's poster frame.
+
+    Runs in a worker process. The thumbnail is written to a temporary file
+    and renamed into place, so readers never see a partial file.
+    """
+    image = _poster_frame(source) if file_type == "video" else Image.open(source)
+
+    with image:
+        # Take the first frame of animations and respect camera rotation
+        image.seek(0)
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        image.thumbnail((size, size), Image.LANCZOS)
+
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        temp_path = f"{destination}.{uuid.uuid4().hex}.part"
+        try:
+            image.save(temp_path, "WEBP", quality=THUMBNAIL_QUALITY, method=4)
+            os.replace(temp_path, destination)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+class ThumbnailService:
+    def __init__(
+        self,
+        sizes: Tuple[int, ...] = THUMBNAIL_SIZES,
+        workers: int = THUMBNAIL_WORKERS,
+        concurrency: int = THUMBNAIL_CONCURRENCY
+    ):
+        """
+        Generate and cache WebP thumbnails of output files.
+
+        Thumbnails are generated in a process pool when an output is created,
+        or on first request if they are missing. They are cached on disk next
+        to the blob layout, so outputs sharing a blob share thumbnails too.
+
+        Args:
+            sizes: Allowed thumbnail sizes (longest side in pixels).
+            workers: Number of worker processes.
+            concurrency: Maximum number of thumbnails generated at once.
+        """
+        self.sizes = sizes
+        self.workers = workers
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    async def start(self):
+        """
+        Start the worker processes.
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    async def stop(self):
+        """
+        Stop the worker processes.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def path(self, filename: str, size: int) -> str:
+        """
+        Get where the thumbnail of a stored output file is cached.
+        """
+        return os.path.join(THUMBNAILS_DIR, f"{os.path.splitext(filename)[0]}-{size}.webp")
+
+    def supports(self, file_type: str) -> bool:
+        """
+        Check whether thumbnails can be made for a file type.
+        """
+        return file_type == "image" or (file_type == "video" and shutil.which("ffmpeg") is not None)
+
+    async def get(self, filename: str, file_type: str, size: int) -> str:
+        """
+        Get the path of a thumbnail, generating it first if it is missing.
+
+        Concurrent requests for the same missing thumbnail share one
+        generation.
+        """
+        destination = self.path(filename, size)
+        if os.path.exists(destination):
+            return destination
+
+        future = self._pending.get(destination)
+        if future is None:
+            future = asyncio.ensure_future(self._generate(filename, file_type, size, destination))
+            self._pending[destination] = future
+            future.add_done_callback(lambda _: self._pending.pop(destination, None))
+
+        await asyncio.shield(future)
+
+        return destination
+
+    async def _generate(self, filename: str, file_type: str, size: int, destination: str):
+        await self.start()
+        async with self._semaphore:
+            if os.path.exists(destination):
+                return
+
+            await asyncio.get_running_loop().run_in_executor(
+                self._executor,
+                generate_thumbnail,
+                os.path.join(OUTPUTS_DIR, filename),
+                destination,
+                size,
+                file_type
+            )
+
+    def schedule(self, filename: str, file_type: str):
+        """
+        Generate every thumbnail size of a new output in the background.
+        """
+        if self.supports(file_type):
+            task = asyncio.create_task(self._generate_all(filename, file_type))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+
+    async def _generate_all(self, filename: str, file_type: str):
+        for size in self.sizes:
+            try:
+                await self.get(filename, file_type, size)
+            except Exception as e:
+                logger.warning(f"Failed to generate {size}px thumbnail of {filename}: {e}")
+                return
+
+    def remove(self, filename: str):
+        """
+        Delete the cached thumbnails of a stored file that was removed.
+        """
+        for size in self.sizes:
+            path = self.path(filename, size)
+            if os.path.exists(path):
+                os.remove(path)
+
+# Shared service instance used by the whole application
+thumbnails = ThumbnailService()
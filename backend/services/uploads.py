@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+import os
+from typing import BinaryIO, Callable, Collection, Tuple
+
+from fastapi import HTTPException, UploadFile, status
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Size of the chunks copied from an upload to disk
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+# Room for the multipart boundaries and form fields around an uploaded file
+MULTIPART_OVERHEAD = 64 * 1024
+
+class UploadTooLarge(Exception):
+    """Raised when an upload is bigger than the allowed size."""
+
+def _write_chunk(buffer: BinaryIO, digest, chunk: bytes):
+    buffer.write(chunk)
+    digest.update(chunk)
+
+async def save_upload(
+    upload: UploadFile,
+    destination: str,
+    max_size: int,
+    chunk_size: int = UPLOAD_CHUNK_SIZE
+) -> Tuple[int, str]:
+    """
+    Copy an uploaded file to disk in chunks without blocking the event loop.
+
+    The file is written next to its destination and renamed into place
+    once complete, so a partial upload is never visible. Its SHA-256 is
+    computed during the copy.
+
+    Args:
+        upload: The uploaded file.
+        destination: The path to store the file at.
+        max_size: Maximum allowed size in bytes.
+        chunk_size: Size of the chunks copied at a time.
+
+    Returns:
+        The file size in bytes and its hex SHA-256 digest.
+
+    Raises:
+        UploadTooLarge: If the file is bigger than max_size. Nothing is
+            left on disk in that case.
+    """
+    temp_path = f"{destination}.part"
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        with open(temp_path, "wb") as buffer:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLarge(f"File is larger than {max_size} bytes")
+
+                # Disk writes and hashing run in a worker thread
+                await asyncio.to_thread(_write_chunk, buffer, digest, chunk)
+
+        os.replace(temp_path, destination)
+
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return size, digest.hexdigest()
+
+class UploadSizeLimitMiddleware:
+    def __init__(self, app: ASGIApp, paths: Collection[str], max_size: Callable[[], int]):
+        """
+        Reject upload requests whose body is too large before it is parsed.
+
+        FastAPI parses and spools the whole multipart body before a route
+        runs, so the limit has to be enforced while the body is received.
+        Requests announcing a larger Content-Length are answered with 413
+        without reading the body; chunked requests are cut off with 413 as
+        soon as they go over.
+
+        Args:
+            app: The wrapped ASGI application.
+            paths: Paths of the upload endpoints, which take POST requests.
+            max_size: Returns the largest allowed file in bytes; called per
+                request so changes to the settings apply at once.
+        """
+        self.app = app
+        self.paths = set(paths)
+        self.max_size = max_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        max_size = self.max_size()
+        limit = max_size + MULTIPART_OVERHEAD
+        detail = f"File is larger than {max_size // (1024 * 1024)} MB"
+
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse({"detail": detail}, status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI passes HTTP exceptions from body parsing through
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=detail)
+
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,663 @@
+import asyncio
+import copy
+import json
+import logging
+import os
+import weakref
+from collections import deque
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select, update
+
+from api import settings_routes
+from database.db import AsyncSessionLocal
+from models.workflow import Workflow, count_nodes, node_types
+from services.json_patch import apply_patch, PatchError
+from services.presence import aioredis, workflow_room, REDIS_URL
+from services.workflow_versions import workflow_versions
+
+logger = logging.getLogger(__name__)
+
+# Number of recent patches kept per workflow for clients catching up
+WORKFLOW_PATCH_HISTORY = int(os.environ.get("WORKFLOW_PATCH_HISTORY", "200"))
+
+class WorkflowNotFound(Exception):
+    """Raised when a workflow to sync does not exist."""
+
+class PatchRejected(Exception):
+    """Raised when a client's patch cannot be applied to the live document."""
+
+def check_root(operations: List[Dict[str, Any]]):
+    """
+    Make sure a patch keeps the workflow JSON an object.
+
+    Raises:
+        PatchRejected: If the patch replaces the root with anything else.
+    """
+    if not isinstance(operations, list):
+        raise PatchRejected("Patch must be a list of operations")
+
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get("path") != "":
+            continue
+
+        if operation.get("op") in ("add", "replace") and not isinstance(operation.get("value"), dict):
+            raise PatchRejected("The workflow must be a JSON object")
+        if operation.get("op") in ("move", "copy"):
+            raise PatchRejected("Cannot move or copy a value onto the workflow root")
+
+def patch_document(
+    document: Dict[str, Any],
+    version: int,
+    base_version: int,
+    operations: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """
+    Apply a client's patch to a document and return the patched copy.
+
+    The patch must be made against the current version. Paths in a patch
+    against an older version may point at other elements by now (array
+    indexes shift), so such a client has to catch up with sync_workflow
+    and send its change again.
+
+    Args:
+        document: The document at its current version.
+        version: The current version.
+        base_version: The version the client made the patch against.
+        operations: The patch.
+
+    Raises:
+        PatchRejected: If the patch can't be applied.
+    """
+    if base_version != version:
+        raise PatchRejected("Client is out of sync")
+
+    check_root(operations)
+
+    try:
+        return apply_patch(document, operations)
+    except PatchError as e:
+        raise PatchRejected(str(e))
+
+def patches_since(
+    history: Iterable[Tuple[int, List[Dict[str, Any]]]],
+    current: int,
+    version: int
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Get the patches made after a version, or None if they are no longer kept.
+
+    Args:
+        history: The kept (version, operations) pairs, oldest first.
+        current: The current version.
+        version: The version the client has.
+    """
+    if version > current:
+        return None
+    if version == current:
+        return []
+
+    history = list(history)
+    if not history or history[0][0] > version + 1:
+        return None
+
+    return [
+        {"version": patch_version, "ops": operations}
+        for patch_version, operations in history
+        if patch_version > version
+    ]
+
+class WorkflowDocument:
+    def __init__(self, workflow_id: str, document: Dict[str, Any], history_size: int):
+        """
+        The authoritative, versioned copy of a workflow being edited.
+
+        Args:
+            workflow_id: The workflow ID.
+            document: The workflow JSON.
+            history_size: Number of recent patches to keep.
+        """
+        self.workflow_id = workflow_id
+        self.document = document
+        self.version = 0
+        self.saved_version = 0
+        self.history: deque = deque(maxlen=history_size)
+        self.save_task: Optional[asyncio.Task] = None
+        # Counts open() calls, so a close can tell the document was reopened
+        self.opened = 0
+
+    @property
+    def dirty(self) -> bool:
+        """Whether the document has edits that are not in the database yet."""
+        return self.version != self.saved_version
+
+    def apply(self, base_version: Optional[int], operations: List[Dict[str, Any]]) -> int:
+        """
+        Apply a client's patch and return the new version.
+
+        Args:
+            base_version: The version the patch was made against, or None
+                for the current one.
+            operations: The patch.
+        """
+        if base_version is None:
+            base_version = self.version
+
+        self.document = patch_document(self.document, self.version, base_version, operations)
+        self.version += 1
+        self.history.append((self.version, operations))
+
+        return self.version
+
+    def operations_since(self, version: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Get the patches made after a version, or None if they are no longer kept.
+        """
+        return patches_since(self.history, self.version, version)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Get the full document at its current version.
+        """
+        return {
+            "workflowId": self.workflow_id,
+            "version": self.version,
+            "workflow": self.document,
+        }
+
+class WorkflowSyncManager:
+    def __init__(self, history_size: int = WORKFLOW_PATCH_HISTORY):
+        """
+        Hold the live documents of workflows that are open for editing and
+        write them back to the database.
+
+        Edits are saved at most once per auto_save_interval (from the app
+        settings) per workflow, however often they arrive, and when the last
+        editor leaves.
+
+        The documents live in this process, so this only suits a single
+        worker; RedisWorkflowSyncManager shares them between workers.
+
+        Args:
+            history_size: Number of recent patches kept per workflow.
+        """
+        self.history_size = history_size
+        self.documents: Dict[str, WorkflowDocument] = {}
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self._sio = None
+
+    def _lock(self, workflow_id: str) -> asyncio.Lock:
+        # Serializes loading and dropping the live document of a workflow
+        lock = self._locks.get(workflow_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[workflow_id] = lock
+
+        return lock
+
+    def attach(self, sio):
+        """
+        Attach the Socket.IO server used to relay changes made outside a session.
+        """
+        self._sio = sio
+
+    async def open(self, workflow_id: str) -> Dict[str, Any]:
+        """
+        Open a workflow for editing, loading it from the database if needed.
+
+        Returns:
+            A snapshot of the live document.
+        """
+        document = self.documents.get(workflow_id)
+        if document is None:
+            async with self._lock(workflow_id):
+                document = self.documents.get(workflow_id)
+                if document is None:
+                    document = WorkflowDocument(workflow_id, await self._load(workflow_id), self.history_size)
+                    self.documents[workflow_id] = document
+
+        document.opened += 1
+
+        return document.snapshot()
+
+    async def _load(self, workflow_id: str) -> Dict[str, Any]:
+        if not workflow_id.isdigit():
+            raise WorkflowNotFound(workflow_id)
+
+        async with AsyncSessionLocal() as db:
+            workflow_json = await db.scalar(select(Workflow.workflow_json).filter(Workflow.id == int(workflow_id)))
+
+        if workflow_json is None:
+            raise WorkflowNotFound(workflow_id)
+
+        return workflow_json
+
+    async def snapshot(self, workflow_id: str) -> Dict[str, Any]:
+        """
+        Get the full live document of an open workflow at its current version.
+        """
+        return self.documents[workflow_id].snapshot()
+
+    async def operations_since(self, workflow_id: str, version: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Get the patches made to an open workflow after a version, or None if
+        they are no longer kept.
+        """
+        return self.documents[workflow_id].operations_since(version)
+
+    async def apply(self, workflow_id: str, base_version: Optional[int], operations: List[Dict[str, Any]]) -> int:
+        """
+        Apply a patch to an open workflow and schedule it to be saved.
+
+        Args:
+            workflow_id: The workflow being edited.
+            base_version: The version the patch was made against, or None
+                for the current one.
+            operations: The patch.
+
+        Returns:
+            The new version of the document.
+
+        Raises:
+            PatchRejected: If the patch can't be applied.
+        """
+        document = self.documents[workflow_id]
+        version = document.apply(base_version, operations)
+        self._schedule_save(workflow_id)
+
+        return version
+
+    async def replace(self, workflow_id: str, workflow_json: Dict[str, Any]):
+        """
+        Bring an open workflow in line with a change saved through the REST API.
+
+        The new JSON is applied as a root replace patch, relayed to the
+        workflow's editors and treated as already saved.
+        """
+        operations = [{"op": "replace", "path": "", "value": workflow_json}]
+        version = await self._replace(workflow_id, operations)
+        if version is None:
+            return
+
+        if self._sio is not None:
+            await self._sio.emit(
+                "workflow_change",
+                {"workflowId": workflow_id, "version": version, "ops": operations},
+                room=workflow_room(workflow_id)
+            )
+
+    async def _replace(self, workflow_id: str, operations: List[Dict[str, Any]]) -> Optional[int]:
+        # Apply a saved change to the live document, if the workflow is open
+        document = self.documents.get(workflow_id)
+        if document is None:
+            return None
+
+        version = document.apply(None, operations)
+        document.saved_version = version
+
+        return version
+
+    def _schedule_save(self, workflow_id: str):
+        document = self.documents[workflow_id]
+        if document.save_task is None or document.save_task.done():
+            document.save_task = asyncio.create_task(self._save_later(workflow_id))
+
+    async def _save_later(self, workflow_id: str):
+        # Edits arriving while we wait are written by the same save
+        await asyncio.sleep(settings_routes.app_settings.auto_save_interval)
+        try:
+            await self.save(workflow_id)
+        except Exception:
+            logger.exception(f"Failed to save workflow {workflow_id}")
+
+        # Edits made while the save was writing, or a failed save, need
+        # another one; they couldn't schedule it while this task ran
+        document = self.documents.get(workflow_id)
+        if document is not None and document.save_task is asyncio.current_task() and document.dirty:
+            document.save_task = None
+            self._schedule_save(workflow_id)
+
+    async def save(self, workflow_id: str):
+        """
+        Write an open workflow to the workflows table if it has unsaved edits.
+        """
+        document = self.documents.get(workflow_id)
+        if document is None or not document.dirty:
+            return
+
+        version = document.version
+        # Copy so later edits can't change the JSON while it is being written
+        await self._write(workflow_id, copy.deepcopy(document.document))
+
+        document.saved_version = max(document.saved_version, version)
+
+    async def _write(self, workflow_id: str, workflow_json: Dict[str, Any]):
+        workflow_id = int(workflow_id)
+        async with AsyncSessionLocal() as db, workflow_versions.lock(workflow_id):
+            # The JSON before this save is the first version of workflows
+            # created before versioning existed
+            previous = await db.scalar(
+                select(Workflow.workflow_json).filter(Workflow.id == workflow_id).with_for_update()
+            )
+            # Nothing to write or version if the workflow was deleted meanwhile
+            if previous is None:
+                return
+
+            await db.execute(
+                update(Workflow)
+                .where(Workflow.id == workflow_id)
+                .values(
+                    workflow_json=workflow_json,
+                    node_count=count_nodes(workflow_json),
+                    node_types=node_types(workflow_json)
+                )
+            )
+            await workflow_versions.record(db, workflow_id, workflow_json, previous=previous)
+            await db.commit()
+
+    async def close(self, workflow_id: str, edited_elsewhere: bool = False):
+        """
+        Save and drop the live document of a workflow nobody on this worker
+        is editing any more.
+
+        Args:
+            workflow_id: The workflow.
+            edited_elsewhere: Whether sessions on other workers still edit it.
+        """
+        document = self.documents.get(workflow_id)
+        if document is None:
+            return
+
+        opened = document.opened
+        if document.save_task is not None and not document.save_task.done():
+            document.save_task.cancel()
+
+        while True:
+            try:
+                await self.save(workflow_id)
+                saved = True
+            except Exception:
+                logger.exception(f"Failed to save workflow {workflow_id} on close")
+                saved = False
+
+            async with self._lock(workflow_id):
+                if self.documents.get(workflow_id) is not document:
+                    return
+
+                if document.opened != opened:
+                    # Someone started editing again while it was being saved
+                    if document.dirty:
+                        self._schedule_save(workflow_id)
+                    return
+
+                if not saved or not document.dirty:
+                    del self.documents[workflow_id]
+                    return
+
+    async def close_all(self):
+        """
+        Save and drop every open document. Called on application shutdown.
+        """
+        for workflow_id in list(self.documents):
+            await self.close(workflow_id, edited_elsewhere=True)
+
+class RedisWorkflowSyncManager(WorkflowSyncManager):
+    # Raise saved_version, never lower it; saves can finish out of order
+    _MARK_SAVED = """
+        local saved = tonumber(redis.call('HGET', KEYS[1], 'saved_version') or '0')
+        if tonumber(ARGV[1]) > saved then
+            redis.call('HSET', KEYS[1], 'saved_version', ARGV[1])
+        end
+    """
+
+    def __init__(self, url: str, history_size: int = WORKFLOW_PATCH_HISTORY, prefix: str = "workflow_sync"):
+        """
+        Keep the live documents of workflows in Redis, so every worker behind
+        the load balancer applies patches to the same document and hands out
+        the same version numbers.
+
+        Patches are applied with optimistic transactions and retried when
+        another worker changed the document in between. Saves to the
+        database take a Redis lock, so only one worker writes a workflow at
+        a time.
+
+        Args:
+            url: The Redis connection URL.
+            history_size: Number of recent patches kept per workflow.
+            prefix: Prefix of the Redis keys.
+        """
+        if aioredis is None:
+            raise RuntimeError("The redis package is required when REDIS_URL is set")
+
+        super().__init__(history_size)
+        self.prefix = prefix
+        self._redis = aioredis.from_url(url, decode_responses=True)
+        # Workflows opened by this worker, with their pending save
+        self._open: Set[str] = set()
+        self._save_tasks: Dict[str, asyncio.Task] = {}
+
+    def _key(self, workflow_id: str) -> str:
+        # Hash of the document JSON, its version and the last saved version
+        return f"{self.prefix}:{workflow_id}"
+
+    def _history_key(self, workflow_id: str) -> str:
+        return f"{self.prefix}:{workflow_id}:history"
+
+    async def open(self, workflow_id: str) -> Dict[str, Any]:
+        """
+        Open a workflow for editing, loading it from the database if no
+        worker has it open.
+
+        Returns:
+            A snapshot of the live document.
+        """
+        if not await self._redis.hexists(self._key(workflow_id), "document"):
+            await self._share(workflow_id)
+
+        self._open.add(workflow_id)
+
+        return await self.snapshot(workflow_id)
+
+    async def _share(self, workflow_id: str):
+        workflow_json = await self._load(workflow_id)
+
+        # The version carries on from before, so clients never see it go back
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hsetnx(self._key(workflow_id), "document", json.dumps(workflow_json))
+            pipe.hsetnx(self._key(workflow_id), "version", 0)
+            pipe.hsetnx(self._key(workflow_id), "saved_version", 0)
+            await pipe.execute()
+
+    async def snapshot(self, workflow_id: str) -> Dict[str, Any]:
+        """
+        Get the full live document of an open workflow at its current version.
+        """
+        document, version = await self._redis.hmget(self._key(workflow_id), "document", "version")
+        if document is None:
+            await self._share(workflow_id)
+            return await self.snapshot(workflow_id)
+
+        return {
+            "workflowId": workflow_id,
+            "version": int(version),
+            "workflow": json.loads(document),
+        }
+
+    async def operations_since(self, workflow_id: str, version: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Get the patches made to an open workflow after a version, or None if
+        they are no longer kept.
+        """
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hget(self._key(workflow_id), "version")
+            pipe.lrange(self._history_key(workflow_id), 0, -1)
+            current, history = await pipe.execute()
+
+        return patches_since((json.loads(patch) for patch in history), int(current or 0), version)
+
+    async def apply(self, workflow_id: str, base_version: Optional[int], operations: List[Dict[str, Any]]) -> int:
+        """
+        Apply a patch to an open workflow and schedule it to be saved.
+
+        Args:
+            workflow_id: The workflow being edited.
+            base_version: The version the patch was made against, or None
+                for the current one.
+            operations: The patch.
+
+        Returns:
+            The new version of the document.
+
+        Raises:
+            PatchRejected: If the patch can't be applied.
+        """
+        version = await self._update(workflow_id, base_version, operations)
+        self._schedule_save(workflow_id)
+
+        return version
+
+    async def _update(
+        self,
+        workflow_id: str,
+        base_version: Optional[int],
+        operations: List[Dict[str, Any]],
+        saved: bool = False,
+        load: bool = True
+    ) -> Optional[int]:
+        # Retry until no other worker changed the document in between
+        key = self._key(workflow_id)
+        history_key = self._history_key(workflow_id)
+
+        async with self._redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    document, version = await pipe.hmget(key, "document", "version")
+                    if document is None:
+                        await pipe.unwatch()
+                        if not load:
+                            return None
+                        # Dropped by a worker whose last editor left meanwhile
+                        await self._share(workflow_id)
+                        continue
+
+                    version = int(version)
+                    document = patch_document(
+                        json.loads(document),
+                        version,
+                        version if base_version is None else base_version,
+                        operations
+                    )
+
+                    pipe.multi()
+                    pipe.hset(key, "document", json.dumps(document))
+                    pipe.hset(key, "version", version + 1)
+                    if saved:
+                        pipe.hset(key, "saved_version", version + 1)
+                    pipe.rpush(history_key, json.dumps([version + 1, operations]))
+                    pipe.ltrim(history_key, -self.history_size, -1)
+                    await pipe.execute()
+
+                    return version + 1
+                except aioredis.WatchError:
+                    continue
+
+    async def _replace(self, workflow_id: str, operations: List[Dict[str, Any]]) -> Optional[int]:
+        # Apply a saved change to the live document, if any worker has it open
+        return await self._update(workflow_id, None, operations, saved=True, load=False)
+
+    def _schedule_save(self, workflow_id: str):
+        task = self._save_tasks.get(workflow_id)
+        if task is None or task.done():
+            self._save_tasks[workflow_id] = asyncio.create_task(self._save_later(workflow_id))
+
+    async def _save_later(self, workflow_id: str):
+        await asyncio.sleep(settings_routes.app_settings.auto_save_interval)
+        try:
+            await self.save(workflow_id)
+        except Exception:
+            logger.exception(f"Failed to save workflow {workflow_id}")
+
+        # Edits made while the save was writing, or a failed save, need another one
+        if (
+            workflow_id in self._open
+            and self._save_tasks.get(workflow_id) is asyncio.current_task()
+            and await self._dirty(workflow_id)
+        ):
+            del self._save_tasks[workflow_id]
+            self._schedule_save(workflow_id)
+
+    async def _dirty(self, workflow_id: str) -> bool:
+        version, saved_version = await self._redis.hmget(self._key(workflow_id), "version", "saved_version")
+        return version != saved_version
+
+    async def save(self, workflow_id: str):
+        """
+        Write an open workflow to the workflows table if it has unsaved edits.
+        """
+        key = self._key(workflow_id)
+
+        # A worker waiting here finds nothing left to save once the first is done
+        async with self._redis.lock(f"{key}:save", timeout=60, blocking_timeout=30):
+            document, version, saved_version = await self._redis.hmget(key, "document", "version", "saved_version")
+            if document is None or version == saved_version:
+                return
+
+            await self._write(workflow_id, json.loads(document))
+            await self._redis.eval(self._MARK_SAVED, 1, key, version)
+
+    async def close(self, workflow_id: str, edited_elsewhere: bool = False):
+        """
+        Save a workflow nobody on this worker is editing any more, and drop
+        its live document if nobody on any worker is.
+
+        Args:
+            workflow_id: The workflow.
+            edited_elsewhere: Whether sessions on other workers still edit it.
+        """
+        self._open.discard(workflow_id)
+        task = self._save_tasks.pop(workflow_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+
+        try:
+            await self.save(workflow_id)
+        except Exception:
+            logger.exception(f"Failed to save workflow {workflow_id} on close")
+            return
+
+        # Someone on this worker may have started editing again meanwhile
+        if not edited_elsewhere and workflow_id not in self._open:
+            await self._drop(workflow_id)
+
+    async def _drop(self, workflow_id: str):
+        # Only drop a document that is fully saved and nobody changed meanwhile
+        key = self._key(workflow_id)
+
+        async with self._redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                version, saved_version = await pipe.hmget(key, "version", "saved_version")
+                if version != saved_version:
+                    return
+
+                pipe.multi()
+                pipe.hdel(key, "document")
+                pipe.delete(self._history_key(workflow_id))
+                await pipe.execute()
+            except aioredis.WatchError:
+                pass
+
+    async def close_all(self):
+        """
+        Save every workflow this worker has open and close the connection.
+        Called on application shutdown; the documents stay in Redis for the
+        other workers.
+        """
+        for workflow_id in list(self._open):
+            await self.close(workflow_id, edited_elsewhere=True)
+
+        await self._redis.aclose()
+
+# Shared manager instance used by the whole application
+workflow_sync = RedisWorkflowSyncManager(REDIS_URL) if REDIS_URL else WorkflowSyncManager()
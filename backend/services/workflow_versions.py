@@ -0,0 +1,179 @@
+import asyncio
+import copy
+import json
+import os
+import weakref
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select, func, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.workflow import WorkflowVersion
+from services.json_patch import apply_patch, make_patch
+
+# Most versions stored as patches between two keyframes. Rebuilding a
+# version applies at most this many patches.
+WORKFLOW_KEYFRAME_INTERVAL = int(os.environ.get("WORKFLOW_KEYFRAME_INTERVAL", "20"))
+
+class VersionNotFound(Exception):
+    """Raised when a workflow has no such version."""
+
+class WorkflowVersionStore:
+    def __init__(self, keyframe_interval: int = WORKFLOW_KEYFRAME_INTERVAL):
+        """
+        Append-only version history of workflows.
+
+        Every keyframe_interval versions, and whenever a patch would not be
+        much smaller than the workflow itself, the full JSON is stored as a
+        keyframe. Other versions store the patch from the version before, so
+        a version is rebuilt from the nearest keyframe with a bounded number
+        of patches.
+
+        Callers hold lock(workflow_id) from recording a version until the
+        session is committed, so version numbers are handed out in order.
+
+        Args:
+            keyframe_interval: Most versions between two keyframes.
+        """
+        self.keyframe_interval = keyframe_interval
+        self._locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def lock(self, workflow_id: int) -> asyncio.Lock:
+        """
+        Get the lock serializing new versions of a workflow.
+        """
+        lock = self._locks.get(workflow_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[workflow_id] = lock
+
+        return lock
+
+    async def _chain(self, db: AsyncSession, workflow_id: int, version: int) -> List[WorkflowVersion]:
+        # The nearest keyframe at or before the version, and every version after it
+        keyframe = await db.scalar(
+            select(func.max(WorkflowVersion.version))
+            .filter(
+                WorkflowVersion.workflow_id == workflow_id,
+                WorkflowVersion.is_keyframe.is_(True),
+                WorkflowVersion.version <= version
+            )
+        )
+        if keyframe is None:
+            raise VersionNotFound(f"Workflow {workflow_id} has no version {version}")
+
+        chain = (await db.scalars(
+            select(WorkflowVersion)
+            .filter(
+                WorkflowVersion.workflow_id == workflow_id,
+                WorkflowVersion.version.between(keyframe, version)
+            )
+            .order_by(WorkflowVersion.version)
+        )).all()
+        if chain[-1].version != version:
+            raise VersionNotFound(f"Workflow {workflow_id} has no version {version}")
+
+        return chain
+
+    async def get(self, db: AsyncSession, workflow_id: int, version: int) -> Dict[str, Any]:
+        """
+        Rebuild the workflow JSON of a version.
+
+        Raises:
+            VersionNotFound: If the workflow has no such version.
+        """
+        return self._rebuild(await self._chain(db, workflow_id, version))
+
+    def _rebuild(self, chain: List[WorkflowVersion]) -> Dict[str, Any]:
+        # Copy so the loaded rows are never modified
+        workflow_json = copy.deepcopy(chain[0].data)
+        for delta in chain[1:]:
+            workflow_json = apply_patch(workflow_json, delta.data)
+
+        return workflow_json
+
+    async def latest_version(self, db: AsyncSession, workflow_id: int) -> Optional[int]:
+        """
+        Get the number of the most recent version of a workflow.
+        """
+        return await db.scalar(
+            select(func.max(WorkflowVersion.version)).filter(WorkflowVersion.workflow_id == workflow_id)
+        )
+
+    async def record(
+        self,
+        db: AsyncSession,
+        workflow_id: int,
+        workflow_json: Dict[str, Any],
+        user_id: Optional[int] = None,
+        previous: Optional[Dict[str, Any]] = None
+    ) -> int:
+        """
+        Add the workflow JSON as a new version if it differs from the latest.
+
+        The version is added to the session; the caller commits it.
+
+        Args:
+            db: The session to add the version to.
+            workflow_id: The workflow that was saved.
+            workflow_json: The saved workflow JSON.
+            user_id: The user who saved it, if known.
+            previous: The JSON the workflow held before this save. It
+                becomes the first version of workflows saved before
+                versioning existed, so their earlier state is kept.
+
+        Returns:
+            The number of the new version, or of the latest one if nothing
+            changed.
+        """
+        latest = await self.latest_version(db, workflow_id)
+
+        if latest is None and previous is not None:
+            db.add(WorkflowVersion(
+                workflow_id=workflow_id,
+                version=1,
+                is_keyframe=True,
+                data=copy.deepcopy(previous)
+            ))
+            await db.flush()
+            latest = 1
+
+        if latest is None:
+            db.add(WorkflowVersion(
+                workflow_id=workflow_id,
+                version=1,
+                is_keyframe=True,
+                data=copy.deepcopy(workflow_json),
+                user_id=user_id
+            ))
+            return 1
+
+        chain = await self._chain(db, workflow_id, latest)
+        operations = make_patch(self._rebuild(chain), workflow_json)
+        if not operations:
+            return latest
+
+        # A patch about as big as the workflow saves nothing over a keyframe
+        is_keyframe = (
+            len(chain) >= self.keyframe_interval
+            or len(json.dumps(operations)) * 2 > len(json.dumps(workflow_json))
+        )
+
+        db.add(WorkflowVersion(
+            workflow_id=workflow_id,
+            version=latest + 1,
+            is_keyframe=is_keyframe,
+            data=copy.deepcopy(workflow_json) if is_keyframe else operations,
+            user_id=user_id
+        ))
+
+        return latest + 1
+
+    async def delete(self, db: AsyncSession, workflow_id: int):
+        """
+        Delete the history of a workflow. The caller commits.
+        """
+        await db.execute(delete(WorkflowVersion).where(WorkflowVersion.workflow_id == workflow_id))
+
+# Shared version store used by the whole application
+workflow_versions = WorkflowVersionStore()
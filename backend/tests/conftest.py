@@ -0,0 +1,30 @@
+import asyncio
+
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from database.db import Base
+# Every model must be imported so its table is created
+from models import prompt, user, workflow  # noqa: F401
+
+@pytest.fixture
+def run_with_db():
+    """
+    Run a coroutine function with a session on a fresh in-memory database.
+    """
+    def run(test):
+        async def main():
+            engine = create_async_engine("sqlite+aiosqlite://")
+            async with engine.begin() as connection:
+                await connection.run_sync(Base.metadata.create_all)
+
+            try:
+                session = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+                async with session() as db:
+                    return await test(db)
+            finally:
+                await engine.dispose()
+
+        return asyncio.run(main())
+
+    return run
@@ -0,0 +1,69 @@
+import asyncio
+import hashlib
+import os
+
+from models.workflow import Output
+from services.blob_store import BlobStore, hash_file
+
+def _write(store, content):
+    temp_path = store.temp_path()
+    with open(temp_path, "wb") as file:
+        file.write(content)
+
+    return temp_path, hashlib.sha256(content).hexdigest()
+
+def _output(name, content_hash):
+    return Output(workflow_id=1, user_id=1, filename=name, original_filename="a.png", file_type="image", file_size=5, content_hash=content_hash)
+
+def test_hash_file(tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(b"content")
+
+    assert hash_file(str(path)) == hashlib.sha256(b"content").hexdigest()
+
+def test_identical_files_share_a_blob(tmp_path):
+    store = BlobStore(str(tmp_path))
+    first, content_hash = _write(store, b"image")
+    second, _ = _write(store, b"image")
+
+    async def store_both():
+        return await store.store(first, content_hash, ".PNG"), await store.store(second, content_hash, ".png")
+
+    name, again = asyncio.run(store_both())
+
+    assert name == again == f"{content_hash[:2]}/{content_hash[2:4]}/{content_hash}.png"
+    assert os.path.exists(store.path(name))
+    assert not os.path.exists(first) and not os.path.exists(second)
+
+def test_blob_is_removed_with_its_last_reference(tmp_path, run_with_db):
+    store = BlobStore(str(tmp_path))
+
+    async def test(db):
+        temp_path, content_hash = _write(store, b"image")
+        async with store.lock(db, store.blob_name(content_hash, ".png")):
+            name = await store.store(temp_path, content_hash, ".png")
+            first, second = _output(name, content_hash), _output(name, content_hash)
+            db.add_all([first, second])
+            await db.commit()
+
+        removed = []
+        for output in (first, second):
+            async with store.lock(db, name):
+                await db.delete(output)
+                await db.commit()
+                removed.append((await store.release(db, name), os.path.exists(store.path(name))))
+                await db.commit()
+
+        return removed
+
+    assert run_with_db(test) == [(False, True), (True, False)]
+
+def test_discard_removes_temporary_files(tmp_path):
+    store = BlobStore(str(tmp_path))
+    temp_path, _ = _write(store, b"partial")
+
+    store.discard(temp_path)
+    store.discard(temp_path)
+    store.discard(None)
+
+    assert not os.path.exists(temp_path)
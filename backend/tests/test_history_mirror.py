@@ -0,0 +1,27 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from models.prompt import PromptRecord
+from services import history_mirror as mirror
+from services.history_mirror import HistoryMirror
+
+def test_owner_is_filled_in_on_a_mirrored_prompt(monkeypatch, run_with_db):
+    async def test(db):
+        monkeypatch.setattr(mirror, "AsyncSessionLocal", async_sessionmaker(db.bind, expire_on_commit=False))
+        history = HistoryMirror(None, None)
+
+        await history._save([{"prompt_id": "a", "status": "completed", "outputs": None}])
+        await history._save([{
+            "prompt_id": "a",
+            "user_id": None,
+            "workflow_id": 3,
+            "prompt_hash": "hash",
+            "status": "error",
+            "outputs": None,
+        }])
+        await history._save([{"prompt_id": "a", "workflow_id": 4, "prompt_hash": "other", "status": "completed"}])
+
+        record = (await db.scalars(select(PromptRecord))).one()
+        return record.workflow_id, record.prompt_hash, record.status
+
+    assert run_with_db(test) == (3, "hash", "completed")
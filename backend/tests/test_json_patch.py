@@ -0,0 +1,91 @@
+import copy
+
+import pytest
+
+from services.json_patch import PatchError, apply_patch, make_patch
+
+def test_apply_patch_operations():
+    document = {"nodes": [{"id": 1}, {"id": 2}], "links": [], "extra": {"a/b": 1}}
+
+    result = apply_patch(document, [
+        {"op": "add", "path": "/nodes/-", "value": {"id": 3}},
+        {"op": "remove", "path": "/nodes/0"},
+        {"op": "replace", "path": "/extra/a~1b", "value": 2},
+        {"op": "copy", "from": "/nodes/0", "path": "/first"},
+        {"op": "move", "from": "/first", "path": "/links/0"},
+        {"op": "test", "path": "/links/0/id", "value": 2},
+    ])
+
+    assert result == {"nodes": [{"id": 2}, {"id": 3}], "links": [{"id": 2}], "extra": {"a/b": 2}}
+
+def test_apply_patch_replaces_root():
+    assert apply_patch({"a": 1}, [{"op": "replace", "path": "", "value": {"b": 2}}]) == {"b": 2}
+
+@pytest.mark.parametrize("operation", [
+    {"op": "remove", "path": "/missing"},
+    {"op": "replace", "path": "/nodes/5", "value": 1},
+    {"op": "add", "path": "/nodes/x", "value": 1},
+    {"op": "test", "path": "/nodes/0/id", "value": 2},
+    {"op": "move", "from": "/nodes", "path": "/nodes/0"},
+    {"op": "frobnicate", "path": "/nodes"},
+    {"path": "/nodes"},
+    {"op": "remove", "path": 5},
+    {"op": "add", "path": ["nodes"], "value": 1},
+    {"op": "copy", "from": 0, "path": "/nodes/-"},
+    {"op": "move", "from": None, "path": "/links"},
+])
+def test_apply_patch_rejects_and_rolls_back(operation):
+    document = {"nodes": [{"id": 1}], "links": []}
+    original = copy.deepcopy(document)
+
+    # The first operation succeeds and must be undone when the second fails
+    with pytest.raises(PatchError):
+        apply_patch(document, [{"op": "add", "path": "/links/-", "value": [1, 2]}, operation])
+
+    assert document == original
+
+@pytest.mark.parametrize("source, target", [
+    ({"a": 1}, {"a": 1}),
+    ({"a": 1, "b": {"c": [1, 2, 3]}}, {"a": 2, "b": {"c": [1, 3]}, "d": None}),
+    ({"list": [1, 2, 3, 4, 5]}, {"list": [0, 1, 2, 3, 4, 5, 6]}),
+    ({"list": [1, 2, 3]}, {"list": []}),
+    ({"flag": 1}, {"flag": True}),
+    ({"value": 1}, {"value": 1.0}),
+    ({"a~b": {"c/d": 1}}, {"a~b": {"c/d": 2}}),
+    ([1, {"x": 1}], {"now": "an object"}),
+])
+def test_make_patch_round_trips(source, target):
+    operations = make_patch(source, target)
+
+    result = apply_patch(copy.deepcopy(source), operations)
+
+    assert result == target
+    assert [type(value) for value in _leaves(result)] == [type(value) for value in _leaves(target)]
+
+def test_make_patch_is_empty_for_equal_documents():
+    assert make_patch({"a": [1, {"b": 2}]}, {"a": [1, {"b": 2}]}) == []
+
+def test_make_patch_touches_only_the_changed_part():
+    source = {"nodes": [{"id": index, "widgets": [index, "text"]} for index in range(50)]}
+    target = copy.deepcopy(source)
+    target["nodes"][20]["widgets"][0] = -1
+
+    assert make_patch(source, target) == [{"op": "replace", "path": "/nodes/20/widgets/0", "value": -1}]
+
+def test_make_patch_does_not_share_values_with_the_target():
+    target = {"a": {"b": [1]}}
+    operations = make_patch({}, target)
+
+    target["a"]["b"].append(2)
+
+    assert operations == [{"op": "add", "path": "/a", "value": {"b": [1]}}]
+
+def _leaves(value):
+    if isinstance(value, dict):
+        for key in sorted(value):
+            yield from _leaves(value[key])
+    elif isinstance(value, list):
+        for item in value:
+            yield from _leaves(item)
+    else:
+        yield value
@@ -0,0 +1,24 @@
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from api.output_routes import decode_cursor, encode_cursor
+from models.workflow import Output
+
+@pytest.mark.parametrize("created_at", [
+    datetime(2024, 5, 1, 12, 30, 15),
+    datetime(2024, 5, 1, 12, 30, 15, 123456),
+])
+def test_cursor_round_trips(created_at):
+    cursor = encode_cursor(Output(id=42, created_at=created_at))
+
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (created_at, 42)
+
+@pytest.mark.parametrize("cursor", ["", "not base64!", "bm9waXBl", "MjAyNHwx", "eDp8eA"])
+def test_invalid_cursor_is_a_bad_request(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+
+    assert error.value.status_code == 400
@@ -0,0 +1,41 @@
+import asyncio
+import hashlib
+import os
+
+from services import output_ingestion as ingestion
+from services.blob_store import BlobStore
+from services.output_ingestion import OutputIngestionWorker
+
+def _job(prompt_id):
+    return {"prompt_id": prompt_id, "username": "alice", "workflow_id": 1, "files": []}
+
+def test_overflow_is_capped():
+    worker = OutputIngestionWorker(None, queue_size=1, max_overflow=1)
+
+    for prompt_id in ("a", "b", "c"):
+        worker.enqueue(_job(prompt_id))
+
+    assert worker.queue.get_nowait()["prompt_id"] == "a"
+    assert [job["prompt_id"] for job in worker._overflow] == ["b"]
+
+def test_failed_save_removes_temp_files_and_new_blobs(tmp_path, monkeypatch, run_with_db):
+    store = BlobStore(str(tmp_path))
+    monkeypatch.setattr(ingestion, "blob_store", store)
+    worker = OutputIngestionWorker(None)
+
+    stored_path, pending_path = store.temp_path(), store.temp_path()
+    for path in (stored_path, pending_path):
+        with open(path, "wb") as file:
+            file.write(b"image")
+    content_hash = hashlib.sha256(b"image").hexdigest()
+    files = [{"temp_path": stored_path}, {"temp_path": pending_path}]
+
+    async def test(db):
+        name = await store.store(stored_path, content_hash, ".png")
+        await worker._abandon(db, _job("a"), files, {name})
+        return name
+
+    name = run_with_db(test)
+
+    assert not os.path.exists(store.path(name))
+    assert not os.path.exists(pending_path)
@@ -0,0 +1,41 @@
+import asyncio
+
+from services.prompt_queue import PromptDispatcher
+from services.prompt_tracker import PromptTracker
+
+def _dispatcher():
+    tracker = PromptTracker(None)
+    return PromptDispatcher(None, tracker), tracker
+
+def test_identical_prompts_share_an_unfinished_prompt():
+    dispatcher, tracker = _dispatcher()
+
+    first = dispatcher.submit({}, "alice", prompt_hash="hash")
+    second = dispatcher.submit({}, "bob", prompt_hash="hash")
+
+    assert first == second
+    assert tracker.active[first]["watchers"] == ["bob"]
+
+def test_finished_prompt_is_not_shared():
+    dispatcher, tracker = _dispatcher()
+    first = dispatcher.submit({}, "alice", prompt_hash="hash")
+    resubmitted = []
+
+    async def resubmit(state):
+        # Runs before the dispatcher's own completion listener
+        resubmitted.append(dispatcher.submit({}, "bob", prompt_hash="hash"))
+
+    tracker.add_completion_listener(resubmit)
+    dispatcher.register(tracker)
+    asyncio.run(tracker._finish(first, "completed"))
+
+    assert resubmitted[0] != first
+    assert resubmitted[0] in tracker.active
+
+def test_uncoalesced_prompt_is_not_shared():
+    dispatcher, _ = _dispatcher()
+
+    first = dispatcher.submit({}, "alice", prompt_hash="hash", coalesce=False)
+    second = dispatcher.submit({}, "bob", prompt_hash="hash")
+
+    assert first != second
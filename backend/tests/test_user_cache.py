@@ -0,0 +1,12 @@
+from auth.user_cache import UserCache
+from models.user import User
+
+def test_invalidate_drops_every_given_username():
+    cache = UserCache()
+    for username in ("old", "new", "other"):
+        cache.set(username, User(username=username))
+
+    cache.invalidate("old", "new")
+
+    assert cache.get("old") is None and cache.get("new") is None
+    assert cache.get("other").username == "other"
@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+from api import settings_routes
+from services.workflow_sync import PatchRejected, WorkflowDocument, WorkflowSyncManager, check_root
+
+def _document(history_size=3):
+    return WorkflowDocument("1", {"nodes": []}, history_size)
+
+def test_apply_hands_out_versions():
+    document = _document()
+
+    assert document.apply(0, [{"op": "add", "path": "/nodes/-", "value": 1}]) == 1
+    assert document.apply(None, [{"op": "add", "path": "/nodes/-", "value": 2}]) == 2
+    assert document.apply(2, [{"op": "add", "path": "/links", "value": []}]) == 3
+    assert document.snapshot() == {"workflowId": "1", "version": 3, "workflow": {"nodes": [1, 2], "links": []}}
+
+@pytest.mark.parametrize("base_version", [0, 2, 4, -1])
+def test_apply_rejects_clients_out_of_sync(base_version):
+    document = _document()
+    for _ in range(3):
+        document.apply(None, [{"op": "add", "path": "/nodes/-", "value": 1}])
+
+    with pytest.raises(PatchRejected):
+        document.apply(base_version, [])
+
+def test_concurrent_index_edits_are_not_misapplied():
+    document = WorkflowDocument("1", {"nodes": ["A", "B", "C"]}, 3)
+    document.apply(0, [{"op": "add", "path": "/nodes/1", "value": "X"}])
+
+    # Made against version 0 to delete B, which is at /nodes/2 by now
+    with pytest.raises(PatchRejected):
+        document.apply(0, [{"op": "remove", "path": "/nodes/1"}])
+
+    assert document.document == {"nodes": ["A", "X", "B", "C"]}
+
+@pytest.mark.parametrize("operations", [
+    {"op": "replace", "path": "", "value": {}},
+    [{"op": "replace", "path": "", "value": None}],
+    [{"op": "add", "path": "", "value": [1]}],
+    [{"op": "move", "from": "/nodes", "path": ""}],
+    [{"op": "remove", "path": "/missing"}],
+])
+def test_apply_rejects_invalid_patches(operations):
+    document = _document()
+
+    with pytest.raises(PatchRejected):
+        document.apply(None, operations)
+
+    assert document.snapshot()["version"] == 0
+    assert document.document == {"nodes": []}
+
+def test_check_root_allows_object_roots():
+    check_root([{"op": "replace", "path": "", "value": {"nodes": []}}, {"op": "remove", "path": "/nodes"}])
+
+def test_operations_since():
+    document = _document(history_size=2)
+    for value in range(3):
+        document.apply(None, [{"op": "add", "path": "/nodes/-", "value": value}])
+
+    assert document.operations_since(3) == []
+    assert document.operations_since(2) == [{"version": 3, "ops": [{"op": "add", "path": "/nodes/-", "value": 2}]}]
+    assert [patch["version"] for patch in document.operations_since(1)] == [2, 3]
+    # Version 1 has dropped out of the history, and 4 doesn't exist yet
+    assert document.operations_since(0) is None
+    assert document.operations_since(4) is None
+
+def _manager(written, write_delay):
+    manager = WorkflowSyncManager()
+
+    async def load(workflow_id):
+        return {"nodes": []}
+
+    async def write(workflow_id, workflow_json):
+        await asyncio.sleep(write_delay)
+        written.append(workflow_json)
+
+    manager._load = load
+    manager._write = write
+    return manager
+
+def _add(value):
+    return [{"op": "add", "path": "/nodes/-", "value": value}]
+
+def test_edits_made_while_saving_are_saved_too(monkeypatch):
+    monkeypatch.setattr(settings_routes.app_settings, "auto_save_interval", 0.01)
+    written = []
+    manager = _manager(written, write_delay=0.1)
+
+    async def test():
+        await manager.open("1")
+        await manager.apply("1", 0, _add(1))
+        # The first save is writing version 1 now
+        await asyncio.sleep(0.05)
+        await manager.apply("1", 1, _add(2))
+        await asyncio.sleep(0.3)
+        return manager.documents["1"]
+
+    document = asyncio.run(test())
+
+    assert written == [{"nodes": [1]}, {"nodes": [1, 2]}]
+    assert not document.dirty
+
+def test_close_keeps_a_document_reopened_while_saving():
+    written = []
+    manager = _manager(written, write_delay=0.05)
+
+    async def test():
+        await manager.open("1")
+        await manager.apply("1", 0, _add(1))
+        closing = asyncio.create_task(manager.close("1"))
+        await asyncio.sleep(0.01)
+        # Someone joins and edits while the last editor's close is saving
+        await manager.open("1")
+        await manager.apply("1", 1, _add(2))
+        await closing
+        snapshot = await manager.snapshot("1")
+        await manager.close("1")
+        return snapshot
+
+    snapshot = asyncio.run(test())
+
+    assert snapshot["workflow"] == {"nodes": [1, 2]}
+    assert written[-1] == {"nodes": [1, 2]}
+    assert "1" not in manager.documents
@@ -0,0 +1,91 @@
+import pytest
+
+from services.workflow_versions import VersionNotFound, WorkflowVersionStore
+
+def _workflow(nodes):
+    return {"nodes": [{"id": index, "type": "KSampler", "widgets_values": [index, 20, 7.5]} for index in range(nodes)]}
+
+def test_record_stores_patches_between_keyframes(run_with_db):
+    store = WorkflowVersionStore(keyframe_interval=3)
+    saved = [_workflow(10 + index) for index in range(5)]
+
+    async def test(db):
+        versions = []
+        for workflow_json in saved:
+            versions.append(await store.record(db, 1, workflow_json, user_id=7))
+            await db.commit()
+
+        chain = await store._chain(db, 1, 5)
+        rebuilt = [await store.get(db, 1, version) for version in versions]
+        return versions, [row.version for row in chain], [row.is_keyframe for row in chain], rebuilt
+
+    versions, chain, keyframes, rebuilt = run_with_db(test)
+
+    assert versions == [1, 2, 3, 4, 5]
+    # Version 4 starts a new keyframe after three versions; 5 is a patch on it
+    assert chain == [4, 5]
+    assert keyframes == [True, False]
+    assert rebuilt == saved
+
+def test_record_skips_unchanged_json(run_with_db):
+    store = WorkflowVersionStore()
+
+    async def test(db):
+        first = await store.record(db, 1, _workflow(10))
+        await db.commit()
+        second = await store.record(db, 1, _workflow(10))
+        await db.commit()
+        return first, second, await store.latest_version(db, 1)
+
+    assert run_with_db(test) == (1, 1, 1)
+
+def test_record_keeps_previous_json_of_unversioned_workflows(run_with_db):
+    store = WorkflowVersionStore()
+
+    async def test(db):
+        version = await store.record(db, 1, _workflow(11), previous=_workflow(10))
+        await db.commit()
+        return version, await store.get(db, 1, 1), await store.get(db, 1, 2)
+
+    assert run_with_db(test) == (2, _workflow(10), _workflow(11))
+
+def test_restore_is_a_new_version(run_with_db):
+    store = WorkflowVersionStore()
+
+    async def test(db):
+        for nodes in (10, 11, 12):
+            await store.record(db, 1, _workflow(nodes))
+            await db.commit()
+
+        # Restoring version 1 records its JSON again on top of the history
+        restored = await store.record(db, 1, await store.get(db, 1, 1))
+        await db.commit()
+        return restored, await store.get(db, 1, restored), await store.get(db, 1, 3)
+
+    assert run_with_db(test) == (4, _workflow(10), _workflow(12))
+
+def test_unknown_versions_raise(run_with_db):
+    store = WorkflowVersionStore()
+
+    async def test(db):
+        await store.record(db, 1, _workflow(1))
+        await db.commit()
+
+        for workflow_id, version in ((1, 2), (1, 0), (2, 1)):
+            with pytest.raises(VersionNotFound):
+                await store.get(db, workflow_id, version)
+
+    run_with_db(test)
+
+def test_delete_removes_only_that_workflow(run_with_db):
+    store = WorkflowVersionStore()
+
+    async def test(db):
+        await store.record(db, 1, _workflow(1))
+        await store.record(db, 2, _workflow(2))
+        await db.commit()
+        await store.delete(db, 1)
+        await db.commit()
+        return await store.latest_version(db, 1), await store.latest_version(db, 2)
+
+    assert run_with_db(test) == (None, 1)
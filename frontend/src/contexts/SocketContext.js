@@ -1,6 +1,7 @@
-import React, { createContext, useContext, useEffect, useState } from 'react';
+import React, { createContext, useCallback, useContext, useEffect, useRef, useState } from 'react';
 import { io } from 'socket.io-client';
 import { useAuth } from './AuthContext';
+import { applyPatch, createPatch } from '../utils/jsonPatch';
 
 const SocketContext = createContext();
 
@@ -14,8 +15,41 @@ export function SocketProvider({ children }) {
   const [users, setUsers] = useState({});
   const [cursors, setCursors] = useState({});
   const [selectedNodes, setSelectedNodes] = useState({});
+  const [prompts, setPrompts] = useState({});
+  const [workflow, setWorkflow] = useState(null);
+  // Last workflow state confirmed by the server: { workflowId, version, workflow }
+  const syncedWorkflowRef = useRef(null);
   const { isAuthenticated, currentUser } = useAuth();
 
+  const setSyncedWorkflow = (synced) => {
+    syncedWorkflowRef.current = synced;
+    setWorkflow(synced);
+  };
+
+  // Catch up with the server after missing a change: replay the missed
+  // patches, or start over from a snapshot if the server no longer has them
+  const resyncWorkflow = (targetSocket) => {
+    const synced = syncedWorkflowRef.current;
+    if (!synced) return;
+
+    targetSocket.emit(
+      'sync_workflow',
+      { workflowId: synced.workflowId, version: synced.version },
+      (response) => {
+        if (!response || response.error) return;
+        if (response.snapshot) {
+          setSyncedWorkflow(response.snapshot);
+          return;
+        }
+        const current = syncedWorkflowRef.current;
+        const caughtUp = response.patches
+          .filter((patch) => patch.version > current.version)
+          .reduce((doc, patch) => applyPatch(doc, patch.ops), current.workflow);
+        setSyncedWorkflow({ ...current, version: response.version, workflow: caughtUp });
+      },
+    );
+  };
+
   // Initialize socket connection when authenticated
   useEffect(() => {
     if (!isAuthenticated || !currentUser) {
@@ -54,16 +88,21 @@ export function SocketProvider({ children }) {
     });
 
     newSocket.on('cursor_update', (data) => {
-      setCursors((prevCursors) => ({
-        ...prevCursors,
-        [data.userId]: {
-          x: data.x,
-          y: data.y,
-          username: data.username,
-          color: data.color,
-          timestamp: Date.now(),
-        },
-      }));
+      // The server sends the latest cursor of every user in the workflow in one batch
+      const timestamp = Date.now();
+      setCursors((prevCursors) => {
+        const newCursors = { ...prevCursors };
+        data.cursors.forEach((cursor) => {
+          newCursors[cursor.userId] = {
+            x: cursor.x,
+            y: cursor.y,
+            username: cursor.username,
+            color: cursor.color,
+            timestamp,
+          };
+        });
+        return newCursors;
+      });
     });
 
     newSocket.on('node_update', (data) => {
@@ -79,9 +118,31 @@ export function SocketProvider({ children }) {
     });
 
     newSocket.on('workflow_change', (data) => {
-      // Handle workflow changes from other users
-      console.log('Workflow changed by', data.username);
-      // You would update your workflow state here
+      // Apply patches made by other users to our copy of the workflow
+      const synced = syncedWorkflowRef.current;
+      if (!synced || synced.workflowId !== data.workflowId || data.version <= synced.version) {
+        return;
+      }
+      if (data.version !== synced.version + 1) {
+        resyncWorkflow(newSocket);
+        return;
+      }
+      setSyncedWorkflow({
+        ...synced,
+        version: data.version,
+        workflow: applyPatch(synced.workflow, data.ops),
+      });
+    });
+
+    newSocket.on('prompt_update', (data) => {
+      // Progress and completion of prompts queued by the current user
+      setPrompts((prevPrompts) => ({
+        ...prevPrompts,
+        [data.promptId]: {
+          ...data,
+          timestamp: Date.now(),
+        },
+      }));
     });
 
     setSocket(newSocket);
@@ -123,6 +184,34 @@ export function SocketProvider({ children }) {
     return () => clearInterval(interval);
   }, []);
 
+  // Join a workflow's collaboration room; cursors, selections and changes
+  // are only exchanged with other sessions editing the same workflow
+  const joinWorkflow = useCallback((workflowId) => {
+    if (socket && connected && workflowId) {
+      setCursors({});
+      setSelectedNodes({});
+      socket.emit('join_workflow', { workflowId }, (response) => {
+        // The server answers with a full snapshot of the live workflow
+        if (response && !response.error) {
+          setSyncedWorkflow({
+            workflowId: response.workflowId,
+            version: response.version,
+            workflow: response.workflow,
+          });
+        }
+      });
+    }
+  }, [socket, connected]);
+
+  // Leave a workflow's collaboration room
+  const leaveWorkflow = useCallback((workflowId) => {
+    if (socket && connected && workflowId) {
+      socket.emit('leave_workflow', { workflowId });
+      setUsers({});
+      setSyncedWorkflow(null);
+    }
+  }, [socket, connected]);
+
   // Function to update cursor position
   const updateCursorPosition = (x, y) => {
     if (socket && connected && currentUser) {
@@ -149,14 +238,28 @@ export function SocketProvider({ children }) {
   };
 
   // Function to broadcast workflow changes
+  // Send only the changes between the last synced workflow and the new one
   const broadcastWorkflowChange = (workflowData) => {
-    if (socket && connected && currentUser) {
-      socket.emit('workflow_update', {
-        userId: currentUser.id,
-        username: currentUser.username,
-        workflowData,
-      });
-    }
+    const synced = syncedWorkflowRef.current;
+    if (!socket || !connected || !currentUser || !synced) return;
+
+    const ops = createPatch(synced.workflow, workflowData);
+    if (ops.length === 0) return;
+
+    socket.emit(
+      'workflow_patch',
+      { workflowId: synced.workflowId, baseVersion: synced.version, ops },
+      (response) => {
+        if (!response) return;
+        if (response.snapshot) {
+          setSyncedWorkflow(response.snapshot);
+        } else if (response.version === synced.version + 1) {
+          setSyncedWorkflow({ ...synced, version: response.version, workflow: workflowData });
+        } else {
+          resyncWorkflow(socket);
+        }
+      },
+    );
   };
 
   const value = {
@@ -165,6 +268,10 @@ export function SocketProvider({ children }) {
     users,
     cursors,
     selectedNodes,
+    prompts,
+    workflow,
+    joinWorkflow,
+    leaveWorkflow,
     updateCursorPosition,
     updateSelectedNodes,
     broadcastWorkflowChange,
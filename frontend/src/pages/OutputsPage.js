@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useAuth } from '../contexts/AuthContext';
 import {
   Box,
@@ -47,6 +47,8 @@ function OutputsPage() {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [searchQuery, setSearchQuery] = useState('');
+  // Outputs matching the search query, best first, or null when not searching
+  const [searchResults, setSearchResults] = useState(null);
   const [selectedWorkflow, setSelectedWorkflow] = useState('all');
   const [sortBy, setSortBy] = useState('newest');
   const [workflows, setWorkflows] = useState([]);
@@ -57,6 +59,9 @@ function OutputsPage() {
   const [detailsDialogOpen, setDetailsDialogOpen] = useState(false);
   const [selectedOutput, setSelectedOutput] = useState(null);
   const [snackbar, setSnackbar] = useState({ open: false, message: '', severity: 'info' });
+  // Latest loaded outputs, so search can reuse them without rerunning
+  const outputsRef = useRef(outputs);
+  outputsRef.current = outputs;
   
   // Fetch outputs and workflows
   useEffect(() => {
@@ -83,9 +88,53 @@ function OutputsPage() {
     fetchData();
   }, [apiClient]);
   
+  // Search outputs on the server once the user stops typing
+  useEffect(() => {
+    if (!searchQuery.trim()) {
+      setSearchResults(null);
+      return undefined;
+    }
+    
+    let cancelled = false;
+    const timer = setTimeout(async () => {
+      try {
+        const response = await apiClient.get('/api/search', {
+          params: { q: searchQuery, kind: 'output', limit: 100 },
+        });
+        const ids = response.data.items.map((item) => item.id);
+        
+        // Matches need not be among the loaded outputs; fetch the others
+        const known = new Map(outputsRef.current.map((output) => [output.id, output]));
+        const fetched = await Promise.all(
+          ids
+            .filter((id) => !known.has(id))
+            .map((id) =>
+              apiClient.get(`/api/outputs/${id}`).then(
+                (outputResponse) => outputResponse.data,
+                () => null
+              )
+            )
+        );
+        fetched.filter(Boolean).forEach((output) => known.set(output.id, output));
+        
+        if (!cancelled) {
+          setSearchResults(ids.map((id) => known.get(id)).filter(Boolean));
+        }
+      } catch (err) {
+        console.error(err);
+      }
+    }, 300);
+    
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [apiClient, searchQuery]);
+  
   // Filter and sort outputs
   useEffect(() => {
-    let filtered = [...outputs];
+    // Search results replace the loaded outputs while searching
+    let filtered = [...(searchResults || outputs)];
     
     // Filter by workflow
     if (selectedWorkflow !== 'all') {
@@ -94,18 +143,6 @@ function OutputsPage() {
       );
     }
     
-    // Filter by search query
-    if (searchQuery) {
-      const query = searchQuery.toLowerCase();
-      filtered = filtered.filter(
-        (output) =>
-          output.filename.toLowerCase().includes(query) ||
-          (output.metadata &&
-            output.metadata.description &&
-            output.metadata.description.toLowerCase().includes(query))
-      );
-    }
-    
     // Filter by tab (file type)
     if (tabValue === 1) {
       filtered = filtered.filter((output) => output.file_type === 'image');
@@ -123,7 +160,7 @@ function OutputsPage() {
     }
     
     setFilteredOutputs(filtered);
-  }, [outputs, searchQuery, selectedWorkflow, sortBy, tabValue]);
+  }, [outputs, searchResults, selectedWorkflow, sortBy, tabValue]);
   
   // Handle delete output
   const handleDeleteOutput = async () => {
@@ -137,6 +174,9 @@ function OutputsPage() {
       setOutputs((prevOutputs) =>
         prevOutputs.filter((output) => output.id !== outputToDelete.id)
       );
+      setSearchResults((prevResults) =>
+        prevResults && prevResults.filter((output) => output.id !== outputToDelete.id)
+      );
       
       setSnackbar({
         open: true,
@@ -283,10 +323,17 @@ function OutputsPage() {
                   component="img"
                   height="200"
                   image={
-                    output.file_type === 'image'
-                      ? `${process.env.REACT_APP_API_URL}/static/outputs/${output.filename}`
+                    output.file_type === 'image' || output.file_type === 'video'
+                      ? `${process.env.REACT_APP_API_URL}/api/outputs/${output.id}/thumbnail?size=512`
                       : '/placeholder.png' // You would need to add this placeholder image
                   }
+                  loading="lazy"
+                  onError={(e) => {
+                    // Outputs whose thumbnail can't be made show the placeholder instead
+                    if (!e.currentTarget.src.endsWith('/placeholder.png')) {
+                      e.currentTarget.src = '/placeholder.png';
+                    }
+                  }}
                   alt={output.filename}
                   sx={{ objectFit: 'cover' }}
                 />
@@ -1,4 +1,5 @@
 import React, { useState, useEffect, useRef } from 'react';
+import { useParams } from 'react-router-dom';
 import { useSocket } from '../contexts/SocketContext';
 import { useAuth } from '../contexts/AuthContext';
 import {
@@ -24,9 +25,12 @@ import NodeSelectionHighlight from '../components/NodeSelectionHighlight';
 
 function WorkflowEditorPage() {
   const { apiClient, currentUser } = useAuth();
+  const { workflowId } = useParams();
   const { 
     connected, 
     cursors, 
+    joinWorkflow,
+    leaveWorkflow,
     selectedNodes, 
     updateCursorPosition, 
     updateSelectedNodes, 
@@ -58,6 +62,15 @@ function WorkflowEditorPage() {
     return () => clearTimeout(timer);
   }, []);
   
+  // Join the collaboration room of the workflow being edited
+  useEffect(() => {
+    if (!connected || !workflowId) return;
+    
+    joinWorkflow(workflowId);
+    
+    return () => leaveWorkflow(workflowId);
+  }, [connected, workflowId, joinWorkflow, leaveWorkflow]);
+  
   // Track mouse movement for cursor position
   useEffect(() => {
     const handleMouseMove = (e) => {
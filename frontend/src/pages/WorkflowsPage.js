@@ -126,10 +126,12 @@ function WorkflowsPage() {
   // Handle duplicate workflow
   const handleDuplicateWorkflow = async (workflow) => {
     try {
+      // The list only has summaries; load the full graph to copy it
+      const { data: fullWorkflow } = await apiClient.get(`/api/workflows/${workflow.id}`);
       const response = await apiClient.post('/api/workflows', {
         name: `${workflow.name} (Copy)`,
         description: workflow.description,
-        workflow_json: workflow.workflow_json,
+        workflow_json: fullWorkflow.workflow_json,
       });
       
       setWorkflows((prevWorkflows) => [...prevWorkflows, response.data]);
@@ -151,8 +153,9 @@ function WorkflowsPage() {
   // Handle run workflow
   const handleRunWorkflow = async (workflow) => {
     try {
+      const { data: fullWorkflow } = await apiClient.get(`/api/workflows/${workflow.id}`);
       await apiClient.post('/api/comfyui/prompt', {
-        prompt: workflow.workflow_json,
+        prompt: fullWorkflow.workflow_json,
         workflow_id: workflow.id,
       });
       
@@ -242,6 +245,13 @@ function WorkflowsPage() {
                       <Chip
                         size="small"
                         label={`Updated: ${formatDate(workflow.updated_at)}`}
+                        sx={{ mr: 1, mb: 1 }}
+                      />
+                    )}
+                    {workflow.node_count != null && (
+                      <Chip
+                        size="small"
+                        label={`${workflow.node_count} nodes`}
                         sx={{ mb: 1 }}
                       />
                     )}
@@ -0,0 +1,117 @@
+// Minimal JSON Patch (RFC 6902) helpers used for collaborative workflow sync
+
+const escapeToken = (token) => String(token).replace(/~/g, '~0').replace(/\//g, '~1');
+
+const parsePointer = (pointer) => {
+  if (pointer === '') return [];
+  return pointer
+    .slice(1)
+    .split('/')
+    .map((token) => token.replace(/~1/g, '/').replace(/~0/g, '~'));
+};
+
+const isObject = (value) => value !== null && typeof value === 'object';
+
+const clone = (value) => (value === undefined ? value : JSON.parse(JSON.stringify(value)));
+
+// Create a patch that turns `source` into `target`
+export function createPatch(source, target, path = '') {
+  if (source === target) return [];
+
+  if (Array.isArray(source) && Array.isArray(target)) {
+    const ops = [];
+    const common = Math.min(source.length, target.length);
+    for (let i = 0; i < common; i += 1) {
+      ops.push(...createPatch(source[i], target[i], `${path}/${i}`));
+    }
+    for (let i = source.length - 1; i >= target.length; i -= 1) {
+      ops.push({ op: 'remove', path: `${path}/${i}` });
+    }
+    for (let i = source.length; i < target.length; i += 1) {
+      ops.push({ op: 'add', path: `${path}/-`, value: clone(target[i]) });
+    }
+    return ops;
+  }
+
+  if (isObject(source) && isObject(target) && !Array.isArray(source) && !Array.isArray(target)) {
+    const ops = [];
+    Object.keys(source).forEach((key) => {
+      if (!(key in target)) {
+        ops.push({ op: 'remove', path: `${path}/${escapeToken(key)}` });
+      }
+    });
+    Object.keys(target).forEach((key) => {
+      const childPath = `${path}/${escapeToken(key)}`;
+      if (!(key in source)) {
+        ops.push({ op: 'add', path: childPath, value: clone(target[key]) });
+      } else {
+        ops.push(...createPatch(source[key], target[key], childPath));
+      }
+    });
+    return ops;
+  }
+
+  if (JSON.stringify(source) === JSON.stringify(target)) return [];
+
+  return [{ op: 'replace', path, value: clone(target) }];
+}
+
+// Apply a patch to a copy of `document` and return the result
+export function applyPatch(document, ops) {
+  let root = clone(document);
+
+  ops.forEach((operation) => {
+    const tokens = parsePointer(operation.path);
+
+    const resolve = (pointerTokens) => pointerTokens.reduce((node, token) => node[token], root);
+
+    const add = (pointerTokens, value) => {
+      if (pointerTokens.length === 0) {
+        root = value;
+        return;
+      }
+      const parent = resolve(pointerTokens.slice(0, -1));
+      const key = pointerTokens[pointerTokens.length - 1];
+      if (Array.isArray(parent)) {
+        parent.splice(key === '-' ? parent.length : Number(key), 0, value);
+      } else {
+        parent[key] = value;
+      }
+    };
+
+    const remove = (pointerTokens) => {
+      const parent = resolve(pointerTokens.slice(0, -1));
+      const key = pointerTokens[pointerTokens.length - 1];
+      const value = parent[key];
+      if (Array.isArray(parent)) {
+        parent.splice(Number(key), 1);
+      } else {
+        delete parent[key];
+      }
+      return value;
+    };
+
+    switch (operation.op) {
+      case 'add':
+        add(tokens, clone(operation.value));
+        break;
+      case 'remove':
+        remove(tokens);
+        break;
+      case 'replace':
+        if (tokens.length > 0) remove(tokens);
+        add(tokens, clone(operation.value));
+        break;
+      case 'move':
+        add(tokens, remove(parsePointer(operation.from)));
+        break;
+      case 'copy':
+        add(tokens, clone(resolve(parsePointer(operation.from))));
+        break;
+      default:
+        break;
+    }
+  });
+
+  return root;
+}